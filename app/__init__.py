@@ -34,6 +34,12 @@ def create_app(config_class=Config):
     app.register_blueprint(admin_bp)
     app.register_blueprint(pages_bp)
 
+    from app.cli import register_commands
+    register_commands(app)
+
+    from app.services.indexer import indexer
+    indexer.init_app(app)
+
     # User loader
     from app.models.user import User
 
@@ -45,11 +51,34 @@ def create_app(config_class=Config):
     with app.app_context():
         from app.models import user, note, mistake_item, subject, tag, quiz, chat, quota, embedding  # noqa
         db.create_all()
+        _upgrade_schema()
         _seed_admin(app)
 
     return app
 
 
+def _upgrade_schema():
+    """
+    Add nullable columns and indexes introduced after a table was created —
+    create_all only creates missing tables.
+    """
+    inspector = db.inspect(db.engine)
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {c["name"] for c in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing or not column.nullable:
+                continue
+            col_type = column.type.compile(dialect=db.engine.dialect)
+            db.session.execute(db.text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {col_type}"))
+        existing_indexes = {i["name"] for i in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing_indexes:
+                index.create(db.session.connection())
+    db.session.commit()
+
+
 def _seed_admin(app):
     from app.models.user import User
     from app.models.quota import Quota
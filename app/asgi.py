@@ -0,0 +1,203 @@
+"""
+ASGI entry point: uvicorn app.asgi:app --workers 2
+
+Every request runs the Flask app in a thread pool, except the streaming
+replies of POST /api/chat/threads/<id>/messages and /regenerate. Those views
+do their usual checks (login, quota, history, RAG context) in the pool and
+then hand the prepared request back. The event loop relays the upstream
+stream on a shared httpx.AsyncClient, and only the reply checkpoints go back
+to the pool. A reply that takes a minute to generate then holds a coroutine,
+not a worker, so thousands of streams fit in one process.
+"""
+import asyncio
+import io
+import re
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import aclosing
+import httpx
+from app import create_app
+from app.routes.chat import STREAM_HANDOFF, _sse
+
+flask_app = create_app()
+
+_STREAM_PATH = re.compile(r"^/api/chat/threads/\d+/(messages|regenerate)$")
+_pool = ThreadPoolExecutor(max_workers=flask_app.config.get("ASGI_THREADS", 32), thread_name_prefix="asgi")
+_client = None
+
+
+def _get_client():
+    """Upstream client shared by all streams of this process (created on the running event loop)."""
+    global _client
+    if _client is None:
+        config = flask_app.config
+        connections = config.get("ASGI_UPSTREAM_CONNECTIONS", 1000)
+        _client = httpx.AsyncClient(
+            timeout=httpx.Timeout(config.get("HTTP_READ_TIMEOUT", 120), connect=config.get("HTTP_CONNECT_TIMEOUT", 5)),
+            limits=httpx.Limits(max_connections=connections, max_keepalive_connections=min(connections, 100)),
+        )
+    return _client
+
+
+async def _in_app(fn, *args):
+    """Run fn(*args) in the thread pool inside an app context (for database work)."""
+    def run():
+        with flask_app.app_context():
+            return fn(*args)
+    return await asyncio.get_running_loop().run_in_executor(_pool, run)
+
+
+def _build_environ(scope, body):
+    script_name = scope.get("root_path", "").encode("utf-8").decode("latin1")
+    path_info = scope["path"].encode("utf-8").decode("latin1")
+    if script_name and path_info.startswith(script_name):
+        path_info = path_info[len(script_name):]
+    server = scope.get("server") or ("localhost", 80)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": script_name,
+        "PATH_INFO": path_info,
+        "QUERY_STRING": scope["query_string"].decode("latin1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": f"HTTP/{scope['http_version']}",
+        "REMOTE_ADDR": (scope.get("client") or ("", 0))[0],
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    for name, value in scope.get("headers", []):
+        name = name.decode("latin1").upper().replace("-", "_")
+        if name not in ("CONTENT_LENGTH", "CONTENT_TYPE"):
+            name = f"HTTP_{name}"
+        value = value.decode("latin1")
+        environ[name] = f"{environ[name]},{value}" if name in environ else value
+    return environ
+
+
+def _call_flask(environ, loop, send):
+    """
+    Run one request through the Flask app in a pool thread, relaying the
+    response through the event loop. Returns the status and headers instead
+    of sending anything when the view handed its stream over.
+    """
+    started = {}
+
+    def start_response(status, headers, exc_info=None):
+        started["status"] = int(status.split(" ", 1)[0])
+        started["headers"] = [(k.lower().encode("latin1"), v.encode("latin1")) for k, v in headers]
+
+    def relay(message):
+        asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+    body = flask_app(environ, start_response)
+    try:
+        if environ.get(STREAM_HANDOFF):
+            return started
+        relay({"type": "http.response.start", **started})
+        for chunk in body:
+            if chunk:
+                relay({"type": "http.response.body", "body": chunk, "more_body": True})
+        relay({"type": "http.response.body", "body": b""})
+    finally:
+        if hasattr(body, "close"):
+            body.close()
+    return None
+
+
+async def _relay_chat_stream(plan, started, receive, send):
+    """Stream a handed-over chat reply from the upstream API to the client, checkpointing it like _stream_reply."""
+    recorder = plan["recorder"]
+    complete = False
+    saving = None
+    disconnected = asyncio.Event()
+
+    async def emit(data):
+        await send({"type": "http.response.body", "body": data.encode("utf-8"), "more_body": True})
+
+    async def relay():
+        nonlocal complete, saving
+        await emit(_sse({"context_tokens": plan["context_tokens"]}))
+        try:
+            stream = plan["service"].chat_completion_stream_async(_get_client(), plan["messages"], plan["model"])
+            async with aclosing(stream):  # Closes the upstream response here if the client disconnects
+                async for chunk in stream:
+                    await emit(_sse({"content": chunk}))
+                    # Checkpoints run alongside the stream, at most one at a time, so a slow database never stalls it
+                    if recorder.feed(chunk) and (saving is None or saving.done()):
+                        if saving is not None and saving.exception():
+                            raise saving.exception()
+                        saving = asyncio.ensure_future(_in_app(recorder.save, recorder.take()))
+            complete = True
+        except Exception as e:
+            await emit(_sse({"error": str(e)}))
+
+    async def watch_disconnect():
+        while (await receive())["type"] != "http.disconnect":
+            pass
+        disconnected.set()
+
+    # Flask's empty hand-off response carries Content-Length: 0
+    headers = [(k, v) for k, v in started["headers"] if k != b"content-length"]
+    await send({"type": "http.response.start", "status": started["status"], "headers": headers})
+
+    relay_task = asyncio.create_task(relay())
+    watch_task = asyncio.create_task(watch_disconnect())
+    try:
+        await asyncio.wait({relay_task, watch_task}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in (relay_task, watch_task):
+            task.cancel()
+        await asyncio.gather(relay_task, watch_task, return_exceptions=True)
+        if saving is not None:
+            await asyncio.gather(saving, return_exceptions=True)  # The final save must not race a checkpoint
+        await _in_app(recorder.finish, complete)
+
+    if not disconnected.is_set():
+        if recorder.message_id is not None:
+            await emit(_sse({"message_id": recorder.message_id, "status": recorder.status}))
+        await emit("data: [DONE]\n\n")
+        await send({"type": "http.response.body", "body": b""})
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            if _client is not None:
+                await _client.aclose()
+            _pool.shutdown(wait=False)
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        await _lifespan(receive, send)
+        return
+    if scope["type"] != "http":
+        return
+
+    body = bytearray()
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return
+        body.extend(message.get("body", b""))
+        if not message.get("more_body"):
+            break
+
+    environ = _build_environ(scope, bytes(body))
+    if scope["method"] == "POST" and _STREAM_PATH.match(scope["path"]):
+        environ[STREAM_HANDOFF] = {}
+
+    loop = asyncio.get_running_loop()
+    started = await loop.run_in_executor(_pool, _call_flask, environ, loop, send)
+    if started is not None:
+        await _relay_chat_stream(environ[STREAM_HANDOFF], started, receive, send)
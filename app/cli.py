@@ -0,0 +1,263 @@
+import json
+import os
+import signal
+import time
+from concurrent.futures import ProcessPoolExecutor
+import click
+import numpy as np
+from app.extensions import db
+from app.services.quantization import FORMATS
+
+
+def _hash_embed(task):
+    """Process-pool worker: embed texts with the hashing vectorizer."""
+    from app.services.vectorizer import HashingVectorizer
+
+    dim, texts = task
+    return HashingVectorizer(dim=dim).transform(texts)
+
+
+def _raise_interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+
+def _write_checkpoint(path, state):
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f)
+    os.replace(tmp, path)
+
+
+def register_commands(app):
+    @app.cli.command("ann-report")
+    @click.option("--user", "user_id", type=int, default=None, help="User whose notes to search (default: all users).")
+    @click.option("--k", default=8, show_default=True, help="Results per query for recall@k.")
+    @click.option("--probes", default="1,2,4,8,16", show_default=True, help="Comma-separated nprobe values.")
+    @click.option("--queries", "n_queries", default=100, show_default=True, help="Chunks sampled as queries.")
+    def ann_report(user_id, k, probes, n_queries):
+        """Report IVF recall and latency against exact search."""
+        from app.models.embedding import Embedding
+        from app.services.ann_index import recall_report
+        from app.services.embedding_service import generate_embeddings
+        from app.services.vector_index import get_user_index
+
+        index = get_user_index(user_id, dim=app.config.get("EMBEDDING_DIM", 384))
+        if not len(index):
+            raise click.ClickException("No embeddings to report on.")
+
+        rng = np.random.default_rng(0)
+        sample_ids = rng.choice(index.emb_ids, min(n_queries, len(index)), replace=False).tolist()
+        texts = [t for (t,) in db.session.query(Embedding.chunk_text).filter(Embedding.id.in_(sample_ids))]
+        report = recall_report(index, generate_embeddings(texts), k=k,
+                               nprobes=[int(p) for p in probes.split(",") if p.strip()])
+        click.echo(json.dumps(report, indent=2))
+
+    @app.cli.command("quantize-embeddings")
+    @click.option("--to", "fmt", type=click.Choice(FORMATS), required=True,
+                  help="Target vector_blob format.")
+    @click.option("--dry-run", is_flag=True, help="Only report memory use and ranking agreement.")
+    @click.option("--k", default=8, show_default=True, help="Top-k used for ranking agreement.")
+    @click.option("--queries", "n_queries", default=200, show_default=True, help="Chunks sampled as queries.")
+    @click.option("--batch-size", default=1000, show_default=True, help="Rows rewritten per commit.")
+    def quantize_embeddings(fmt, dry_run, k, n_queries, batch_size):
+        """Convert stored vectors to another format, reporting savings and ranking agreement."""
+        from app.models.embedding import Embedding
+        from app.models.note import Note
+        from app.services.embedding_service import generate_embeddings
+        from app.services.quantization import quantize, ranking_agreement, encode_vectors, blob_size
+        from app.services.vector_index import load_sql_vectors, bump_index_version
+
+        dim = app.config.get("EMBEDDING_DIM", 384)
+        emb_ids, _, dense = load_sql_vectors(None, dim, "float32")
+        if not len(emb_ids):
+            raise click.ClickException("No SQL-stored embeddings found.")
+        quantized = quantize(dense, fmt)
+
+        rng = np.random.default_rng(0)
+        sample_ids = rng.choice(emb_ids, min(n_queries, len(emb_ids)), replace=False).tolist()
+        texts = [t for (t,) in db.session.query(Embedding.chunk_text).filter(Embedding.id.in_(sample_ids))]
+        stored_before = db.session.query(db.func.sum(db.func.length(Embedding.vector_blob))).scalar() or 0
+
+        report = {
+            "rows": len(emb_ids),
+            "format": fmt,
+            "stored_bytes_before": int(stored_before),
+            "stored_bytes_after": sum(len(b) for b in encode_vectors(dense, fmt)) if fmt == "sparse"
+            else len(emb_ids) * blob_size(fmt, dim),
+            "memory_bytes_float32": int(dense.nbytes),
+            "memory_bytes_after": int(quantized.nbytes),
+            "ranking": ranking_agreement(dense, quantized, generate_embeddings(texts), k=k),
+        }
+        click.echo(json.dumps(report, indent=2))
+        if dry_run:
+            return
+
+        converted = 0
+        for start in range(0, len(emb_ids), batch_size):
+            ids = emb_ids[start:start + batch_size]
+            blobs = encode_vectors(dense[start:start + batch_size], fmt)
+            db.session.execute(db.update(Embedding), [
+                {"id": int(emb_id), "vector_blob": blob, "vector_format": fmt}
+                for emb_id, blob in zip(ids, blobs)
+            ])
+            db.session.commit()
+            converted += len(ids)
+            click.echo(f"Converted {converted}/{len(emb_ids)} rows", err=True)
+
+        for (user_id,) in db.session.query(Note.user_id).distinct():
+            bump_index_version(user_id)
+        db.session.commit()
+
+    @app.cli.command("mock-embeddings")
+    @click.option("--host", default="127.0.0.1", show_default=True)
+    @click.option("--port", default=8765, show_default=True)
+    @click.option("--latency-ms", default=0, show_default=True, help="Delay added to every request.")
+    def mock_embeddings(host, port, latency_ms):
+        """Serve a local OpenAI-compatible /v1/embeddings endpoint backed by the hashing vectorizer."""
+        from flask import Flask, request, jsonify
+        from werkzeug.serving import run_simple
+        from app.services.vectorizer import HashingVectorizer
+
+        default_dim = app.config.get("EMBEDDING_DIM", 384)
+        mock = Flask("mock_embeddings")
+
+        @mock.route("/v1/embeddings", methods=["POST"])
+        def embeddings():
+            data = request.get_json() or {}
+            texts = data.get("input", [])
+            if isinstance(texts, str):
+                texts = [texts]
+            if latency_ms:
+                time.sleep(latency_ms / 1000)
+            vectors = HashingVectorizer(dim=int(data.get("dimensions") or default_dim)).transform(texts)
+            click.echo(f"Embedded {len(texts)} texts", err=True)
+            return jsonify({
+                "object": "list",
+                "model": data.get("model", "mock"),
+                "data": [{"object": "embedding", "index": i, "embedding": v.tolist()} for i, v in enumerate(vectors)],
+                "usage": {"prompt_tokens": sum(len(t) for t in texts), "total_tokens": sum(len(t) for t in texts)},
+            })
+
+        click.echo(f"Mock embeddings at http://{host}:{port}/v1 (dim {default_dim})")
+        run_simple(host, port, mock, threaded=True)
+
+    @app.cli.command("reindex")
+    @click.option("--user", "user_id", type=int, default=None, help="Only this user's notes (default: all users).")
+    @click.option("--workers", default=min(4, os.cpu_count() or 1), show_default=True,
+                  help="Vectorizer processes (hashing provider only).")
+    @click.option("--batch-size", default=200, show_default=True, help="Notes swapped in per commit.")
+    @click.option("--checkpoint", "checkpoint_path", type=click.Path(dir_okay=False), default=None,
+                  help="Progress file used to resume (default: instance/reindex.json).")
+    @click.option("--stale-only", is_flag=True, help="Only notes with chunks from another embedding version.")
+    @click.option("--force", is_flag=True, help="Re-embed every chunk, even ones that are current.")
+    @click.option("--restart", is_flag=True, help="Ignore an existing checkpoint and start over.")
+    def reindex(user_id, workers, batch_size, checkpoint_path, stale_only, force, restart):
+        """Re-embed notes in batches, resumably, keeping old vectors searchable until each batch is swapped in."""
+        from app.models.embedding import Embedding
+        from app.models.note import Note
+        from app.services.embedding_providers import get_embedding_provider, HashingProvider
+        from app.services.embedding_service import plan_embeddings, texts_to_embed, apply_embeddings
+
+        provider = get_embedding_provider()
+        if checkpoint_path is None:
+            os.makedirs(app.instance_path, exist_ok=True)
+            checkpoint_path = os.path.join(app.instance_path, "reindex.json")
+        params = {"user_id": user_id, "stale_only": stale_only, "force": force, "version": provider.version}
+
+        state = {**params, "last_note_id": 0, "notes_done": 0, "chunks_done": 0}
+        if os.path.exists(checkpoint_path) and not restart:
+            with open(checkpoint_path, "r", encoding="utf-8") as f:
+                saved = json.load(f)
+            if any(saved.get(k) != v for k, v in params.items()):
+                raise click.ClickException(
+                    f"{checkpoint_path} belongs to a run with other options; use --restart to discard it.")
+            state = saved
+            click.echo(f"Resuming after note {state['last_note_id']} ({state['notes_done']} notes done)", err=True)
+
+        query = Note.query
+        if user_id is not None:
+            query = query.filter(Note.user_id == user_id)
+        if stale_only:
+            query = query.filter(Note.id.in_(
+                db.session.query(Embedding.note_id).filter(db.or_(
+                    Embedding.vector_version.is_(None), Embedding.vector_version != provider.version))
+            ))
+        total = query.filter(Note.id > state["last_note_id"]).count()
+        if not total:
+            click.echo("Nothing to re-index.", err=True)
+            if os.path.exists(checkpoint_path):
+                os.remove(checkpoint_path)
+            return
+
+        # Local hashing is CPU-bound and parallelizes; remote providers already batch over the network
+        pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 and isinstance(provider, HashingProvider) else None
+
+        def submit(texts):
+            if not texts:
+                return None
+            if pool is None:
+                return provider.embed(texts)
+            step = -(-len(texts) // workers)
+            return pool.map(_hash_embed, [(provider.dim, texts[i:i + step]) for i in range(0, len(texts), step)])
+
+        def collect(pending):
+            return pending if pending is None or isinstance(pending, np.ndarray) else np.vstack(list(pending))
+
+        def swap_in(batch):
+            notes, last_id, plans, pending = batch
+            vectors = collect(pending)
+            stats = apply_embeddings(notes, plans, vectors)
+            state["last_note_id"] = last_id
+            state["notes_done"] += len(notes)
+            state["chunks_done"] += sum(s["rebuilt"] for s in stats)
+            _write_checkpoint(checkpoint_path, state)
+
+            done = state["notes_done"] - start_done
+            rate = done / max(time.perf_counter() - started, 1e-9)
+            eta = (total - done) / rate if rate else 0
+            click.echo(f"{done}/{total} notes, {state['chunks_done']} chunks re-embedded — "
+                       f"{rate:.1f} notes/s, ETA {eta:.0f}s", err=True)
+
+        # Treat `kill` like Ctrl-C so the worker processes are shut down too
+        previous_sigterm = signal.signal(signal.SIGTERM, _raise_interrupt)
+        started, start_done = time.perf_counter(), state["notes_done"]
+        cursor = state["last_note_id"]
+        in_flight = None
+        try:
+            while True:
+                notes = query.filter(Note.id > cursor).order_by(Note.id).limit(batch_size).all()
+                if not notes:
+                    break
+                cursor = notes[-1].id
+                plans = plan_embeddings(notes, force=force)
+                # Embed this batch while the previous one is written
+                batch = (notes, cursor, plans, submit(texts_to_embed(plans)))
+                if in_flight is not None:
+                    swap_in(in_flight)
+                in_flight = batch
+            if in_flight is not None:
+                swap_in(in_flight)
+        except KeyboardInterrupt:
+            raise click.ClickException(f"Interrupted; run the same command again to resume from {checkpoint_path}.")
+        finally:
+            signal.signal(signal.SIGTERM, previous_sigterm)
+            if pool is not None:
+                pool.shutdown(cancel_futures=True)
+
+        os.remove(checkpoint_path)
+        click.echo(f"Re-indexed {state['notes_done']} notes ({state['chunks_done']} chunks).", err=True)
+
+    @app.cli.command("rebuild-note-graph")
+    @click.option("--user", "user_id", type=int, default=None, help="Only this user (default: all users).")
+    def rebuild_note_graph_command(user_id):
+        """Recompute note centroids and related-note edges from the stored vectors."""
+        from app.models.note import Note
+        from app.services.embedding_providers import get_embedding_provider
+        from app.services.note_graph import rebuild_note_graph
+
+        provider = get_embedding_provider()
+        user_ids = [user_id] if user_id is not None else [u for (u,) in db.session.query(Note.user_id).distinct()]
+        for uid in user_ids:
+            count = rebuild_note_graph(uid, provider)
+            db.session.commit()
+            click.echo(f"User {uid}: {count} notes in the graph", err=True)
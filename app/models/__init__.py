@@ -7,4 +7,4 @@ from app.models.tag import Tag  # noqa
 from app.models.quiz import QuizSession, QuizQuestion  # noqa
 from app.models.chat import ChatThread, ChatMessage  # noqa
 from app.models.quota import Quota  # noqa
-from app.models.embedding import Embedding  # noqa
+from app.models.embedding import Embedding, IndexState, Posting, EmbeddingCacheEntry, NoteCentroid, NoteNeighbor  # noqa
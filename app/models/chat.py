@@ -8,6 +8,8 @@ class ChatThread(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False, index=True)
     title = db.Column(db.String(200), default="New Chat")
+    summary = db.Column(db.Text, nullable=True)  # Rolling summary of messages up to summary_upto_id
+    summary_upto_id = db.Column(db.Integer, nullable=True)
     created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
 
     messages = db.relationship("ChatMessage", backref="thread", lazy="select", cascade="all, delete-orphan",
@@ -31,6 +33,7 @@ class ChatMessage(db.Model):
     thread_id = db.Column(db.Integer, db.ForeignKey("chat_threads.id"), nullable=False, index=True)
     role = db.Column(db.String(20), nullable=False)  # "user" / "assistant" / "system"
     content = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String(20), nullable=True, default="complete")  # "complete" / "partial" (interrupted stream)
     created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
 
     def to_dict(self):
@@ -38,5 +41,6 @@ class ChatMessage(db.Model):
             "id": self.id,
             "role": self.role,
             "content": self.content,
+            "status": self.status or "complete",
             "created_at": self.created_at.isoformat() if self.created_at else None,
         }
@@ -1,3 +1,4 @@
+from datetime import datetime, timezone
 from app.extensions import db
 
 
@@ -8,3 +9,62 @@ class Embedding(db.Model):
     note_id = db.Column(db.Integer, db.ForeignKey("notes.id"), nullable=False, index=True)
     chunk_text = db.Column(db.Text, nullable=False)
     vector_blob = db.Column(db.LargeBinary, nullable=False)  # numpy array as bytes
+    vector_version = db.Column(db.String(32), nullable=True)  # Vectorizer version that produced vector_blob
+    vector_format = db.Column(db.String(8), nullable=True)  # float32 (NULL) / float16 / int8, see quantization
+    term_count = db.Column(db.Integer, nullable=True)  # BM25 document length; NULL until indexed
+
+
+class IndexState(db.Model):
+    """Per-user embedding index version, bumped whenever that user's embeddings change."""
+    __tablename__ = "embedding_index_state"
+
+    user_id = db.Column(db.Integer, db.ForeignKey("users.id"), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    bm25_docs = db.Column(db.Integer, nullable=True, default=0)   # Indexed chunks
+    bm25_terms = db.Column(db.Integer, nullable=True, default=0)  # Sum of their term counts
+
+
+class Posting(db.Model):
+    """BM25 inverted index entry: how often a term occurs in one chunk."""
+    __tablename__ = "chunk_postings"
+
+    user_id = db.Column(db.Integer, db.ForeignKey("users.id"), primary_key=True)
+    term = db.Column(db.String(32), primary_key=True)
+    embedding_id = db.Column(db.Integer, db.ForeignKey("embeddings.id"), primary_key=True)
+    tf = db.Column(db.Integer, nullable=False)
+    doc_len = db.Column(db.Integer, nullable=True)  # The chunk's term_count, so scoring needs no join; NULL in old rows
+
+    # Unindexing deletes by embedding_id, which the (user_id, term, ...) primary key can't serve.
+    # Without a rowid, SQLite stores postings in primary key order, so a term's list is read in one scan
+    # (a table created before this keeps its rowid and just reads a little slower)
+    __table_args__ = (db.Index("ix_chunk_postings_embedding_id", "embedding_id"), {"sqlite_with_rowid": False})
+
+
+class EmbeddingCacheEntry(db.Model):
+    """Vector computed by a remote embedding provider, keyed by the text's content hash."""
+    __tablename__ = "embedding_cache"
+
+    provider = db.Column(db.String(32), primary_key=True)
+    model = db.Column(db.String(128), primary_key=True)
+    text_hash = db.Column(db.String(64), primary_key=True)  # sha256 of the chunk text
+    vector_blob = db.Column(db.LargeBinary, nullable=False)  # float32
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+
+
+class NoteCentroid(db.Model):
+    """Mean of a note's chunk vectors, unit-normalized — the note's position in the related-notes graph."""
+    __tablename__ = "note_centroids"
+
+    note_id = db.Column(db.Integer, db.ForeignKey("notes.id"), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False, index=True)
+    vector_blob = db.Column(db.LargeBinary, nullable=False)  # float32
+
+
+class NoteNeighbor(db.Model):
+    """Directed kNN edge: neighbor_id is one of note_id's most similar notes."""
+    __tablename__ = "note_neighbors"
+
+    note_id = db.Column(db.Integer, db.ForeignKey("notes.id"), primary_key=True)
+    neighbor_id = db.Column(db.Integer, db.ForeignKey("notes.id"), primary_key=True, index=True)
+    user_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False, index=True)
+    similarity = db.Column(db.Float, nullable=False)
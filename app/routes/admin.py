@@ -4,6 +4,16 @@ from app.extensions import db
 from app.models.user import User
 from app.models.quota import Quota
 from app.middleware.quota_middleware import admin_required
+from app.services.vector_index import index_cache_stats
+from app.services.embedding_service import retrieve_relevant_chunks, retrieval_cache_stats
+from app.services.indexer import indexer
+from app.services.embedding_providers import embedding_provider_stats
+from app.services.http_client import http_client_stats
+from app.services.llm_cache import llm_cache_stats
+from app.services.single_flight import single_flight_stats
+from app.services.resilience import resilience_stats
+from app.services.rate_limiter import rate_limiter_stats
+from app.utils.crypto import api_key_cache_stats
 
 admin_bp = Blueprint("admin", __name__, url_prefix="/admin")
 
@@ -56,3 +66,34 @@ def update_quota(user_id):
 
     db.session.commit()
     return jsonify({"message": "Quota updated", "quota": quota.to_dict(hide_max=False)})
+
+
+@admin_bp.route("/search", methods=["GET"])
+@login_required
+@admin_required
+def search_all_notes():
+    """Search chunks across every user's notes."""
+    query = request.args.get("q", "").strip()
+    if not query:
+        return jsonify({"error": "Query is required"}), 400
+    top_k = min(request.args.get("k", 20, type=int), 100)
+    return jsonify({"results": retrieve_relevant_chunks(query, None, top_k=top_k)})
+
+
+@admin_bp.route("/metrics", methods=["GET"])
+@login_required
+@admin_required
+def metrics():
+    """Per-worker cache and service counters."""
+    return jsonify({
+        "vector_index_cache": index_cache_stats(),
+        "retrieval_cache": retrieval_cache_stats(),
+        "embedding_indexer": indexer.stats(),
+        "embedding_provider": embedding_provider_stats(),
+        "http_client": http_client_stats(),
+        "api_key_cache": api_key_cache_stats(),
+        "llm_cache": llm_cache_stats(),
+        "single_flight": single_flight_stats(),
+        "llm_resilience": resilience_stats(),
+        "llm_rate_limiter": rate_limiter_stats(),
+    })
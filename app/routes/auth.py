@@ -3,7 +3,7 @@ from flask_login import login_user, logout_user, login_required, current_user
 from app.extensions import db
 from app.models.user import User
 from app.models.quota import Quota
-from app.utils.crypto import encrypt_api_key
+from app.utils.crypto import encrypt_api_key, forget_user_api_key
 from app.services.quota_service import get_remaining, get_warnings
 from flask import current_app
 
@@ -99,6 +99,7 @@ def update_api_key():
     data = request.get_json()
     key = data.get("api_key", "").strip()
 
+    forget_user_api_key(current_user)
     if key:
         current_user.openrouter_api_key_enc = encrypt_api_key(key)
     else:
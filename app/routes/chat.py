@@ -6,40 +6,107 @@ from app.models.chat import ChatThread, ChatMessage
 from app.models.note import Note
 from app.middleware.quota_middleware import require_quota
 from app.services.openrouter import OpenRouterService
-from app.services.embedding_service import retrieve_relevant_chunks
+from app.services.embedding_service import retrieve_relevant_chunks, chunk_vectors
+from app.services.context_packer import pack_context
+from app.services.chat_history import build_history, invalidate_summary
+from app.services.stream_recorder import StreamRecorder
 
 chat_bp = Blueprint("chat", __name__, url_prefix="/api/chat")
 
+# WSGI environ key app.asgi sets on streaming chat requests; the view fills it instead of streaming
+STREAM_HANDOFF = "chat.stream_handoff"
 
-def _build_context_messages(thread, note_ids=None, user_message=None):
-    """Build message list with optional RAG context."""
+
+def _build_context_messages(thread, note_ids=None, user_message=None, model=None, service=None):
+    """
+    Build message list with optional RAG context, the thread summary and the recent history.
+    service is used to fold older turns into the summary (see chat_history.build_history).
+
+    Returns:
+        (messages, context_tokens) — estimated tokens of the packed note context
+    """
     messages = []
+    context_tokens = 0
 
     # System message with note context
     system_content = "You are a helpful study assistant for a Chinese student. Help them understand their homework/exam mistakes and improve. Respond in the same language as the user's message."
 
     # RAG: retrieve relevant context
     if user_message:
+        top_k = current_app.config.get("RAG_CANDIDATES", 24)
         if note_ids:
             # User selected specific notes — restrict retrieval to those
-            chunks = retrieve_relevant_chunks(user_message, current_user.id, note_ids=note_ids, top_k=8)
+            chunks = retrieve_relevant_chunks(user_message, current_user.id, note_ids=note_ids, top_k=top_k)
         else:
             # AUTO mode — search all user notes
-            chunks = retrieve_relevant_chunks(user_message, current_user.id, top_k=8)
+            chunks = retrieve_relevant_chunks(user_message, current_user.id, top_k=top_k)
 
         if chunks:
-            context_text = "\n\n---\n\n".join([
-                f"[Note #{c['note_id']}] {c['chunk_text']}" for c in chunks
-            ])
+            # Diversify and fit the candidates into the token budget
+            context_text, context_tokens, _ = pack_context(
+                chunks,
+                chunk_vectors(current_user.id, [c["embedding_id"] for c in chunks]),
+                budget=current_app.config.get("RAG_CONTEXT_TOKEN_BUDGET", 1200),
+                mmr_lambda=current_app.config.get("RAG_MMR_LAMBDA", 0.7),
+            )
             system_content += f"\n\nRelevant study notes for context:\n{context_text}"
 
+    # Conversation history: summary of older turns plus the recent ones verbatim
+    summary, history = build_history(thread, model=model, service=service)
+    if summary:
+        system_content += f"\n\nSummary of the earlier conversation:\n{summary}"
+
     messages.append({"role": "system", "content": system_content})
+    messages.extend(history)
+
+    return messages, context_tokens
 
-    # Add conversation history
-    for msg in thread.messages:
-        messages.append({"role": msg.role, "content": msg.content})
 
-    return messages
+def _sse(data):
+    return f"data: {json.dumps(data)}\n\n"
+
+
+def _stream_reply(service, messages, model, recorder):
+    """
+    Relay the model's reply as SSE events while checkpointing it to the
+    thread. The saved message stays "partial" if the upstream fails or the
+    client disconnects before the end.
+    """
+    complete = False
+    try:
+        try:
+            for chunk in service.chat_completion_stream(messages, model=model):
+                recorder.append(chunk)
+                yield _sse({"content": chunk})
+            complete = True
+        except Exception as e:
+            yield _sse({"error": str(e)})
+    finally:
+        # Also runs on GeneratorExit when the client goes away mid-stream
+        recorder.finish(complete=complete)
+
+    if recorder.message_id is not None:
+        yield _sse({"message_id": recorder.message_id, "status": recorder.status})
+    yield "data: [DONE]\n\n"
+
+
+def _stream_response(service, messages, model, thread_id, context_tokens):
+    """SSE response for a chat reply, or a hand-off to the async relay when served by app.asgi."""
+    recorder = StreamRecorder(thread_id)
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+    handoff = request.environ.get(STREAM_HANDOFF)
+    if handoff is not None:
+        # app.asgi streams from its event loop instead of holding this thread for the whole reply
+        handoff.update(service=service, messages=messages, model=model, recorder=recorder,
+                       context_tokens=context_tokens)
+        return Response(mimetype="text/event-stream", headers=headers)
+
+    def generate():
+        yield _sse({"context_tokens": context_tokens})
+        yield from _stream_reply(service, messages, model, recorder)
+
+    return Response(stream_with_context(generate()), mimetype="text/event-stream", headers=headers)
 
 
 @chat_bp.route("/threads", methods=["GET"])
@@ -111,32 +178,12 @@ def send_message(thread_id):
         db.session.commit()
 
     # Build messages with RAG context
-    messages = _build_context_messages(thread, note_ids=note_ids or None, user_message=content)
+    messages, context_tokens = _build_context_messages(
+        thread, note_ids=note_ids or None, user_message=content, model=model, service=service
+    )
 
     if stream:
-        def generate():
-            full_response = ""
-            try:
-                for chunk in service.chat_completion_stream(messages, model=model):
-                    full_response += chunk
-                    yield f"data: {json.dumps({'content': chunk})}\n\n"
-            except Exception as e:
-                yield f"data: {json.dumps({'error': str(e)})}\n\n"
-
-            # Save assistant message
-            if full_response:
-                with current_app.app_context():
-                    assistant_msg = ChatMessage(thread_id=thread.id, role="assistant", content=full_response)
-                    db.session.add(assistant_msg)
-                    db.session.commit()
-
-            yield "data: [DONE]\n\n"
-
-        return Response(
-            stream_with_context(generate()),
-            mimetype="text/event-stream",
-            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
-        )
+        return _stream_response(service, messages, model, thread.id, context_tokens)
     else:
         # Non-streaming
         try:
@@ -144,7 +191,7 @@ def send_message(thread_id):
             assistant_msg = ChatMessage(thread_id=thread.id, role="assistant", content=response)
             db.session.add(assistant_msg)
             db.session.commit()
-            return jsonify(assistant_msg.to_dict())
+            return jsonify({**assistant_msg.to_dict(), "context_tokens": context_tokens})
         except Exception as e:
             return jsonify({"error": str(e)}), 500
 
@@ -167,6 +214,7 @@ def edit_message(thread_id, msg_id):
         ChatMessage.created_at > msg.created_at
     ).delete()
 
+    invalidate_summary(thread, msg.id)
     msg.content = new_content
     db.session.commit()
 
@@ -186,6 +234,7 @@ def regenerate_response(thread_id):
     ).order_by(ChatMessage.created_at.desc()).first()
 
     if last_assistant:
+        invalidate_summary(thread, last_assistant.id)
         db.session.delete(last_assistant)
         db.session.commit()
 
@@ -203,31 +252,12 @@ def regenerate_response(thread_id):
     if not model or model not in available:
         model = available[0] if available else current_app.config["DEFAULT_CHAT_MODEL"]
 
-    messages = _build_context_messages(
+    messages, context_tokens = _build_context_messages(
         thread,
         note_ids=note_ids or None,
-        user_message=last_user.content if last_user else ""
+        user_message=last_user.content if last_user else "",
+        model=model,
+        service=service,
     )
 
-    def generate():
-        full_response = ""
-        try:
-            for chunk in service.chat_completion_stream(messages, model=model):
-                full_response += chunk
-                yield f"data: {json.dumps({'content': chunk})}\n\n"
-        except Exception as e:
-            yield f"data: {json.dumps({'error': str(e)})}\n\n"
-
-        if full_response:
-            with current_app.app_context():
-                assistant_msg = ChatMessage(thread_id=thread.id, role="assistant", content=full_response)
-                db.session.add(assistant_msg)
-                db.session.commit()
-
-        yield "data: [DONE]\n\n"
-
-    return Response(
-        stream_with_context(generate()),
-        mimetype="text/event-stream",
-        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
-    )
+    return _stream_response(service, messages, model, thread.id, context_tokens)
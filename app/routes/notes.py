@@ -7,7 +7,9 @@ from app.models.note import Note, note_tags
 from app.models.mistake_item import MistakeItem
 from app.models.subject import Subject
 from app.models.tag import Tag
-from app.services.embedding_service import store_embeddings_for_note
+from app.services.embedding_service import delete_embeddings_for_note
+from app.services.indexer import indexer
+from app.services.note_graph import related_notes
 
 notes_bp = Blueprint("notes", __name__, url_prefix="/api")
 
@@ -122,11 +124,8 @@ def create_note():
 
     db.session.commit()
 
-    # Generate embeddings
-    try:
-        store_embeddings_for_note(note)
-    except Exception:
-        pass  # Non-critical
+    # Generate embeddings in the background
+    indexer.note_changed(note.id)
 
     return jsonify(note.to_dict()), 201
 
@@ -138,6 +137,27 @@ def get_note(note_id):
     return jsonify(note.to_dict())
 
 
+@notes_bp.route("/notes/<int:note_id>/related", methods=["GET"])
+@login_required
+def get_related_notes(note_id):
+    """Earlier mistakes most similar to this note, from the precomputed neighbour graph."""
+    note = Note.query.filter_by(id=note_id, user_id=current_user.id).first_or_404()
+    limit = min(request.args.get("limit", 5, type=int), 50)
+    return jsonify({
+        "note_id": note.id,
+        "related": [
+            {
+                "id": n.id,
+                "title": n.title,
+                "subject": n.subject.name if n.subject else None,
+                "status": n.status,
+                "similarity": round(similarity, 4),
+            }
+            for n, similarity in related_notes(note.id, limit)
+        ],
+    })
+
+
 @notes_bp.route("/notes/<int:note_id>", methods=["PUT"])
 @login_required
 def update_note(note_id):
@@ -181,11 +201,8 @@ def update_note(note_id):
     note.updated_at = datetime.now(timezone.utc)
     db.session.commit()
 
-    # Refresh embeddings
-    try:
-        store_embeddings_for_note(note)
-    except Exception:
-        pass
+    # Refresh embeddings in the background
+    indexer.note_changed(note.id)
 
     return jsonify(note.to_dict())
 
@@ -194,6 +211,7 @@ def update_note(note_id):
 @login_required
 def delete_note(note_id):
     note = Note.query.filter_by(id=note_id, user_id=current_user.id).first_or_404()
+    delete_embeddings_for_note(note)
     db.session.delete(note)
     db.session.commit()
     return jsonify({"message": "Note deleted"})
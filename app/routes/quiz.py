@@ -147,7 +147,7 @@ RESPOND WITH VALID JSON ONLY:
 """
     try:
         messages = [{"role": "user", "content": prompt}]
-        response = service.chat_completion(messages, temperature=0.1, max_tokens=500)
+        response = service.chat_completion(messages, temperature=0.1, max_tokens=500, cache=True)
         response = response.strip()
         if response.startswith("```"):
             lines = response.split("\n")
@@ -0,0 +1,145 @@
+import time
+import numpy as np
+from app.utils.lru import LRUCache
+
+# Trained centroids per corpus, reused across index rebuilds so a write only costs one assignment pass
+_trained = LRUCache(1024)
+
+_BLOCK_BYTES = 64 * 1024 * 1024  # Dense float32 working set per assignment block
+
+
+class IVFIndex:
+    """
+    Inverted-file ANN index: rows are grouped into k-means cells and a query
+    only scans the rows of the nprobe cells whose centroids are closest.
+    """
+
+    def __init__(self, centroids, assignments):
+        self.centroids = centroids
+        order = np.argsort(assignments, kind="stable")
+        counts = np.bincount(assignments, minlength=len(centroids))
+        self._order = order
+        self._offsets = np.concatenate([[0], np.cumsum(counts)])
+
+    @property
+    def n_cells(self):
+        return len(self.centroids)
+
+    def candidates(self, query_vec, nprobe):
+        """Row indices in the nprobe cells nearest to the query."""
+        nprobe = max(1, min(nprobe, self.n_cells))
+        cell_scores = self.centroids @ query_vec
+        cells = np.argpartition(-cell_scores, nprobe - 1)[:nprobe]
+        return np.concatenate([self._order[self._offsets[c]:self._offsets[c + 1]] for c in cells])
+
+
+def _assign(matrix, centroids):
+    """Nearest centroid (max inner product) for every row, computed in blocks to bound memory."""
+    out = np.empty(len(matrix), dtype=np.int64)
+    block_rows = max(256, _BLOCK_BYTES // (4 * matrix.shape[1]))
+    for start in range(0, len(matrix), block_rows):
+        block = np.asarray(matrix[start:start + block_rows], dtype=np.float32)
+        out[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+    return out
+
+
+def train_centroids(matrix, n_cells, iterations=10, sample_per_cell=64, seed=0):
+    """Spherical k-means on a row sample. Returns unit-normalized (n_cells, dim) centroids."""
+    rng = np.random.default_rng(seed)
+    n = len(matrix)
+    # Bounded in bytes too, since sparse matrices of large dimension are densified here
+    sample_size = min(n, n_cells * sample_per_cell, max(n_cells, _BLOCK_BYTES // (4 * matrix.shape[1])))
+    sample = np.asarray(matrix[np.sort(rng.choice(n, sample_size, replace=False))], dtype=np.float32)
+    centroids = sample[rng.choice(sample_size, n_cells, replace=False)].copy()
+
+    for _ in range(iterations):
+        labels = np.argmax(sample @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, sample)
+        empty = np.bincount(labels, minlength=n_cells) == 0
+        # Re-seed empty cells from random sample rows
+        sums[empty] = sample[rng.choice(sample_size, int(empty.sum()))]
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        centroids = np.divide(sums, norms, out=np.zeros_like(sums), where=norms > 0)
+    return centroids
+
+
+def build_ivf(index, n_cells=None):
+    """
+    Build an IVFIndex for a VectorIndex, reusing previously trained centroids
+    for the same corpus unless it has since more than doubled in size.
+    """
+    n = len(index)
+    dim = index.matrix.shape[1]
+    n_cells = min(n_cells or max(1, int(np.sqrt(n))), n)
+    trained = _trained.get(index.user_id)
+    if trained is None or trained[0].shape[1] != dim or n > 2 * trained[1] or len(trained[0]) > n:
+        trained = (train_centroids(index.matrix, n_cells), n)
+        _trained.put(index.user_id, trained)
+    return IVFIndex(trained[0], _assign(index.matrix, trained[0]))
+
+
+def get_ivf(index, n_cells=None):
+    """The VectorIndex's IVF index, built on first use and kept for the life of the snapshot."""
+    if index.ann is None:
+        index.ann = build_ivf(index, n_cells)
+    return index.ann
+
+
+def _exact_top_k(matrix, query_vec, k):
+    scores = matrix @ query_vec
+    k = min(k, len(scores))
+    return set(np.argpartition(-scores, k - 1)[:k].tolist())
+
+
+def recall_report(index, queries, k=8, nprobes=(1, 2, 4, 8, 16)):
+    """
+    Compare IVF search against exact brute-force search on the same queries.
+
+    Args:
+        index: VectorIndex to search
+        queries: (n_queries, dim) float32 query vectors
+        k: result count for recall@k
+        nprobes: probe counts to evaluate
+
+    Returns:
+        dict with corpus size, cell count, exact latency and per-nprobe recall/latency/scan fraction
+    """
+    ivf = get_ivf(index)
+
+    def pct(samples, p):
+        return round(float(np.percentile(samples, p)) * 1000, 3)
+
+    exact, exact_times = [], []
+    for q in queries:
+        t0 = time.perf_counter()
+        exact.append(_exact_top_k(index.matrix, q, k))
+        exact_times.append(time.perf_counter() - t0)
+
+    report = {
+        "rows": len(index),
+        "cells": ivf.n_cells,
+        "k": k,
+        "queries": len(queries),
+        "exact": {"p50_ms": pct(exact_times, 50), "p95_ms": pct(exact_times, 95)},
+        "ivf": [],
+    }
+    for nprobe in nprobes:
+        hits, times, scanned = 0, [], 0
+        for q, truth in zip(queries, exact):
+            t0 = time.perf_counter()
+            rows = ivf.candidates(q, nprobe)
+            scores = index.matrix[rows] @ q
+            kk = min(k, len(rows))
+            found = set(rows[np.argpartition(-scores, kk - 1)[:kk]].tolist()) if kk else set()
+            times.append(time.perf_counter() - t0)
+            hits += len(found & truth)
+            scanned += len(rows)
+        report["ivf"].append({
+            "nprobe": nprobe,
+            "recall_at_k": round(hits / max(1, sum(len(t) for t in exact)), 4),
+            "p50_ms": pct(times, 50),
+            "p95_ms": pct(times, 95),
+            "scanned_fraction": round(scanned / max(1, len(queries) * len(index)), 4),
+        })
+    return report
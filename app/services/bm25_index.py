@@ -0,0 +1,143 @@
+from collections import Counter
+import numpy as np
+from app.extensions import db
+from app.models.embedding import Embedding, IndexState, Posting
+from app.services.vectorizer import WORD_RE, is_cjk, to_codepoints
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+MAX_TERM_LENGTH = 32
+# Query terms in more than this share of the chunks are skipped: their IDF is near zero,
+# and their posting lists are the longest ones to read
+BM25_MAX_DF_RATIO = 0.1
+BM25_MIN_DF_CUTOFF = 50  # Small corpora keep every term
+
+
+def tokenize(text):
+    """
+    BM25 terms: CJK character bigrams, plus whole Latin/Greek/Cyrillic words.
+    "二次方程" → 二次 次方 方程. A lone CJK character is kept as a unigram;
+    unigrams inside longer runs are not indexed, since common characters
+    occur in nearly every chunk.
+    """
+    text = text.lower()
+    terms = []
+    codes = to_codepoints(text)
+    cjk = is_cjk(codes)
+    run = []
+    for ch, flag in zip(text, cjk):
+        if flag:
+            run.append(ch)
+            continue
+        if run:
+            terms.extend(_cjk_terms(run))
+            run = []
+    if run:
+        terms.extend(_cjk_terms(run))
+    terms.extend(w[:MAX_TERM_LENGTH] for w in WORD_RE.findall(text))
+    return terms
+
+
+def _cjk_terms(run):
+    if len(run) == 1:
+        return run
+    return [run[i] + run[i + 1] for i in range(len(run) - 1)]
+
+
+def _doc_freq_statement(per_user):
+    matches = db.select(Posting.embedding_id).where(Posting.term == db.bindparam("term"))
+    if per_user:
+        matches = matches.where(Posting.user_id == db.bindparam("user_id"))
+    return db.select(db.func.count()).select_from(matches.limit(db.bindparam("limit")).subquery())
+
+
+# Built once: a term's document frequency, counted no further than :limit in the (user_id, term) index
+_DOC_FREQ = {True: _doc_freq_statement(True), False: _doc_freq_statement(False)}
+
+
+def _adjust_stats(user_id, docs, terms):
+    coalesce = db.func.coalesce
+    updated = db.session.query(IndexState).filter_by(user_id=user_id).update({
+        IndexState.bm25_docs: coalesce(IndexState.bm25_docs, 0) + docs,
+        IndexState.bm25_terms: coalesce(IndexState.bm25_terms, 0) + terms,
+    }, synchronize_session=False)
+    if not updated:
+        db.session.add(IndexState(user_id=user_id, version=0, bm25_docs=docs, bm25_terms=terms))
+        db.session.flush()
+
+
+def index_chunks(user_id, embeddings):
+    """Add postings for flushed Embedding rows and record their term counts. Caller commits."""
+    rows = []
+    total_terms = 0
+    for emb in embeddings:
+        counts = Counter(tokenize(emb.chunk_text))
+        emb.term_count = sum(counts.values())
+        total_terms += emb.term_count
+        rows.extend({"user_id": user_id, "term": term, "embedding_id": emb.id, "tf": tf, "doc_len": emb.term_count}
+                    for term, tf in counts.items())
+    if rows:
+        db.session.execute(db.insert(Posting), rows)
+    if embeddings:
+        _adjust_stats(user_id, len(embeddings), total_terms)
+
+
+def unindex_chunks(user_id, emb_ids):
+    """Drop postings for the given embeddings. Call before the Embedding rows are deleted."""
+    if not emb_ids:
+        return
+    docs, terms = db.session.query(db.func.count(Embedding.id), db.func.coalesce(db.func.sum(Embedding.term_count), 0)) \
+        .filter(Embedding.id.in_(emb_ids), Embedding.term_count.isnot(None)).one()
+    # Embedding ids are unique across users; filtering on user_id too would steer SQLite to the primary key
+    Posting.query.filter(Posting.embedding_id.in_(emb_ids)).delete(synchronize_session=False)
+    if docs:
+        _adjust_stats(user_id, -docs, -terms)
+
+
+def bm25_scores(user_id, query):
+    """
+    Score the user's chunks (every user's when user_id is None) against a query,
+    reading only the postings of its selective terms (see BM25_MAX_DF_RATIO).
+
+    Returns:
+        (embedding_ids, scores) numpy arrays covering every chunk with at least one scored query term
+    """
+    empty = np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+    terms = list(dict.fromkeys(tokenize(query)))
+    stats = db.session.query(db.func.sum(IndexState.bm25_docs), db.func.sum(IndexState.bm25_terms))
+    if user_id is not None:
+        stats = stats.filter(IndexState.user_id == user_id)
+    n_docs, n_terms = stats.one()
+    if not terms or not n_docs or n_docs <= 0:
+        return empty
+    avg_len = max((n_terms or 0) / n_docs, 1.0)
+
+    max_df = int(max(BM25_MAX_DF_RATIO * n_docs, BM25_MIN_DF_CUTOFF))
+    doc_freq = {}
+    for term in terms:
+        count = db.session.execute(_DOC_FREQ[user_id is not None],
+                                   {"term": term, "user_id": user_id, "limit": max_df + 1}).scalar()
+        if 0 < count <= max_df:
+            doc_freq[term] = count
+    if not doc_freq:
+        return empty
+
+    postings = db.select(Posting.term, Posting.embedding_id, Posting.tf, Posting.doc_len) \
+        .where(Posting.term.in_(list(doc_freq)))
+    if user_id is not None:
+        postings = postings.where(Posting.user_id == user_id)
+    postings = db.session.execute(postings).all()
+    if not postings:
+        return empty
+
+    posting_terms, emb_ids, tf, lengths = zip(*postings)
+    vocab = sorted(doc_freq)
+    df = np.array([doc_freq[term] for term in vocab], dtype=np.float64)
+    idf = np.log1p((n_docs - df + 0.5) / (df + 0.5))[np.searchsorted(np.array(vocab), np.array(posting_terms))]
+    tf = np.array(tf, dtype=np.float64)
+    lengths = np.array(lengths, dtype=np.float64)  # None (rows indexed before doc_len) becomes nan
+    lengths[np.isnan(lengths)] = avg_len
+    contributions = idf * tf * (BM25_K1 + 1) / (tf + BM25_K1 * (1 - BM25_B + BM25_B * lengths / avg_len))
+
+    ids, rows = np.unique(np.array(emb_ids, dtype=np.int64), return_inverse=True)
+    return ids, np.bincount(rows, weights=contributions).astype(np.float32)
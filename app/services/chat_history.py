@@ -0,0 +1,158 @@
+"""
+Chat history windowing with a rolling summary.
+
+The newest turns are sent word for word; everything older is folded into a
+summary stored on the ChatThread (summary, summary_upto_id). Folding happens
+in batches of CHAT_SUMMARY_BATCH_TURNS turns, so the summary is regenerated
+only when the window has moved that far, and each regeneration sends just the
+previous summary plus the newly evicted messages. Folds run in a background
+thread, so a reply never waits on the summary call.
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+from app.extensions import db
+from app.services.context_packer import estimate_tokens
+
+_SUMMARY_THREADS = 2
+_pool = None
+_pool_pid = None
+_folding = set()  # Thread ids with a fold queued or running
+_lock = threading.Lock()
+
+SUMMARY_PROMPT = (
+    "You maintain a running summary of a tutoring conversation between a student and a study assistant. "
+    "Update the summary with the new messages. Keep the student's questions, the mistakes and concepts "
+    "discussed, and any conclusions or open issues. Be concise, use bullet points, and write in the "
+    "language of the conversation. Reply with the summary only."
+)
+
+
+def history_budget(model):
+    """Token budget for verbatim history plus summary for the given chat model."""
+    budgets = current_app.config.get("CHAT_HISTORY_TOKEN_BUDGETS", {})
+    return budgets.get(model, current_app.config.get("CHAT_HISTORY_TOKEN_BUDGET", 8000))
+
+
+def _window_start(messages, budget, keep_turns):
+    """Index of the first message kept verbatim: the last keep_turns user turns, shrunk to fit the budget."""
+    start = len(messages)
+    turns = 0
+    used = 0
+    for i in range(len(messages) - 1, -1, -1):
+        cost = estimate_tokens(messages[i].content)
+        if start < len(messages) and used + cost > budget:
+            break
+        used += cost
+        start = i
+        if messages[i].role == "user":
+            turns += 1
+            if turns >= keep_turns:
+                break
+    return start
+
+
+def _summarize(service, model, previous, messages):
+    lines = [f"{m.role}: {m.content}" for m in messages]
+    prompt = f"Current summary:\n{previous or '(none)'}\n\nNew messages:\n" + "\n\n".join(lines)
+    return service.chat_completion(
+        [{"role": "system", "content": SUMMARY_PROMPT}, {"role": "user", "content": prompt}],
+        model=model, temperature=0.2, max_tokens=1024,
+    ).strip()
+
+
+def _turn_settings():
+    config = current_app.config
+    return max(config.get("CHAT_HISTORY_TURNS", 4), 1), max(config.get("CHAT_SUMMARY_BATCH_TURNS", 2), 1)
+
+
+def build_history(thread, model=None, service=None):
+    """
+    Summary and verbatim messages to send for the thread's next reply.
+
+    Args:
+        thread: ChatThread whose messages (oldest first) end with the new user message
+        model: chat model, selects the token budget
+        service: OpenRouterService of the requesting user; when given, a due fold is
+            started in the background. None reuses the stored summary as-is.
+
+    Returns:
+        (summary, messages) — summary text or None, and the recent {"role", "content"} messages
+    """
+    budget = history_budget(model) - estimate_tokens(thread.summary)
+    keep_turns, batch_turns = _turn_settings()
+
+    upto = thread.summary_upto_id or 0
+    pending = [m for m in thread.messages if m.id > upto]
+
+    # The verbatim window grows to keep_turns + batch_turns before anything is folded, so the summary isn't rewritten every turn
+    start = _window_start(pending, budget, keep_turns + batch_turns - 1)
+    if start > 0 and service is not None:
+        _start_fold(thread.id, service.user.id if service.user else None, model)
+        # Until the fold lands, the turns it covers stay verbatim as far as the budget allows
+        start = _window_start(pending, budget, len(pending))
+
+    return thread.summary, [{"role": m.role, "content": m.content} for m in pending[start:]]
+
+
+def _get_pool():
+    global _pool, _pool_pid
+    with _lock:
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = ThreadPoolExecutor(max_workers=_SUMMARY_THREADS, thread_name_prefix="chat-summary")
+            _pool_pid = os.getpid()
+        return _pool
+
+
+def _start_fold(thread_id, user_id, model):
+    with _lock:
+        if thread_id in _folding:
+            return
+        _folding.add(thread_id)
+    _get_pool().submit(_fold, current_app._get_current_object(), thread_id, user_id, model)
+
+
+def _fold(app, thread_id, user_id, model):
+    """Fold a thread's older turns into its summary, in its own app context and session."""
+    from app.models.chat import ChatThread
+    from app.models.user import User
+    from app.services.openrouter import OpenRouterService
+
+    with app.app_context():
+        try:
+            thread = db.session.get(ChatThread, thread_id)
+            if thread is None:
+                return
+            budget = history_budget(model) - estimate_tokens(thread.summary)
+            keep_turns, batch_turns = _turn_settings()
+            upto = thread.summary_upto_id
+            pending = [m for m in thread.messages if m.id > (upto or 0)]
+            if _window_start(pending, budget, keep_turns + batch_turns - 1) == 0:
+                return  # Already folded, or the thread was edited back down
+            fold = _window_start(pending, budget, keep_turns)
+
+            service = OpenRouterService(user=db.session.get(User, user_id) if user_id else None, priority="batch")
+            summary = _summarize(service, app.config.get("CHAT_SUMMARY_MODEL") or model, thread.summary, pending[:fold])
+
+            # Only if no edit reset the summary while it was being written
+            same = ChatThread.summary_upto_id.is_(None) if upto is None else ChatThread.summary_upto_id == upto
+            ChatThread.query.filter(ChatThread.id == thread_id, same).update(
+                {ChatThread.summary: summary, ChatThread.summary_upto_id: pending[fold - 1].id},
+                synchronize_session=False,
+            )
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            app.logger.exception(f"Updating the summary of chat thread {thread_id} failed; keeping the previous one")
+        finally:
+            db.session.remove()
+            with _lock:
+                _folding.discard(thread_id)
+
+
+def invalidate_summary(thread, message_id):
+    """Drop the stored summary if it covers a message that was edited or deleted. Caller commits."""
+    if thread.summary_upto_id is not None and message_id <= thread.summary_upto_id:
+        thread.summary = None
+        thread.summary_upto_id = None
@@ -0,0 +1,90 @@
+import math
+import numpy as np
+from app.services.vectorizer import is_cjk, to_codepoints
+
+_BLOCK_SEPARATOR = "\n\n---\n\n"
+
+
+def estimate_tokens(text):
+    """
+    Rough LLM token count without a tokenizer: about one token per CJK
+    character and one per four characters of other text.
+    """
+    if not text:
+        return 0
+    cjk = int(is_cjk(to_codepoints(text)).sum())
+    return cjk + math.ceil((len(text) - cjk) / 4)
+
+
+def _header(note_id):
+    return f"[Note #{note_id}] "
+
+
+def pack_context(chunks, vectors, budget, mmr_lambda=0.7, duplicate_threshold=0.92):
+    """
+    Choose retrieved chunks for the prompt by maximal marginal relevance until
+    the token budget is full.
+
+    Each step takes the chunk with the best trade-off between relevance and
+    similarity to what is already chosen, so a note's meta chunk and its
+    near-identical "Question:" chunk don't both use up the budget. Chunks at
+    least duplicate_threshold similar to a chosen one are dropped outright.
+    Chosen chunks of the same note are merged into one block under a single
+    header, in stored order.
+
+    Args:
+        chunks: retrieval results (chunk_text, note_id, similarity, embedding_id), best first
+        vectors: (len(chunks), dim) unit-normalized chunk vectors
+        budget: maximum estimated tokens for the packed context
+        mmr_lambda: 1.0 ranks purely by relevance, lower values favour diversity
+
+    Returns:
+        (context_text, estimated_tokens, chosen_chunks)
+    """
+    if not chunks or budget <= 0:
+        return "", 0, []
+
+    vectors = np.asarray(vectors, dtype=np.float32)
+    relevance = np.array([c["similarity"] for c in chunks], dtype=np.float32)
+    top = relevance.max()
+    relevance = relevance / top if top > 0 else np.zeros_like(relevance)
+    pairwise = vectors @ vectors.T
+
+    costs = [estimate_tokens(c["chunk_text"]) for c in chunks]
+    remaining = set(range(len(chunks)))
+    chosen, notes_used = [], set()
+    max_sim = np.full(len(chunks), -np.inf, dtype=np.float32)
+    used = 0
+
+    while remaining:
+        candidates = np.array(sorted(remaining))
+        redundancy = np.where(np.isfinite(max_sim[candidates]), max_sim[candidates], 0.0)
+        mmr = mmr_lambda * relevance[candidates] - (1 - mmr_lambda) * redundancy
+        best = int(candidates[np.argmax(mmr)])
+        remaining.discard(best)
+        if max_sim[best] >= duplicate_threshold:
+            continue
+
+        note_id = chunks[best]["note_id"]
+        if note_id in notes_used:
+            cost = costs[best] + 1  # Joined to the note's block with a newline
+        else:
+            cost = costs[best] + estimate_tokens(_header(note_id)) + (estimate_tokens(_BLOCK_SEPARATOR) if chosen else 0)
+        if used + cost > budget:
+            continue  # Too long; a shorter chunk may still fit
+
+        chosen.append(best)
+        notes_used.add(note_id)
+        used += cost
+        np.maximum(max_sim, pairwise[best], out=max_sim)
+
+    # One block per note, ordered by its best chunk; chunks inside in stored order
+    blocks = {}
+    for i in chosen:
+        blocks.setdefault(chunks[i]["note_id"], []).append(i)
+    parts = []
+    for note_id, members in blocks.items():
+        members.sort(key=lambda i: chunks[i].get("embedding_id", 0))
+        parts.append(_header(note_id) + "\n".join(chunks[i]["chunk_text"] for i in members))
+    context = _BLOCK_SEPARATOR.join(parts)
+    return context, estimate_tokens(context), [chunks[i] for i in chosen]
@@ -0,0 +1,245 @@
+"""
+Embedding providers: turn a batch of texts into unit-normalized vectors.
+
+    hashing  local HashingVectorizer, no network (default)
+    openai   any OpenAI-compatible POST {base}/embeddings endpoint
+
+Remote providers are wrapped in CachedProvider, which keeps every vector in
+the embedding_cache table keyed by (provider, model, sha256 of the text), so
+a chunk that was embedded once — a repeated textbook question, a note saved
+again, a re-index — is never sent to the provider again.
+"""
+import hashlib
+import numpy as np
+from flask import current_app
+from sqlalchemy.dialects import postgresql, sqlite
+from app.extensions import db
+from app.services import http_client
+from app.models.embedding import EmbeddingCacheEntry
+from app.services.vectorizer import HashingVectorizer
+
+_LOOKUP_BATCH = 500  # Keeps IN (...) lists under SQLite's variable limit
+
+
+class EmbeddingProvider:
+    """
+    Interface for embedding backends.
+
+    Subclasses set name, model and dim and implement embed().
+    version is stored on each Embedding row, so switching provider or model
+    marks previously stored vectors as stale.
+    """
+
+    name = None
+    model = None
+    dim = None
+
+    @property
+    def version(self):
+        version = f"{self.name}:{self.model}"
+        if len(version) > 32:  # Embedding.vector_version is String(32)
+            version = f"{self.name}:{hashlib.sha1(self.model.encode('utf-8')).hexdigest()[:31 - len(self.name)]}"
+        return version
+
+    def embed(self, texts):
+        """Embed a list of texts. Returns an (n, dim) float32 array of unit-normalized rows."""
+        raise NotImplementedError
+
+
+class HashingProvider(EmbeddingProvider):
+    name = "hashing"
+
+    def __init__(self, dim=384):
+        self._vectorizer = HashingVectorizer(dim=dim)
+        self.dim = dim
+        self.model = self._vectorizer.version
+
+    @property
+    def version(self):
+        # Unchanged from before providers existed, so stored hashing vectors stay current
+        return self._vectorizer.version
+
+    def embed(self, texts):
+        return self._vectorizer.transform(texts)
+
+
+class OpenAICompatibleProvider(EmbeddingProvider):
+    """
+    Client for an OpenAI-style embeddings API (OpenAI, vLLM, Ollama, LiteLLM,
+    or `flask mock-embeddings` locally). Texts are sent batch_size per request.
+    """
+
+    name = "openai"
+
+    def __init__(self, base_url, model, dim, api_key="", batch_size=64, timeout=60):
+        self.base_url = base_url.rstrip("/")
+        self.model = model
+        self.dim = dim
+        self.api_key = api_key
+        self.batch_size = batch_size
+        self.timeout = timeout
+
+    def _headers(self):
+        headers = {"Content-Type": "application/json"}
+        if self.api_key:
+            headers["Authorization"] = f"Bearer {self.api_key}"
+        return headers
+
+    def embed(self, texts):
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for start in range(0, len(texts), self.batch_size):
+            batch = texts[start:start + self.batch_size]
+            resp = http_client.post(
+                f"{self.base_url}/embeddings",
+                headers=self._headers(),
+                json={"model": self.model, "input": batch},
+                read_timeout=self.timeout,
+            )
+            resp.raise_for_status()
+            data = resp.json()["data"]
+            if len(data) != len(batch):
+                raise ValueError(f"Embedding API returned {len(data)} vectors for {len(batch)} inputs")
+            # Items carry the input position they belong to; servers that omit it return them in order
+            positions = [item.get("index", i) for i, item in enumerate(data)]
+            if sorted(positions) != list(range(len(batch))):
+                raise ValueError(f"Embedding API returned indexes {positions} for {len(batch)} inputs")
+            for position, item in zip(positions, data):
+                vector = np.asarray(item["embedding"], dtype=np.float32)
+                if len(vector) != self.dim:
+                    raise ValueError(f"Embedding API returned dimension {len(vector)}, EMBEDDING_DIM is {self.dim}")
+                out[start + position] = vector
+        norms = np.linalg.norm(out, axis=1, keepdims=True)
+        np.divide(out, norms, out=out, where=norms > 0)
+        return out
+
+
+class CachedProvider(EmbeddingProvider):
+    """
+    Persistent content-hash cache in front of another provider.
+
+    Only texts without a cached vector are sent to the wrapped provider, each
+    distinct text once per batch. New vectors are added to the caller's
+    session and become durable with its commit.
+    """
+
+    def __init__(self, provider):
+        self.provider = provider
+        self.name = provider.name
+        self.model = provider.model
+        self.dim = provider.dim
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def version(self):
+        return self.provider.version
+
+    def embed(self, texts, store=True):
+        """
+        Args:
+            texts: texts to embed
+            store: write newly computed vectors to the cache (False for one-off queries)
+        """
+        hashes = [hashlib.sha256(t.encode("utf-8")).hexdigest() for t in texts]
+        found = self._lookup(set(hashes))
+
+        missing = {}
+        for text, text_hash in zip(texts, hashes):
+            if text_hash not in found and text_hash not in missing:
+                missing[text_hash] = text
+        self.hits += len(texts) - sum(h not in found for h in hashes)
+        self.misses += len(missing)
+
+        if missing:
+            vectors = self.provider.embed(list(missing.values()))
+            for text_hash, vector in zip(missing, vectors):
+                found[text_hash] = vector
+            if store:
+                self._store({h: found[h] for h in missing})
+
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for i, text_hash in enumerate(hashes):
+            out[i] = found[text_hash]
+        return out
+
+    def _lookup(self, hashes):
+        found = {}
+        hashes = list(hashes)
+        for start in range(0, len(hashes), _LOOKUP_BATCH):
+            rows = db.session.query(EmbeddingCacheEntry.text_hash, EmbeddingCacheEntry.vector_blob).filter(
+                EmbeddingCacheEntry.provider == self.name,
+                EmbeddingCacheEntry.model == self.model,
+                EmbeddingCacheEntry.text_hash.in_(hashes[start:start + _LOOKUP_BATCH]),
+            )
+            for text_hash, blob in rows:
+                vector = np.frombuffer(blob, dtype=np.float32)
+                if len(vector) == self.dim:
+                    found[text_hash] = vector
+        return found
+
+    def _store(self, vectors):
+        rows = [
+            {"provider": self.name, "model": self.model, "text_hash": h, "vector_blob": v.astype(np.float32).tobytes()}
+            for h, v in vectors.items()
+        ]
+        dialect = db.session.get_bind().dialect.name
+        # Another worker may have cached the same text meanwhile; keep whichever landed first
+        if dialect == "sqlite":
+            stmt = sqlite.insert(EmbeddingCacheEntry).on_conflict_do_nothing()
+        elif dialect == "postgresql":
+            stmt = postgresql.insert(EmbeddingCacheEntry).on_conflict_do_nothing()
+        else:
+            stmt = db.insert(EmbeddingCacheEntry)
+        db.session.execute(stmt, rows)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "provider": self.name,
+            "model": self.model,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+_provider = None
+_provider_key = None
+
+
+def get_embedding_provider():
+    """The configured provider, rebuilt only when the embedding settings change."""
+    global _provider, _provider_key
+    config = current_app.config
+    key = tuple(config.get(k) for k in (
+        "EMBEDDING_PROVIDER", "EMBEDDING_MODEL", "EMBEDDING_DIM", "EMBEDDING_API_BASE",
+        "EMBEDDING_API_KEY", "EMBEDDING_BATCH_SIZE", "EMBEDDING_CACHE",
+    ))
+    if _provider is None or key != _provider_key:
+        _provider = _create_provider(config)
+        _provider_key = key
+    return _provider
+
+
+def _create_provider(config):
+    name = config.get("EMBEDDING_PROVIDER", "hashing")
+    dim = config.get("EMBEDDING_DIM", 384)
+    if name == "hashing":
+        return HashingProvider(dim=dim)
+    if name == "openai":
+        provider = OpenAICompatibleProvider(
+            base_url=config["EMBEDDING_API_BASE"],
+            model=config["EMBEDDING_MODEL"],
+            dim=dim,
+            api_key=config.get("EMBEDDING_API_KEY", ""),
+            batch_size=config.get("EMBEDDING_BATCH_SIZE", 64),
+        )
+        return CachedProvider(provider) if config.get("EMBEDDING_CACHE", True) else provider
+    raise ValueError(f"Unknown EMBEDDING_PROVIDER: {name}")
+
+
+def embedding_provider_stats():
+    provider = get_embedding_provider()
+    if isinstance(provider, CachedProvider):
+        return provider.stats()
+    return {"provider": provider.name, "model": provider.model}
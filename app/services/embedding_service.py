@@ -1,54 +1,40 @@
+import hashlib
 import numpy as np
 from flask import current_app
+from sqlalchemy import inspect as sa_inspect
 from app.extensions import db
 from app.models.embedding import Embedding
 from app.services.openrouter import OpenRouterService
+from app.services.vector_index import (
+    get_user_index, get_index_version, bump_index_version, open_user_store, queue_store_write,
+)
+from app.services.vector_store import get_store
+from app.services.embedding_providers import get_embedding_provider, CachedProvider
+from app.services.bm25_index import index_chunks, unindex_chunks, bm25_scores
+from app.services.ann_index import get_ivf
+from app.services.note_graph import update_note_graph
+from app.services.quantization import encode_vectors
+from app.utils.lru import LRUCache
 
 
-def _simple_text_to_vector(text, dim=384):
-    """
-    Simple bag-of-characters embedding for lightweight similarity search.
-    For production, replace with a proper embedding model call.
-    Uses character n-gram hashing to create a fixed-size vector.
-    """
-    vec = np.zeros(dim, dtype=np.float32)
-    text = text.lower().strip()
-    if not text:
-        return vec
-
-    # Character trigram hashing
-    for i in range(len(text) - 2):
-        trigram = text[i:i+3]
-        h = hash(trigram) % dim
-        vec[h] += 1.0
-
-    # Word-level hashing
-    words = text.split()
-    for word in words:
-        h = hash(word) % dim
-        vec[h] += 2.0  # Weight words more than char trigrams
-
-    # Normalize
-    norm = np.linalg.norm(vec)
-    if norm > 0:
-        vec = vec / norm
-
-    return vec
+_result_cache = None
 
 
 def generate_embedding(text):
-    """Generate an embedding vector for the given text."""
-    return _simple_text_to_vector(text)
+    """Embed a single query text. Queries are looked up in, but not added to, the embedding cache."""
+    provider = get_embedding_provider()
+    if isinstance(provider, CachedProvider):
+        return provider.embed([text], store=False)[0]
+    return provider.embed([text])[0]
 
 
-def store_embeddings_for_note(note):
-    """
-    Generate and store embeddings for a note's content and mistake items.
-    Chunks the content into manageable pieces.
-    """
-    # Remove old embeddings for this note
-    Embedding.query.filter_by(note_id=note.id).delete()
+def generate_embeddings(texts):
+    """Embed many texts in one batch. Returns an (n, dim) float32 array."""
+    return get_embedding_provider().embed(texts)
 
+
+def chunk_note(note):
+    """Split a note's content, mistake items and metadata into embedding chunks."""
     chunks = []
 
     # Chunk the markdown content
@@ -76,56 +62,377 @@ def store_embeddings_for_note(note):
     if meta_chunk.strip():
         chunks.append(meta_chunk)
 
-    # Generate and store embeddings
-    for chunk_text in chunks:
-        vec = generate_embedding(chunk_text)
+    return chunks
+
+
+def _chunk_hash(text):
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def _plan_note(note, provider, force=False):
+    """
+    Diff a note's current chunks against its stored rows by content hash.
+
+    Returns:
+        (to_embed, reused_ids, removed_ids, unindexed_ids) — chunk texts needing
+        new vectors, rows kept as-is, rows to delete, and kept rows still missing postings
+    """
+    # Existing chunks by hash — a list per hash, since a note can repeat a chunk
+    existing = {}
+    stale_ids = []
+    unindexed_ids = set()  # Rows stored before the BM25 index existed
+    for emb_id, chunk_text, version, term_count in db.session.query(
+            Embedding.id, Embedding.chunk_text, Embedding.vector_version, Embedding.term_count) \
+            .filter(Embedding.note_id == note.id).order_by(Embedding.id):
+        if force or version != provider.version:
+            stale_ids.append(emb_id)
+        else:
+            existing.setdefault(_chunk_hash(chunk_text), []).append(emb_id)
+            if term_count is None:
+                unindexed_ids.add(emb_id)
+
+    to_embed = []
+    reused_ids = []
+    for chunk_text in chunk_note(note):
+        matches = existing.get(_chunk_hash(chunk_text))
+        if matches:
+            reused_ids.append(matches.pop(0))
+        else:
+            to_embed.append(chunk_text)
+    removed_ids = stale_ids + [emb_id for ids in existing.values() for emb_id in ids]
+    return to_embed, reused_ids, removed_ids, unindexed_ids & set(reused_ids)
+
+
+def store_embeddings_for_note(note):
+    """
+    Bring a note's stored embeddings in line with its current chunks.
+
+    Existing chunks are matched to the new ones by content hash: unchanged chunks
+    keep their rows and vectors, removed chunks are deleted, and only new chunks
+    are embedded and inserted. Rows embedded by another provider or model version
+    count as removed, so they are rebuilt. Nothing is written when nothing changed.
+
+    Returns:
+        dict with counts of reused, rebuilt (newly embedded) and removed chunks
+    """
+    return store_embeddings_for_notes([note])[0]
+
+
+def store_embeddings_for_notes(notes):
+    """
+    Batch form of store_embeddings_for_note: every new chunk across the notes is
+    embedded in one provider call and everything is written in one commit.
+
+    Returns:
+        list of per-note stats dicts, in the order of notes
+    """
+    plans = plan_embeddings(notes)
+    texts = texts_to_embed(plans)
+    vectors = get_embedding_provider().embed(texts) if texts else None
+    return apply_embeddings(notes, plans, vectors)
+
+
+def plan_embeddings(notes, force=False):
+    """
+    Work out, per note, which chunks need new vectors (see store_embeddings_for_note).
+    force re-embeds every chunk, even those already current.
+    """
+    provider = get_embedding_provider()
+    return [_plan_note(note, provider, force) for note in notes]
+
+
+def texts_to_embed(plans):
+    """All chunk texts the plans need vectors for, in the order apply_embeddings expects."""
+    return [text for to_embed, _, _, _ in plans for text in to_embed]
+
+
+def apply_embeddings(notes, plans, vectors):
+    """
+    Write planned changes with their new vectors (rows aligned with texts_to_embed)
+    and commit once. Readers see the notes' old vectors until the commit.
+
+    Returns:
+        list of per-note stats dicts, in the order of notes
+    """
+    provider = get_embedding_provider()
+    packed = _use_packed_store()
+    fmt = "float32" if packed else current_app.config.get("EMBEDDING_STORAGE", "float32")
+
+    all_stats = [
+        {"reused": len(reused), "rebuilt": len(to_embed), "removed": len(removed)}
+        for to_embed, reused, removed, _ in plans
+    ]
+    if not any(to_embed or removed or unindexed for to_embed, _, removed, unindexed in plans):
+        return all_stats
+
+    # By identity, not note.id: that reloads a note expired by an earlier commit, and fails if it was deleted
+    note_ids = [sa_inspect(note).identity[0] for note in notes]
+    gone = set(note_ids) - _existing_notes(note_ids, lock=False)
+    if gone:
+        # Deleted since they were planned (e.g. while the reindex command wrote the previous batch)
+        return _apply_without(gone, notes, note_ids, plans, vectors, all_stats)
+
+    offset = 0
+    changed_users = set()
+    moved = {}  # user_id -> notes whose vectors changed, for the related-notes graph
+    for note, (to_embed, _, removed_ids, unindexed_ids) in zip(notes, plans):
+        note_vectors = vectors[offset:offset + len(to_embed)] if to_embed else np.zeros((0, provider.dim), np.float32)
+        offset += len(to_embed)
+        if not to_embed and not removed_ids and not unindexed_ids:
+            continue
+        changed_users.add(note.user_id)
+        _write_note_embeddings(note, to_embed, note_vectors, removed_ids, unindexed_ids, fmt, packed, provider)
+        if to_embed or removed_ids:
+            moved.setdefault(note.user_id, []).append(note.id)
+
+    deleted = set(note_ids) - _existing_notes(note_ids)
+    if deleted:
+        # Deleted while their vectors were being computed: write the others without them
+        db.session.rollback()
+        return _apply_without(deleted, notes, note_ids, plans, vectors, all_stats)
+
+    for user_id, moved_ids in moved.items():
+        update_note_graph(user_id, moved_ids, provider)
+    for user_id in changed_users:
+        bump_index_version(user_id)
+    db.session.commit()
+    for note_id, stats in zip(note_ids, all_stats):
+        current_app.logger.debug(f"Embeddings for note {note_id}: {stats}")
+    return all_stats
+
+
+def _apply_without(dropped, notes, note_ids, plans, vectors, all_stats):
+    """apply_embeddings for all but the dropped notes; theirs keep their planned stats."""
+    keep = [i for i, note_id in enumerate(note_ids) if note_id not in dropped]
+    bounds = np.cumsum([0] + [len(to_embed) for to_embed, _, _, _ in plans])
+    rows = [r for i in keep for r in range(bounds[i], bounds[i + 1])]
+    kept_stats = apply_embeddings([notes[i] for i in keep], [plans[i] for i in keep],
+                                  vectors[rows] if vectors is not None else None)
+    return [kept_stats.pop(0) if note_id not in dropped else stats
+            for note_id, stats in zip(note_ids, all_stats)]
+
+
+def _existing_notes(note_ids, lock=True):
+    """
+    Which of the notes still exist. With lock, this is read after this
+    transaction's writes: by then it holds SQLite's write lock (and these
+    rows' locks elsewhere), so a delete either committed before and is seen
+    here, or commits after and removes the new rows along with the note.
+    """
+    from app.models.note import Note
+
+    query = db.session.query(Note.id).filter(Note.id.in_(note_ids))
+    return {n for (n,) in (query.with_for_update() if lock else query)}
+
+
+def _write_note_embeddings(note, to_embed, vectors, removed_ids, unindexed_ids, fmt, packed, provider):
+    if removed_ids:
+        unindex_chunks(note.user_id, removed_ids)
+        Embedding.query.filter(Embedding.id.in_(removed_ids)).delete(synchronize_session=False)
+
+    blobs = [b""] * len(to_embed) if packed else encode_vectors(vectors, fmt)
+    new_embeddings = []
+    for chunk_text, blob in zip(to_embed, blobs):
         emb = Embedding(
             note_id=note.id,
             chunk_text=chunk_text,
-            vector_blob=vec.tobytes(),
+            vector_blob=blob,
+            vector_version=provider.version,
+            vector_format=fmt,
         )
         db.session.add(emb)
+        new_embeddings.append(emb)
 
-    db.session.commit()
+    db.session.flush()  # Assign ids for the postings and the packed-store sidecar
+    to_index = new_embeddings
+    if unindexed_ids:
+        to_index = to_index + Embedding.query.filter(Embedding.id.in_(unindexed_ids)).all()
+    index_chunks(note.user_id, to_index)
+
+    if packed and (removed_ids or new_embeddings):
+        queue_store_write(
+            open_user_store(note.user_id, provider.dim),
+            emb_ids=removed_ids or None,
+            append=(
+                np.array([e.id for e in new_embeddings], dtype=np.int64),
+                np.full(len(new_embeddings), note.id, dtype=np.int64),
+                np.asarray(vectors, dtype=np.float32),
+            ) if new_embeddings else None,
+        )
+
+
+def delete_embeddings_for_note(note):
+    """Remove a note's embeddings and graph edges and invalidate the owner's cached index. Caller commits."""
+    emb_ids = [emb_id for (emb_id,) in db.session.query(Embedding.id).filter_by(note_id=note.id)]
+    unindex_chunks(note.user_id, emb_ids)
+    Embedding.query.filter_by(note_id=note.id).delete()
+    if _use_packed_store():
+        queue_store_write(get_store(note.user_id, get_embedding_provider().dim, current_app.config),
+                          note_ids=[note.id])
+    update_note_graph(note.user_id, [note.id], get_embedding_provider())
+    bump_index_version(note.user_id)
+
+
+def _use_packed_store():
+    return current_app.config.get("VECTOR_STORE_BACKEND") == "mmap"
+
+
+def count_stale_embeddings(user_id=None):
+    """Number of stored chunks embedded by a different provider/version than the current one."""
+    from app.models.note import Note
+
+    query = db.session.query(db.func.count(Embedding.id)).filter(
+        db.or_(Embedding.vector_version.is_(None), Embedding.vector_version != get_embedding_provider().version)
+    )
+    if user_id is not None:
+        query = query.join(Note).filter(Note.user_id == user_id)
+    return query.scalar()
+
+
+def _top_k_indices(scores, k):
+    """Indices of the k highest scores, best first, using partial selection."""
+    if k >= len(scores):
+        return np.argsort(-scores, kind="stable")
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top], kind="stable")]
+
+
+def _candidate_rows(index, query_vec, note_ids):
+    """
+    Rows worth scoring: the selected notes' rows, the nearest IVF cells once the
+    corpus passes ANN_MIN_CHUNKS, or None for an exact scan over everything.
+    """
+    if note_ids:
+        return np.flatnonzero(index.row_mask(note_ids))
+    min_chunks = current_app.config.get("ANN_MIN_CHUNKS", 20000)
+    if min_chunks and len(index) >= min_chunks:
+        return get_ivf(index).candidates(query_vec, current_app.config.get("ANN_NPROBE", 8))
+    return None
+
+
+def _get_result_cache():
+    global _result_cache
+    if _result_cache is None:
+        _result_cache = LRUCache(current_app.config.get("RETRIEVAL_CACHE_SIZE", 1024))
+    return _result_cache
+
+
+def normalize_query(query):
+    """Case- and whitespace-insensitive form of a query, used for both caching and scoring."""
+    return " ".join(query.lower().split())
+
+
+def retrieval_cache_stats():
+    return _get_result_cache().stats()
 
 
 def retrieve_relevant_chunks(query, user_id, note_ids=None, top_k=8):
     """
-    Retrieve the most relevant chunks for a query using cosine similarity.
+    Retrieve the most relevant chunks for a query.
+
+    Cosine similarity over the chunk vectors is fused with BM25 over the
+    chunks sharing a term with the query (see RETRIEVAL_BM25_WEIGHT), so short
+    keyword queries such as "二次方程 判别式" still find exact matches. Large
+    corpora are searched through an IVF index instead of a full scan.
 
     Args:
         query: search query text
-        user_id: restrict to this user's notes
+        user_id: restrict to this user's notes; None searches every user (admin)
         note_ids: if provided, restrict to these specific note IDs
         top_k: number of results to return
 
+    Results are cached per (user, normalized query, note_ids, top_k) and index
+    version, so a regenerated or re-sent chat message skips the search, and
+    any embedding write for the user makes the old entries unreachable.
+
     Returns:
-        list of dicts with chunk_text, note_id, similarity
+        list of dicts with chunk_text, note_id, similarity, embedding_id
     """
-    from app.models.note import Note
+    query = normalize_query(query)
+    version = get_index_version(user_id)
+    key = (
+        user_id,
+        hashlib.sha256(query.encode("utf-8")).hexdigest(),
+        frozenset(note_ids) if note_ids else None,
+        top_k,
+        version,
+    )
+    cache = _get_result_cache()
+    cached = cache.get(key)
+    if cached is None:
+        cached = _search(query, user_id, note_ids, top_k, version)
+        cache.put(key, cached)
+    return [dict(r) for r in cached]
+
 
+def _search(query, user_id, note_ids, top_k, version):
     query_vec = generate_embedding(query)
 
-    # Build query for embeddings
-    emb_query = db.session.query(Embedding).join(Note).filter(Note.user_id == user_id)
-    if note_ids:
-        emb_query = emb_query.filter(Embedding.note_id.in_(note_ids))
+    index = get_user_index(user_id, dim=len(query_vec), version=version)
+    if not len(index) or top_k <= 0:
+        return []
+
+    bm25_weight = current_app.config.get("RETRIEVAL_BM25_WEIGHT", 0.3)
+    hit_rows, hit_scores = np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+    if bm25_weight > 0:
+        hit_ids, hit_scores = bm25_scores(user_id, query)
+        hit_rows = index.rows_for(hit_ids)
+        found = hit_rows >= 0
+        hit_rows, hit_scores = hit_rows[found], hit_scores[found]
+
+    candidates = _candidate_rows(index, query_vec, note_ids)
+    scores = np.full(len(index), -np.inf, dtype=np.float32)
+    if candidates is None:
+        # Vectors are unit-normalized, so one matrix-vector product gives every cosine similarity
+        scores[:] = index.matrix @ query_vec
+    else:
+        if not note_ids:
+            # Keyword hits are always considered, even outside the probed cells
+            candidates = np.union1d(candidates, hit_rows)
+        scores[candidates] = index.matrix[candidates] @ query_vec
 
-    embeddings = emb_query.all()
-    if not embeddings:
+    if bm25_weight > 0:
+        # Blend in max-normalized BM25 for keyword hits among the scored rows
+        scores *= 1 - bm25_weight
+        if len(hit_rows) and hit_scores.max() > 0:
+            in_play = np.isfinite(scores[hit_rows])
+            scores[hit_rows[in_play]] += bm25_weight * hit_scores[in_play] / hit_scores.max()
+
+    if index.live is not None:
+        scores[~index.live] = -np.inf
+    top_k = min(top_k, int(np.isfinite(scores).sum()))
+    if top_k <= 0:
         return []
+    top = _top_k_indices(scores, top_k)
+
+    # Only the winners need their chunk text
+    winner_ids = [int(i) for i in index.emb_ids[top]]
+    texts = dict(
+        db.session.query(Embedding.id, Embedding.chunk_text).filter(Embedding.id.in_(winner_ids)).all()
+    )
+
+    # A packed-store row can outlive its Embedding row if its store write failed after the commit
+    return [
+        {
+            "chunk_text": texts[int(index.emb_ids[i])],
+            "note_id": int(index.note_ids[i]),
+            "similarity": float(scores[i]),
+            "embedding_id": int(index.emb_ids[i]),
+        }
+        for i in top
+        if int(index.emb_ids[i]) in texts
+    ]
 
-    # Compute similarities
-    results = []
-    for emb in embeddings:
-        stored_vec = np.frombuffer(emb.vector_blob, dtype=np.float32)
-        sim = float(np.dot(query_vec, stored_vec))
-        results.append({
-            "chunk_text": emb.chunk_text,
-            "note_id": emb.note_id,
-            "similarity": sim,
-        })
-
-    # Sort by similarity descending, return top-k
-    results.sort(key=lambda x: x["similarity"], reverse=True)
-    return results[:top_k]
+
+def chunk_vectors(user_id, emb_ids):
+    """
+    Stored vectors for retrieved chunks, read from the user's cached index.
+    Returns an (n, dim) float32 array; rows no longer in the index are zero.
+    """
+    index = get_user_index(user_id, dim=get_embedding_provider().dim)
+    out = np.zeros((len(emb_ids), index.matrix.shape[1]), dtype=np.float32)
+    rows = index.rows_for(np.asarray(emb_ids, dtype=np.int64))
+    found = rows >= 0
+    if found.any():
+        out[found] = np.asarray(index.matrix[rows[found]], dtype=np.float32)
+    return out
@@ -0,0 +1,109 @@
+"""
+Process-wide pooled HTTP client for outbound API calls (OpenRouter,
+OpenAI-compatible embedding endpoints).
+
+One requests.Session per process keeps connections alive between calls, so
+the detection call and every reconciliation call of an upload reuse the same
+TLS connection instead of each paying a fresh TCP+TLS handshake. New
+connections are counted per host and per thread, which makes the reuse
+visible in /admin/metrics and in the vision pipeline's log line.
+"""
+import os
+import threading
+from collections import Counter
+import requests
+from flask import current_app
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+_lock = threading.Lock()
+_local = threading.local()
+_session = None
+_session_key = None
+_requests = Counter()
+_new_connections = Counter()
+
+
+def _count(counter, host, field):
+    with _lock:
+        counter[host] += 1
+    usage = getattr(_local, "usage", None)
+    if usage is None:
+        usage = _local.usage = {"requests": 0, "new_connections": 0}
+    usage[field] += 1
+
+
+class _CountingHTTPConnectionPool(HTTPConnectionPool):
+    def _new_conn(self):
+        _count(_new_connections, self.host, "new_connections")
+        return super()._new_conn()
+
+
+class _CountingHTTPSConnectionPool(HTTPSConnectionPool):
+    def _new_conn(self):
+        _count(_new_connections, self.host, "new_connections")
+        return super()._new_conn()
+
+
+class _PooledAdapter(HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _CountingHTTPConnectionPool,
+            "https": _CountingHTTPSConnectionPool,
+        }
+
+
+def get_session():
+    """
+    The shared session, rebuilt when HTTP_POOL_SIZE changes or in a forked
+    worker (sockets must not be shared with the parent process).
+    """
+    global _session, _session_key
+    key = (os.getpid(), current_app.config.get("HTTP_POOL_SIZE", 32))
+    if _session is None or key != _session_key:
+        with _lock:
+            if _session is None or key != _session_key:
+                adapter = _PooledAdapter(pool_connections=8, pool_maxsize=key[1])
+                session = requests.Session()
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _session, _session_key = session, key
+    return _session
+
+
+def post(url, read_timeout=None, **kwargs):
+    """
+    requests.post on the shared session with separate connect and read
+    timeouts (HTTP_CONNECT_TIMEOUT, and read_timeout or HTTP_READ_TIMEOUT).
+    """
+    config = current_app.config
+    kwargs.setdefault("timeout", (config.get("HTTP_CONNECT_TIMEOUT", 5), read_timeout or config.get("HTTP_READ_TIMEOUT", 120)))
+    _count(_requests, requests.utils.urlparse(url).hostname, "requests")
+    return get_session().post(url, **kwargs)
+
+
+def thread_usage():
+    """{requests, new_connections} made by the current thread so far; diff two calls to measure a block."""
+    return dict(getattr(_local, "usage", None) or {"requests": 0, "new_connections": 0})
+
+
+def http_client_stats():
+    with _lock:
+        hosts = {
+            host: {
+                "requests": _requests[host],
+                "new_connections": _new_connections[host],
+                "reused": max(_requests[host] - _new_connections[host], 0),
+            }
+            for host in _requests
+        }
+    total = sum(h["requests"] for h in hosts.values())
+    reused = sum(h["reused"] for h in hosts.values())
+    return {
+        "pool_size": _session_key[1] if _session_key else None,
+        "requests": total,
+        "reused": reused,
+        "reuse_rate": round(reused / total, 4) if total else 0.0,
+        "hosts": hosts,
+    }
@@ -0,0 +1,182 @@
+import atexit
+import threading
+import time
+from collections import OrderedDict
+
+
+class EmbeddingIndexer:
+    """
+    Background worker that keeps embeddings in step with note writes.
+
+    Routes call note_changed() after committing a note. Events are coalesced per
+    note — ten quick saves of the same note are embedded once — and drained in
+    batches by a daemon thread, so the save request never waits on chunking or
+    vectorizing. With EMBEDDING_INDEXER_ASYNC off, note_changed() embeds inline.
+
+    Notes of a failed batch are queued again after EMBEDDING_INDEXER_RETRY_SECONDS,
+    doubling per attempt, and dropped after EMBEDDING_INDEXER_MAX_ATTEMPTS. A note
+    that failed before is retried in a batch of its own, so one bad note can't
+    keep failing the rest.
+    """
+
+    def __init__(self):
+        self.app = None
+        self._pending = OrderedDict()  # note_id -> monotonic time of the oldest unprocessed change
+        self._in_flight = {}
+        self._attempts = {}  # note_id -> failed attempts so far
+        self._retry_at = {}  # note_id -> monotonic time a pending retry may run
+        self._cond = threading.Condition()
+        self._thread = None
+        self._atexit_registered = False
+        self.processed = 0
+        self.failed = 0
+        self.retries = 0
+        self.batches = 0
+        self.coalesced = 0
+
+    def init_app(self, app):
+        self.app = app
+        self.async_enabled = app.config.get("EMBEDDING_INDEXER_ASYNC", True)
+        self.debounce = app.config.get("EMBEDDING_INDEXER_DEBOUNCE_SECONDS", 0.5)
+        self.batch_size = app.config.get("EMBEDDING_INDEXER_BATCH_SIZE", 32)
+        self.max_attempts = app.config.get("EMBEDDING_INDEXER_MAX_ATTEMPTS", 5)
+        self.retry_delay = app.config.get("EMBEDDING_INDEXER_RETRY_SECONDS", 2)
+        # The singleton is re-initialized by every create_app(); one exit hook is enough
+        if not self._atexit_registered:
+            atexit.register(self.wait_until_idle, 5)
+            self._atexit_registered = True
+
+    def note_changed(self, note_id):
+        if not self.async_enabled:
+            if not self._index([note_id]):
+                self.failed += 1
+            return
+        with self._cond:
+            if note_id in self._pending:
+                self.coalesced += 1
+            else:
+                self._pending[note_id] = time.monotonic()
+            self._ensure_thread()
+            self._cond.notify_all()
+
+    def _ensure_thread(self):
+        # Started lazily so a pre-forking server gives each worker its own thread
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="embedding-indexer", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                wait = self._ready_in()
+                while wait != 0:
+                    self._cond.wait(wait)
+                    wait = self._ready_in()
+            # Give rapid successive saves a moment to coalesce
+            time.sleep(self.debounce)
+            with self._cond:
+                batch = self._take_batch()
+            if not batch:
+                continue
+            ok = False
+            try:
+                ok = self._index(batch)
+            finally:
+                with self._cond:
+                    for note_id in batch:
+                        since = self._in_flight.pop(note_id, None)
+                        if ok:
+                            self._attempts.pop(note_id, None)
+                        else:
+                            self._retry_later(note_id, since)
+                    self._cond.notify_all()
+
+    def _ready_in(self):
+        """Seconds until a pending note may run: 0 if one can now, None if none is pending. Call with the lock held."""
+        if not self._pending:
+            return None
+        if len(self._retry_at) < len(self._pending):
+            return 0
+        return max(min(self._retry_at.values()) - time.monotonic(), 0)
+
+    def _take_batch(self):
+        """Move the next batch from pending to in flight. Call with the lock held."""
+        now = time.monotonic()
+        ready = [n for n in self._pending if self._retry_at.get(n, 0) <= now]
+        fresh = [n for n in ready if n not in self._attempts]
+        batch = fresh[:self.batch_size] or ready[:1]
+        for note_id in batch:
+            self._retry_at.pop(note_id, None)
+            self._in_flight[note_id] = self._pending.pop(note_id)
+        return batch
+
+    def _retry_later(self, note_id, since):
+        """Queue a note from a failed batch again, or give up on it. Call with the lock held."""
+        attempts = self._attempts.get(note_id, 0) + 1
+        if attempts >= self.max_attempts:
+            self._attempts.pop(note_id, None)
+            self.failed += 1
+            self.app.logger.error(f"Giving up on embedding note {note_id} after {attempts} attempts")
+            return
+        self._attempts[note_id] = attempts
+        self.retries += 1
+        if note_id not in self._pending:  # Otherwise saved again meanwhile; that change runs as usual
+            self._pending[note_id] = since
+            self._retry_at[note_id] = time.monotonic() + self.retry_delay * 2 ** (attempts - 1)
+
+    def _index(self, note_ids):
+        """Embed the notes in one batch. Returns False if it failed (already logged)."""
+        from app.extensions import db
+        from app.models.note import Note
+        from app.services.embedding_service import store_embeddings_for_notes
+
+        with self.app.app_context():
+            try:
+                notes = Note.query.filter(Note.id.in_(note_ids)).all()  # Deleted notes simply drop out
+                if notes:
+                    store_embeddings_for_notes(notes)
+                self.processed += len(notes)
+                self.batches += 1
+                return True
+            except Exception:
+                db.session.rollback()
+                self.app.logger.exception(f"Embedding indexing failed for notes {note_ids}")
+                return False
+            finally:
+                db.session.remove()
+
+    def lag_seconds(self):
+        """Age of the oldest change not yet reflected in the index."""
+        with self._cond:
+            waiting = list(self._pending.values()) + list(self._in_flight.values())
+        return round(time.monotonic() - min(waiting), 3) if waiting else 0.0
+
+    def wait_until_idle(self, timeout=10):
+        """Block until every queued change is indexed. Returns False on timeout."""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self._pending or self._in_flight:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def stats(self):
+        with self._cond:
+            pending, in_flight, retrying = len(self._pending), len(self._in_flight), len(self._retry_at)
+        return {
+            "async": self.async_enabled,
+            "pending": pending,
+            "in_flight": in_flight,
+            "retrying": retrying,
+            "lag_seconds": self.lag_seconds(),
+            "processed": self.processed,
+            "failed": self.failed,
+            "retries": self.retries,
+            "batches": self.batches,
+            "coalesced": self.coalesced,
+        }
+
+
+indexer = EmbeddingIndexer()
@@ -0,0 +1,172 @@
+"""
+On-disk cache of deterministic LLM responses.
+
+Low-temperature calls with exactly the same prompt — a retaken quiz answer,
+the same worksheet uploaded twice — get the stored response instead of a new
+upstream call. Entries are keyed by a hash of (model, normalized messages,
+temperature, max_tokens), expire after LLM_CACHE_TTL seconds and are evicted
+least-recently-used once the stored responses exceed LLM_CACHE_MAX_BYTES.
+
+The cache is a separate SQLite file (LLM_CACHE_PATH, default
+instance/llm_cache.db) shared by all workers on the host, so writing to it
+never touches the caller's database transaction. Call sites opt in with
+OpenRouterService.chat_completion(..., cache=True).
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from flask import current_app
+from app.utils.sqlite_file import SQLiteFile
+
+_EVICT_EVERY = 64  # Puts between eviction passes
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS llm_responses (
+    key TEXT PRIMARY KEY,
+    model TEXT NOT NULL,
+    response TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    latency REAL NOT NULL,
+    created_at REAL NOT NULL,
+    used_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_llm_responses_used_at ON llm_responses (used_at);
+"""
+
+
+def _normalize(value):
+    if isinstance(value, str):
+        return unicodedata.normalize("NFC", value.replace("\r\n", "\n")).strip()
+    if isinstance(value, list):
+        return [_normalize(v) for v in value]
+    if isinstance(value, dict):
+        return {k: _normalize(v) for k, v in value.items()}
+    return value
+
+
+def cache_key(payload):
+    """sha256 over model, normalized messages, temperature and max_tokens of a completion payload."""
+    canonical = json.dumps({
+        "model": payload["model"],
+        "messages": _normalize(payload["messages"]),
+        "temperature": payload.get("temperature"),
+        "max_tokens": payload.get("max_tokens"),
+    }, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class LLMCache:
+    def __init__(self, path, ttl, max_bytes):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._db = SQLiteFile(path, _SCHEMA)
+        self._lock = threading.Lock()
+        self._puts = 0
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self.seconds_saved = 0.0
+
+    def get(self, key):
+        """The cached response, or None on a miss, an expired entry or a cache error."""
+        now = time.time()
+        try:
+            conn = self._db.conn()
+            row = conn.execute(
+                "SELECT response, latency FROM llm_responses WHERE key = ? AND created_at > ?",
+                (key, now - self.ttl),
+            ).fetchone()
+            if row is not None:
+                conn.execute("UPDATE llm_responses SET used_at = ? WHERE key = ?", (now, key))
+        except sqlite3.Error as e:
+            self.errors += 1
+            current_app.logger.warning(f"LLM cache lookup failed: {e}")
+            return None
+        with self._lock:
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.seconds_saved += row[1]
+        return row[0]
+
+    def put(self, key, model, response, latency):
+        """Store a response with the upstream latency it took (reported as time saved on hits)."""
+        now = time.time()
+        try:
+            conn = self._db.conn()
+            conn.execute(
+                "INSERT OR REPLACE INTO llm_responses (key, model, response, size, latency, created_at, used_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, model, response, len(response.encode("utf-8")), latency, now, now),
+            )
+            with self._lock:
+                self._puts += 1
+                evict = self._puts % _EVICT_EVERY == 1
+            if evict:
+                self.evict()
+        except sqlite3.Error as e:
+            self.errors += 1
+            current_app.logger.warning(f"LLM cache store failed: {e}")
+
+    def evict(self):
+        """Drop expired entries, then least-recently-used ones until the total size fits max_bytes."""
+        conn = self._db.conn()
+        conn.execute("DELETE FROM llm_responses WHERE created_at <= ?", (time.time() - self.ttl,))
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM llm_responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        drop = []
+        for key, size in conn.execute("SELECT key, size FROM llm_responses ORDER BY used_at"):
+            if total <= self.max_bytes:
+                break
+            drop.append((key,))
+            total -= size
+        conn.executemany("DELETE FROM llm_responses WHERE key = ?", drop)
+
+    def stats(self):
+        try:
+            entries, size = self._db.conn().execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM llm_responses"
+            ).fetchone()
+        except sqlite3.Error:
+            entries, size = None, None
+        lookups = self.hits + self.misses
+        return {
+            "entries": entries,
+            "bytes": size,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "errors": self.errors,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "upstream_seconds_saved": round(self.seconds_saved, 3),
+        }
+
+
+_cache = None
+_cache_key = None
+
+
+def get_llm_cache():
+    """The configured cache, or None when LLM_CACHE_ENABLED is off."""
+    global _cache, _cache_key
+    config = current_app.config
+    if not config.get("LLM_CACHE_ENABLED", True):
+        return None
+    path = config.get("LLM_CACHE_PATH") or os.path.join(current_app.instance_path, "llm_cache.db")
+    key = (path, config.get("LLM_CACHE_TTL", 7 * 86400), config.get("LLM_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+    if _cache is None or key != _cache_key:
+        _cache = LLMCache(*key)
+        _cache_key = key
+    return _cache
+
+
+def llm_cache_stats():
+    cache = get_llm_cache()
+    return cache.stats() if cache is not None else {"enabled": False}
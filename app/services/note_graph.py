@@ -0,0 +1,137 @@
+"""
+Per-user "related notes" graph.
+
+Every note with embeddings gets a centroid (the normalized mean of its chunk
+vectors) and up to NOTE_GRAPH_K directed edges to the earlier notes (by
+created_at, then id) whose centroids are most similar: the mistakes made
+before this one. When notes change, only the edges that can be affected are
+recomputed: the changed notes' own lists, lists that pointed at a changed
+note, and lists of later notes a changed note now belongs in. Reading a
+note's related notes is then a single indexed lookup.
+"""
+import numpy as np
+from flask import current_app
+from app.extensions import db
+from app.models.embedding import Embedding, NoteCentroid, NoteNeighbor
+from app.services.quantization import blob_matches, decode_blobs
+
+_BLOCK_ROWS = 512
+
+
+def _chunk_centroids(user_id, note_ids, provider):
+    """{note_id: unit centroid} computed from the notes' current chunk vectors."""
+    dim = provider.dim
+    if current_app.config.get("VECTOR_STORE_BACKEND") == "mmap":
+        from app.services.vector_index import pending_note_vectors
+
+        # The caller's store writes only land on commit, so read them from its queue
+        owners, matrix = pending_note_vectors(user_id, dim, note_ids)
+    else:
+        rows = [r for r in db.session.query(Embedding.note_id, Embedding.vector_blob, Embedding.vector_format)
+                .filter(Embedding.note_id.in_(note_ids), Embedding.vector_version == provider.version)
+                if blob_matches(r.vector_blob, r.vector_format, dim)]
+        owners = np.array([r.note_id for r in rows], dtype=np.int64)
+        matrix = np.asarray(decode_blobs([r.vector_blob for r in rows], [r.vector_format for r in rows], dim))
+
+    if not len(owners):
+        return {}
+    unique, inverse = np.unique(owners, return_inverse=True)
+    sums = np.zeros((len(unique), dim), dtype=np.float32)
+    np.add.at(sums, inverse, matrix)
+    norms = np.linalg.norm(sums, axis=1, keepdims=True)
+    np.divide(sums, norms, out=sums, where=norms > 0)
+    return {int(n): sums[i] for i, n in enumerate(unique)}
+
+
+def _user_centroids(user_id, dim):
+    """(note ids, centroid matrix) ordered oldest note first, so a lower row is an earlier note."""
+    from app.models.note import Note
+
+    rows = [(n, b) for n, b in db.session.query(NoteCentroid.note_id, NoteCentroid.vector_blob)
+            .join(Note, Note.id == NoteCentroid.note_id)
+            .filter(NoteCentroid.user_id == user_id).order_by(Note.created_at, Note.id) if len(b) == 4 * dim]
+    ids = np.array([n for n, _ in rows], dtype=np.int64)
+    matrix = np.frombuffer(b"".join(b for _, b in rows), dtype=np.float32).reshape(len(rows), dim)
+    return ids, matrix
+
+
+def _store_centroids(user_id, note_ids, centroids):
+    NoteCentroid.query.filter(NoteCentroid.note_id.in_(note_ids)).delete(synchronize_session=False)
+    if centroids:
+        db.session.execute(db.insert(NoteCentroid), [
+            {"note_id": n, "user_id": user_id, "vector_blob": v.astype(np.float32).tobytes()}
+            for n, v in centroids.items()
+        ])
+
+
+def _rebuild_edges(user_id, note_ids, ids, matrix, k):
+    """Replace the edge lists of note_ids with their k nearest earlier centroids."""
+    NoteNeighbor.query.filter(NoteNeighbor.note_id.in_(note_ids)).delete(synchronize_session=False)
+    rows = np.flatnonzero(np.isin(ids, np.asarray(list(note_ids), dtype=np.int64)))
+    k = min(k, len(ids) - 1)
+    if k <= 0 or not len(rows):
+        return
+    edges = []
+    for start in range(0, len(rows), _BLOCK_ROWS):
+        block = rows[start:start + _BLOCK_ROWS]
+        sims = matrix[block] @ matrix.T
+        sims[np.arange(len(ids)) >= block[:, None]] = -np.inf  # Itself and later notes
+        top = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+        for r, row in enumerate(block):
+            edges.extend({"note_id": int(ids[row]), "neighbor_id": int(ids[c]), "user_id": user_id,
+                          "similarity": float(sims[r, c])} for c in top[r] if np.isfinite(sims[r, c]))
+    if edges:
+        db.session.execute(db.insert(NoteNeighbor), edges)
+
+
+def update_note_graph(user_id, note_ids, provider):
+    """
+    Refresh the centroids of changed (or deleted) notes and every edge list
+    they can affect. Runs in the caller's transaction; the caller commits.
+    """
+    if not note_ids:
+        return
+    k = current_app.config.get("NOTE_GRAPH_K", 10)
+    changed = set(note_ids)
+    _store_centroids(user_id, changed, _chunk_centroids(user_id, changed, provider))
+    ids, matrix = _user_centroids(user_id, provider.dim)
+
+    # Lists that pointed at a changed note may need a different member now
+    affected = changed | {n for (n,) in db.session.query(NoteNeighbor.note_id)
+                          .filter(NoteNeighbor.neighbor_id.in_(changed))}
+
+    # Lists of later notes a changed note now beats the weakest member of (or that aren't full yet)
+    changed_rows = np.flatnonzero(np.isin(ids, np.asarray(list(changed), dtype=np.int64)))
+    if len(changed_rows):
+        weakest = dict(db.session.query(NoteNeighbor.note_id, db.func.min(NoteNeighbor.similarity))
+                       .filter(NoteNeighbor.user_id == user_id).group_by(NoteNeighbor.note_id)
+                       .having(db.func.count() >= min(k, len(ids) - 1)))
+        thresholds = np.array([weakest.get(int(n), -np.inf) for n in ids], dtype=np.float32)
+        sims = matrix[changed_rows] @ matrix.T
+        sims[np.arange(len(ids)) <= changed_rows[:, None]] = -np.inf
+        best = sims.max(axis=0)
+        affected |= {int(n) for n in ids[best > thresholds]}
+
+    _rebuild_edges(user_id, affected, ids, matrix, k)
+
+
+def rebuild_note_graph(user_id, provider):
+    """Recompute every centroid and edge for one user. Caller commits."""
+    from app.models.note import Note
+
+    note_ids = [n for (n,) in db.session.query(Note.id).filter(Note.user_id == user_id)]
+    _store_centroids(user_id, note_ids, _chunk_centroids(user_id, note_ids, provider))
+    ids, matrix = _user_centroids(user_id, provider.dim)
+    NoteNeighbor.query.filter(NoteNeighbor.user_id == user_id).delete(synchronize_session=False)
+    _rebuild_edges(user_id, ids.tolist(), ids, matrix, current_app.config.get("NOTE_GRAPH_K", 10))
+    return len(ids)
+
+
+def related_notes(note_id, limit=10):
+    """[(Note, similarity)] from the stored graph, most similar first."""
+    from app.models.note import Note
+
+    return db.session.query(Note, NoteNeighbor.similarity) \
+        .join(NoteNeighbor, NoteNeighbor.neighbor_id == Note.id) \
+        .filter(NoteNeighbor.note_id == note_id) \
+        .order_by(NoteNeighbor.similarity.desc()).limit(limit).all()
@@ -1,21 +1,55 @@
 import json
-import requests
+import time
 from flask import current_app
-from app.utils.crypto import decrypt_api_key
+from app.services import http_client
+from app.services.context_packer import estimate_tokens
+from app.services.llm_cache import cache_key, get_llm_cache
+from app.services.rate_limiter import estimate_request_tokens, get_limiter
+from app.services.resilience import get_resilience
+from app.services.single_flight import get_single_flight
+from app.utils.crypto import get_user_api_key
+
+
+def _parse_stream_line(line):
+    """
+    Parse one line of an OpenAI-style SSE stream.
+
+    Returns:
+        (done, content) — done is True at "data: [DONE]"; content is the delta text or ""
+    """
+    if not line.startswith("data: "):
+        return False, ""
+    data_str = line[6:]
+    if data_str.strip() == "[DONE]":
+        return True, ""
+    try:
+        chunk = json.loads(data_str)
+    except json.JSONDecodeError:
+        return False, ""
+    delta = chunk.get("choices", [{}])[0].get("delta", {})
+    return False, delta.get("content", "") or ""
 
 
 class OpenRouterService:
-    """Wrapper around the OpenRouter API for chat and vision completions."""
+    """
+    Wrapper around the OpenRouter API for chat and vision completions.
+
+    priority is the rate limiter lane of this service's requests:
+    "interactive" (someone is waiting on the reply) or "batch".
+    """
 
-    def __init__(self, user=None):
+    def __init__(self, user=None, priority="interactive"):
         self.base_url = current_app.config["OPENROUTER_BASE_URL"]
         self.user = user
+        self.priority = priority
+        self.resilience = get_resilience()
         self._resolve_api_key()
+        self.limiter = get_limiter(self.api_key, f"user:{user.id}" if self.has_own_key else "shared")
 
     def _resolve_api_key(self):
         """Pick user's own key if available, else admin's."""
         if self.user and self.user.has_own_api_key():
-            self.api_key = decrypt_api_key(self.user.openrouter_api_key_enc)
+            self.api_key = get_user_api_key(self.user)
             self.has_own_key = True
         else:
             self.api_key = current_app.config["OPENROUTER_API_KEY"]
@@ -37,8 +71,59 @@ class OpenRouterService:
             "X-Title": "Digital Error Notebook",
         }
 
-    def chat_completion(self, messages, model=None, temperature=0.7, max_tokens=4096):
-        """Non-streaming chat completion."""
+    def _complete(self, payload, read_timeout=None, cache=False):
+        """
+        POST a non-streaming completion and return the message text.
+
+        cache=True serves identical payloads from the LLM response cache and
+        stores fresh responses there; only for deterministic, low-temperature
+        prompts whose answer doesn't depend on when they're asked.
+
+        Identical calls by the same user that overlap in time share one
+        upstream request (see single_flight). Failed requests are retried and
+        slow ones hedged under the model's circuit breaker (see resilience);
+        each request waits its turn in the API key's limiter (see rate_limiter).
+        """
+        key = cache_key(payload)
+        llm_cache = get_llm_cache() if cache else None
+        if llm_cache is not None:
+            cached = llm_cache.get(key)
+            if cached is not None:
+                return cached
+
+        tokens = estimate_request_tokens(payload)
+
+        def send():
+            grant = self.limiter.acquire(self.priority, tokens)
+            used = None
+            try:
+                resp = http_client.post(
+                    f"{self.base_url}/chat/completions",
+                    headers=self._headers(),
+                    json=payload,
+                    read_timeout=read_timeout,
+                )
+                resp.raise_for_status()
+                data = resp.json()
+                used = (data.get("usage") or {}).get("total_tokens")
+                return data["choices"][0]["message"]["content"]
+            finally:
+                self.limiter.release(grant, used)
+
+        def call():
+            started = time.monotonic()
+            content = self.resilience.call(payload["model"], send)
+            if llm_cache is not None and content:
+                llm_cache.put(key, payload["model"], content, time.monotonic() - started)
+            return content
+
+        flight = get_single_flight()
+        if flight is None:
+            return call()
+        return flight.do(f"{self.user.id if self.user else '-'}:{key}", call)
+
+    def chat_completion(self, messages, model=None, temperature=0.7, max_tokens=4096, cache=False):
+        """Non-streaming chat completion. See _complete for cache."""
         if not model:
             model = current_app.config["DEFAULT_CHAT_MODEL"]
 
@@ -48,16 +133,7 @@ class OpenRouterService:
             "temperature": temperature,
             "max_tokens": max_tokens,
         }
-
-        resp = requests.post(
-            f"{self.base_url}/chat/completions",
-            headers=self._headers(),
-            json=payload,
-            timeout=120,
-        )
-        resp.raise_for_status()
-        data = resp.json()
-        return data["choices"][0]["message"]["content"]
+        return self._complete(payload, cache=cache)
 
     def chat_completion_stream(self, messages, model=None, temperature=0.7, max_tokens=4096):
         """Streaming chat completion — yields content chunks."""
@@ -72,36 +148,104 @@ class OpenRouterService:
             "stream": True,
         }
 
-        resp = requests.post(
-            f"{self.base_url}/chat/completions",
-            headers=self._headers(),
-            json=payload,
-            stream=True,
-            timeout=120,
-        )
-        resp.raise_for_status()
-
-        for line in resp.iter_lines():
-            if not line:
-                continue
-            line_str = line.decode("utf-8")
-            if line_str.startswith("data: "):
-                data_str = line_str[6:]
-                if data_str.strip() == "[DONE]":
-                    break
-                try:
-                    chunk = json.loads(data_str)
-                    delta = chunk.get("choices", [{}])[0].get("delta", {})
-                    content = delta.get("content", "")
+        tokens = estimate_request_tokens(payload)
+
+        def send():
+            grant = self.limiter.acquire(self.priority, tokens)
+            resp = None
+            try:
+                resp = http_client.post(
+                    f"{self.base_url}/chat/completions",
+                    headers=self._headers(),
+                    json=payload,
+                    stream=True,
+                )
+                resp.raise_for_status()
+                self.limiter.stream_opened(grant)
+                return resp, grant
+            except Exception:
+                if resp is not None:
+                    resp.close()
+                self.limiter.release(grant)
+                raise
+
+        # Only opening the stream is retried; once text has been sent to the client it can't be replayed
+        resp, grant = self.resilience.call(model, send, hedge=False)
+
+        # Read to the end rather than stopping at [DONE], so the connection goes back to the pool;
+        # closing early (client gone) discards it instead
+        produced = []
+        with resp:
+            done = False
+            try:
+                for line in resp.iter_lines():
+                    if done or not line:
+                        continue
+                    done, content = _parse_stream_line(line.decode("utf-8"))
                     if content:
+                        produced.append(content)
                         yield content
-                except json.JSONDecodeError:
-                    continue
+            except Exception as e:
+                self.resilience.stream_failed(model, e)
+                raise
+            finally:
+                # Streams report no usage; refund the reservation down to the text actually produced
+                self.limiter.release(grant, tokens - max_tokens + estimate_tokens("".join(produced)))
+
+    async def chat_completion_stream_async(self, client, messages, model, temperature=0.7, max_tokens=4096):
+        """
+        Async version of chat_completion_stream for app.asgi, on a shared
+        httpx.AsyncClient. Needs no app context, so model must be resolved.
+        """
+        payload = {
+            "model": model,
+            "messages": messages,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+            "stream": True,
+        }
+
+        tokens = estimate_request_tokens(payload)
+
+        async def send():
+            grant = await self.limiter.acquire_async(self.priority, tokens)
+            resp = None
+            try:
+                request = client.build_request(
+                    "POST", f"{self.base_url}/chat/completions", headers=self._headers(), json=payload
+                )
+                resp = await client.send(request, stream=True)
+                resp.raise_for_status()
+                self.limiter.stream_opened(grant)
+                return resp, grant
+            except Exception:
+                if resp is not None:
+                    await resp.aclose()
+                self.limiter.release(grant)
+                raise
+
+        resp, grant = await self.resilience.call_async(model, send)
+        produced = []
+        try:
+            async for line in resp.aiter_lines():
+                done, content = _parse_stream_line(line)
+                if done:
+                    break
+                if content:
+                    produced.append(content)
+                    yield content
+        except Exception as e:
+            self.resilience.stream_failed(model, e)
+            raise
+        finally:
+            await resp.aclose()
+            self.limiter.release(grant, tokens - max_tokens + estimate_tokens("".join(produced)))
 
-    def vision_completion(self, images_b64, prompt, model=None, temperature=0.3, max_tokens=8192):
+    def vision_completion(self, images_b64, prompt, model=None, temperature=0.3, max_tokens=8192, cache=False):
         """
         Send images + prompt to a vision model.
         images_b64: list of base64-encoded image strings
+        cache: see _complete; the images are part of the cache key
         Returns: model text response
         """
         if not model:
@@ -122,12 +266,4 @@ class OpenRouterService:
             "max_tokens": max_tokens,
         }
 
-        resp = requests.post(
-            f"{self.base_url}/chat/completions",
-            headers=self._headers(),
-            json=payload,
-            timeout=180,
-        )
-        resp.raise_for_status()
-        data = resp.json()
-        return data["choices"][0]["message"]["content"]
+        return self._complete(payload, read_timeout=current_app.config.get("HTTP_VISION_READ_TIMEOUT", 180), cache=cache)
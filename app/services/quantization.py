@@ -0,0 +1,256 @@
+import numpy as np
+
+FORMATS = ("float32", "float16", "int8", "sparse")
+
+_BLOCK_ROWS = 8192
+
+
+class QuantizedMatrix:
+    """
+    Row-major matrix of quantized vectors.
+
+    float16: codes hold the halves, scales is None.
+    int8:    codes hold round(x / scale) per row, scales the per-row float32 scale.
+
+    Supports the operations retrieval needs — len, shape, row indexing and
+    matrix @ vector — without materializing a float32 copy of the whole matrix;
+    scoring upcasts one block of rows at a time.
+    """
+
+    def __init__(self, codes, scales=None):
+        self.codes = codes
+        self.scales = scales
+
+    @property
+    def format(self):
+        return "int8" if self.scales is not None else "float16"
+
+    @property
+    def shape(self):
+        return self.codes.shape
+
+    @property
+    def nbytes(self):
+        return self.codes.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, rows):
+        return QuantizedMatrix(self.codes[rows], self.scales[rows] if self.scales is not None else None)
+
+    def __array__(self, dtype=None, copy=None):
+        dense = self.codes.astype(np.float32)
+        if self.scales is not None:
+            dense *= self.scales[:, None]
+        return dense if dtype is None else dense.astype(dtype, copy=False)
+
+    def __matmul__(self, query_vec):
+        query_vec = np.asarray(query_vec, dtype=np.float32)
+        out = np.empty(len(self.codes), dtype=np.float32)
+        for start in range(0, len(self.codes), _BLOCK_ROWS):
+            block = self.codes[start:start + _BLOCK_ROWS].astype(np.float32) @ query_vec
+            if self.scales is not None:
+                block *= self.scales[start:start + _BLOCK_ROWS]
+            out[start:start + len(block)] = block
+        return out
+
+
+class SparseMatrix:
+    """
+    Row-major (CSR) matrix of sparse vectors: row i holds values data[indptr[i]:indptr[i+1]]
+    at columns indices[indptr[i]:indptr[i+1]].
+
+    Hashed embeddings touch only a few dozen of their buckets, so memory and
+    scoring cost follow the number of non-zeros rather than the dimension.
+    matrix @ query_vec is a sparse-dense product: gather the query at the
+    stored columns, multiply, and sum per row with np.add.reduceat.
+    """
+
+    def __init__(self, indptr, indices, data, dim):
+        self.indptr = indptr
+        self.indices = indices
+        self.data = data
+        self.dim = dim
+
+    format = "sparse"
+
+    @property
+    def shape(self):
+        return (len(self.indptr) - 1, self.dim)
+
+    @property
+    def nbytes(self):
+        return self.indptr.nbytes + self.indices.nbytes + self.data.nbytes
+
+    def __len__(self):
+        return len(self.indptr) - 1
+
+    def __getitem__(self, rows):
+        if isinstance(rows, slice):
+            rows = np.arange(len(self))[rows]
+        rows = np.asarray(rows)
+        if rows.dtype == bool:
+            rows = np.flatnonzero(rows)
+        starts, ends = self.indptr[rows], self.indptr[rows + 1]
+        lengths = ends - starts
+        indptr = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+        # Positions of every selected non-zero in the source arrays
+        pos = np.arange(indptr[-1], dtype=np.int64) + np.repeat(starts - indptr[:-1], lengths)
+        return SparseMatrix(indptr, self.indices[pos], self.data[pos], self.dim)
+
+    def __array__(self, dtype=None, copy=None):
+        dense = np.zeros(self.shape, dtype=np.float32)
+        row_of = np.repeat(np.arange(len(self)), np.diff(self.indptr))
+        dense[row_of, self.indices] = self.data
+        return dense if dtype is None else dense.astype(dtype, copy=False)
+
+    def __matmul__(self, query_vec):
+        query_vec = np.asarray(query_vec, dtype=np.float32)
+        out = np.zeros(len(self), dtype=np.float32)
+        if not len(self.data):
+            return out
+        products = self.data * query_vec[self.indices]
+        nonempty = np.diff(self.indptr) > 0
+        # reduceat needs strictly valid start offsets; empty rows keep their zero
+        out[nonempty] = np.add.reduceat(products, self.indptr[:-1][nonempty])
+        return out
+
+
+def to_sparse(matrix):
+    """CSR form of a dense float32 (n, dim) matrix, keeping only non-zero entries."""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    rows, cols = np.nonzero(matrix)
+    indptr = np.concatenate([[0], np.cumsum(np.bincount(rows, minlength=len(matrix)))]).astype(np.int64)
+    return SparseMatrix(indptr, cols.astype(np.uint32), matrix[rows, cols], matrix.shape[1])
+
+
+def quantize(matrix, fmt):
+    """Convert a float32 (n, dim) matrix to the given storage format."""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    if fmt == "float32":
+        return matrix
+    if fmt == "sparse":
+        return to_sparse(matrix)
+    if fmt == "float16":
+        return QuantizedMatrix(matrix.astype(np.float16))
+    if fmt == "int8":
+        scales = np.abs(matrix).max(axis=1) / 127.0 if len(matrix) else np.zeros(0, dtype=np.float32)
+        scales = scales.astype(np.float32)
+        safe = np.where(scales > 0, scales, 1.0)[:, None]
+        codes = np.clip(np.rint(matrix / safe), -127, 127).astype(np.int8)
+        return QuantizedMatrix(codes, scales)
+    raise ValueError(f"Unknown vector format: {fmt}")
+
+
+def blob_size(fmt, dim):
+    """Bytes of one stored vector, or None for variable-length (sparse) blobs."""
+    if fmt == "sparse":
+        return None
+    if fmt == "float16":
+        return 2 * dim
+    if fmt == "int8":
+        return 4 + dim  # float32 scale + one byte per component
+    return 4 * dim
+
+
+def blob_matches(blob, fmt, dim):
+    """Whether a stored blob can hold a vector of this dimension in its format."""
+    if fmt == "sparse":
+        return len(blob) % 8 == 0 and len(blob) // 8 <= dim
+    return len(blob) == blob_size(fmt, dim)
+
+
+def encode_vectors(matrix, fmt):
+    """
+    Serialize each row of a float32 matrix into a vector_blob in the given format.
+    Sparse blobs are the row's uint32 column indices followed by its float32 values.
+    """
+    q = quantize(matrix, fmt)
+    if fmt == "sparse":
+        return [
+            q.indices[start:end].tobytes() + q.data[start:end].tobytes()
+            for start, end in zip(q.indptr[:-1], q.indptr[1:])
+        ]
+    if fmt == "float32":
+        return [row.tobytes() for row in q]
+    if fmt == "float16":
+        return [row.tobytes() for row in q.codes]
+    return [scale.tobytes() + row.tobytes() for scale, row in zip(q.scales, q.codes)]
+
+
+def decode_blobs(blobs, formats, dim, target="float32"):
+    """
+    Turn stored vector blobs (each with its own format, None meaning float32)
+    into one matrix in the target format.
+    """
+    n = len(blobs)
+    formats = [f or "float32" for f in formats]
+    if target == "sparse" and all(f == "sparse" for f in formats):
+        return _decode_sparse(blobs, dim)
+    if n and all(f == target for f in formats):
+        joined = b"".join(blobs)
+        if target == "float32":
+            return np.frombuffer(joined, dtype=np.float32).reshape(n, dim)
+        if target == "float16":
+            return QuantizedMatrix(np.frombuffer(joined, dtype=np.float16).reshape(n, dim))
+        packed = np.frombuffer(joined, dtype=np.uint8).reshape(n, 4 + dim)
+        return QuantizedMatrix(packed[:, 4:].view(np.int8), packed[:, :4].copy().view(np.float32).ravel())
+
+    # Mixed formats (e.g. mid-migration): go through float32
+    dense = np.zeros((n, dim), dtype=np.float32)
+    for i, (blob, fmt) in enumerate(zip(blobs, formats)):
+        if fmt == "float16":
+            dense[i] = np.frombuffer(blob, dtype=np.float16)
+        elif fmt == "int8":
+            dense[i] = np.frombuffer(blob[4:], dtype=np.int8) * np.frombuffer(blob[:4], dtype=np.float32)[0]
+        elif fmt == "sparse":
+            row = _decode_sparse([blob], dim)
+            dense[i, row.indices] = row.data
+        else:
+            dense[i] = np.frombuffer(blob, dtype=np.float32)
+    return quantize(dense, target)
+
+
+def _decode_sparse(blobs, dim):
+    """Parse sparse blobs into one SparseMatrix without a Python loop over entries."""
+    nnz = np.fromiter((len(b) // 8 for b in blobs), dtype=np.int64, count=len(blobs))
+    indptr = np.concatenate([[0], np.cumsum(nnz)]).astype(np.int64)
+    words = np.frombuffer(b"".join(blobs), dtype=np.uint32)
+    # Row r occupies words[2*indptr[r] : 2*indptr[r+1]]: its indices, then its values
+    index_pos = np.arange(indptr[-1], dtype=np.int64) + np.repeat(indptr[:-1], nnz)
+    indices = words[index_pos]
+    data = words[index_pos + np.repeat(nnz, nnz)].view(np.float32)
+    if len(indices) and indices.max() >= dim:
+        # Columns from a larger dimension can't be scored; drop them
+        keep = indices < dim
+        row_of = np.repeat(np.arange(len(blobs)), nnz)
+        indptr = np.concatenate([[0], np.cumsum(np.bincount(row_of[keep], minlength=len(blobs)))]).astype(np.int64)
+        indices, data = indices[keep], data[keep]
+    return SparseMatrix(indptr, indices, data, dim)
+
+
+def ranking_agreement(dense, quantized, queries, k=8):
+    """
+    How closely quantized scoring reproduces float32 rankings.
+
+    Returns:
+        dict with mean overlap@k of the top-k sets, top-1 agreement rate and
+        mean absolute score error over the float32 top-k
+    """
+    k = min(k, len(dense))
+    overlap, top1, err = 0.0, 0, 0.0
+    for q in queries:
+        exact = dense @ q
+        approx = quantized @ q
+        exact_top = np.argpartition(-exact, k - 1)[:k]
+        approx_top = np.argpartition(-approx, k - 1)[:k]
+        overlap += len(set(exact_top.tolist()) & set(approx_top.tolist())) / k
+        top1 += int(np.argmax(exact) == np.argmax(approx))
+        err += float(np.abs(exact[exact_top] - approx[exact_top]).mean())
+    n = max(len(queries), 1)
+    return {
+        "overlap_at_k": round(overlap / n, 4),
+        "top1_agreement": round(top1 / n, 4),
+        "mean_abs_score_error": round(err / n, 6),
+    }
@@ -0,0 +1,285 @@
+"""
+Client-side limits on outbound LLM requests, per API key.
+
+Every user without their own key shares OPENROUTER_API_KEY, so a burst of
+uploads (each a detection call plus one reconciliation call per mistake)
+can run into the provider's rate limit, and then every user gets 429s.
+Each key instead gets, in this worker process:
+
+- a concurrency limit (LLM_LIMIT_CONCURRENCY requests in flight). A
+  streamed reply holds its slot only until the response starts. After
+  that, the rest of the stream only occupies a connection, and holding
+  the slot for a minute-long reply would queue every other chat behind it.
+- a request bucket (LLM_LIMIT_RPM) and a token bucket (LLM_LIMIT_TPM),
+  each refilled continuously and holding at most one minute's worth. A
+  request reserves its estimated prompt tokens plus max_tokens. When the
+  response reports its usage, the unused part is refunded.
+- two priority lanes. Waiting "interactive" requests (chat, quizzes) always
+  go before waiting "batch" ones (the vision pipeline), and batch requests
+  may hold at most LLM_LIMIT_BATCH_SHARE of the concurrency slots, so a
+  chat reply never queues behind a whole upload.
+
+A request that can't start within LLM_LIMIT_MAX_WAIT seconds fails with
+LimiterTimeout. Limits are per worker process; divide the provider's
+limits by the number of workers.
+"""
+import asyncio
+import hashlib
+import heapq
+import itertools
+import math
+import threading
+import time
+from flask import current_app
+from app.services.context_packer import estimate_tokens
+from app.utils.lru import LRUCache
+
+LANES = ("interactive", "batch")
+_IMAGE_TOKENS = 1000  # Rough prompt cost of one image part
+_ASYNC_POLL_SECONDS = 0.05
+
+
+class LimiterTimeout(RuntimeError):
+    """Raised when a request waited LLM_LIMIT_MAX_WAIT seconds without getting to run."""
+
+
+def estimate_request_tokens(payload):
+    """Tokens a completion payload may use: its prompt estimate plus max_tokens."""
+    tokens = payload.get("max_tokens") or 0
+    for message in payload["messages"]:
+        content = message.get("content")
+        if isinstance(content, str):
+            tokens += estimate_tokens(content)
+            continue
+        for part in content or []:
+            if part.get("type") == "text":
+                tokens += estimate_tokens(part.get("text", ""))
+            else:
+                tokens += _IMAGE_TOKENS
+    return tokens
+
+
+class _Bucket:
+    """Token bucket holding at most one minute's worth of its per-minute rate; rate 0 = unlimited."""
+
+    def __init__(self, per_minute):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self.level = float(per_minute)
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        if self.rate:
+            self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_for(self, amount):
+        """Seconds until amount (capped at capacity) is available; 0 if it is now."""
+        if not self.rate:
+            return 0.0
+        return max(min(amount, self.capacity) - self.level, 0.0) / self.rate
+
+    def take(self, amount):
+        if self.rate:
+            self.level -= min(amount, self.capacity)
+
+    def give(self, amount):
+        if self.rate:
+            self.level = min(self.capacity, self.level + amount)
+
+
+class Grant:
+    def __init__(self, lane, tokens):
+        self.lane = lane
+        self.tokens = tokens
+        self.streaming = False  # Slot handed back by stream_opened(); tokens still reserved
+
+
+class KeyLimiter:
+    def __init__(self, label, concurrency=32, rpm=0, tpm=0, batch_share=0.75, max_wait=120):
+        self.label = label
+        self.concurrency = concurrency
+        self.batch_slots = max(1, math.floor(concurrency * batch_share)) if concurrency else 0
+        self.max_wait = max_wait
+        self._requests = _Bucket(rpm)
+        self._tokens = _Bucket(tpm)
+        self._cond = threading.Condition()
+        self._queue = []  # heap of (lane index, arrival, tokens) tickets
+        self._arrivals = itertools.count()
+        self.in_flight = dict.fromkeys(LANES, 0)
+        self.streaming = dict.fromkeys(LANES, 0)
+        self.granted = dict.fromkeys(LANES, 0)
+        self.timeouts = dict.fromkeys(LANES, 0)
+        self.wait_total = dict.fromkeys(LANES, 0.0)
+        self.wait_max = dict.fromkeys(LANES, 0.0)
+
+    def _enqueue(self, lane, tokens):
+        if lane not in LANES:
+            raise ValueError(f"Unknown priority lane: {lane}")
+        ticket = (LANES.index(lane), next(self._arrivals), tokens)
+        with self._cond:
+            heapq.heappush(self._queue, ticket)
+        return ticket
+
+    def _try(self, ticket):
+        """
+        Grant ticket if it is first in line and fits now. Call with the lock held.
+
+        Returns:
+            (grant, wait) — a Grant, or None and roughly how long until the
+            buckets could admit it (None if it waits for a slot or its turn)
+        """
+        if self._queue[0] is not ticket:
+            return None, None
+        lane = LANES[ticket[0]]
+        if self.concurrency and (
+            sum(self.in_flight.values()) >= self.concurrency
+            or (lane == "batch" and self.in_flight["batch"] >= self.batch_slots)
+        ):
+            return None, None
+        now = time.monotonic()
+        self._requests.refill(now)
+        self._tokens.refill(now)
+        wait = max(self._requests.wait_for(1), self._tokens.wait_for(ticket[2]))
+        if wait > 0:
+            return None, wait
+        heapq.heappop(self._queue)
+        self._requests.take(1)
+        self._tokens.take(ticket[2])
+        self.in_flight[lane] += 1
+        self._cond.notify_all()  # The next ticket is now first in line
+        return Grant(lane, ticket[2]), None
+
+    def _finish_wait(self, ticket, grant, started):
+        lane = LANES[ticket[0]]
+        waited = time.monotonic() - started
+        with self._cond:
+            if grant is None:
+                self._queue.remove(ticket)
+                heapq.heapify(self._queue)
+                self.timeouts[lane] += 1
+                self._cond.notify_all()
+            else:
+                self.granted[lane] += 1
+            self.wait_total[lane] += waited
+            self.wait_max[lane] = max(self.wait_max[lane], waited)
+        if grant is None:
+            raise LimiterTimeout(
+                f"Too many requests queued for this API key; gave up after {waited:.0f}s, try again shortly"
+            )
+        return grant
+
+    def acquire(self, lane, tokens):
+        """Block until a request in lane reserving tokens may start. Pass the Grant to release()."""
+        started = time.monotonic()
+        deadline = started + self.max_wait
+        ticket = self._enqueue(lane, tokens)
+        grant = None
+        with self._cond:
+            while True:
+                grant, wait = self._try(ticket)
+                remaining = deadline - time.monotonic()
+                if grant is not None or remaining <= 0:
+                    break
+                self._cond.wait(min(wait if wait is not None else remaining, remaining))
+        return self._finish_wait(ticket, grant, started)
+
+    async def acquire_async(self, lane, tokens):
+        """acquire() for the event loop: polls instead of blocking the thread."""
+        started = time.monotonic()
+        deadline = started + self.max_wait
+        ticket = self._enqueue(lane, tokens)
+        while True:
+            with self._cond:
+                grant, wait = self._try(ticket)
+            remaining = deadline - time.monotonic()
+            if grant is not None or remaining <= 0:
+                break
+            await asyncio.sleep(min(wait or _ASYNC_POLL_SECONDS, _ASYNC_POLL_SECONDS, remaining))
+        return self._finish_wait(ticket, grant, started)
+
+    def stream_opened(self, grant):
+        """A granted streaming request got its response: free its slot. Call release() when the stream ends."""
+        with self._cond:
+            self.in_flight[grant.lane] -= 1
+            self.streaming[grant.lane] += 1
+            grant.streaming = True
+            self._cond.notify_all()
+
+    def release(self, grant, used_tokens=None):
+        """End a granted request; used_tokens (from the response's usage) refunds the unused reservation."""
+        with self._cond:
+            if grant.streaming:
+                self.streaming[grant.lane] -= 1
+            else:
+                self.in_flight[grant.lane] -= 1
+            if used_tokens is not None and used_tokens < grant.tokens:
+                self._tokens.refill(time.monotonic())
+                self._tokens.give(grant.tokens - used_tokens)
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            now = time.monotonic()
+            self._requests.refill(now)
+            self._tokens.refill(now)
+            queued = dict.fromkeys(LANES, 0)
+            for ticket in self._queue:
+                queued[LANES[ticket[0]]] += 1
+            return {
+                "in_flight": dict(self.in_flight),
+                "streaming": dict(self.streaming),
+                "queued": queued,
+                "granted": dict(self.granted),
+                "timeouts": dict(self.timeouts),
+                "avg_wait": {
+                    lane: round(self.wait_total[lane] / max(self.granted[lane] + self.timeouts[lane], 1), 3)
+                    for lane in LANES
+                },
+                "max_wait": {lane: round(self.wait_max[lane], 3) for lane in LANES},
+                "requests_available": round(self._requests.level, 1) if self._requests.rate else None,
+                "tokens_available": round(self._tokens.level) if self._tokens.rate else None,
+            }
+
+
+_lock = threading.Lock()
+_limiters = None
+_limiters_key = None
+
+
+def get_limiter(api_key, label):
+    """
+    The limiter for an API key, shared by every service using that key.
+    label names it in stats without exposing the key.
+
+    Limiters are kept in an LRU of LLM_LIMIT_KEYS entries, so keys that stop
+    making calls are evicted instead of piling up for every user who ever
+    brought their own. A service keeps the limiter it was given, so an
+    eviction never strands a request in flight.
+    """
+    global _limiters, _limiters_key
+    config = current_app.config
+    settings = (
+        config.get("LLM_LIMIT_CONCURRENCY", 32),
+        config.get("LLM_LIMIT_RPM", 0),
+        config.get("LLM_LIMIT_TPM", 0),
+        config.get("LLM_LIMIT_BATCH_SHARE", 0.75),
+        config.get("LLM_LIMIT_MAX_WAIT", 120),
+    )
+    capacity = config.get("LLM_LIMIT_KEYS", 1024)
+    key_id = hashlib.sha256((api_key or "").encode()).hexdigest()
+    with _lock:
+        if _limiters is None or (settings, capacity) != _limiters_key:
+            _limiters = LRUCache(capacity)
+            _limiters_key = (settings, capacity)
+        limiter = _limiters.get(key_id)
+        if limiter is None:
+            limiter = KeyLimiter(label, *settings)
+            _limiters.put(key_id, limiter)
+        return limiter
+
+
+def rate_limiter_stats():
+    with _lock:
+        limiters = _limiters.values() if _limiters is not None else []
+    return {limiter.label: limiter.stats() for limiter in limiters}
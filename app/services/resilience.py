@@ -0,0 +1,341 @@
+"""
+Retries, hedging and circuit breaking for upstream LLM calls.
+
+- Retries: 408, 429, 5xx and connection errors are retried up to
+  LLM_RETRY_ATTEMPTS times with full-jitter exponential backoff. A
+  Retry-After header sets the wait instead; one longer than
+  LLM_RETRY_MAX_DELAY fails the call at once. Read timeouts are not retried:
+  the provider has already stalled for the whole timeout.
+- Hedging (LLM_HEDGE_PERCENTILE, off by default): a non-streaming call still
+  running after that percentile of the model's recent latencies gets a second,
+  identical request, and the first response wins. This costs extra tokens, so
+  it is meant for latency-sensitive deployments.
+- Circuit breaker, per model: LLM_BREAKER_FAILURES consecutive 5xx, timeouts
+  or connection errors open the circuit. Calls then fail fast with
+  CircuitOpenError for LLM_BREAKER_COOLDOWN seconds, after which a single
+  probe call decides whether it closes again. 429 and other 4xx responses
+  depend on the API key and the request, not on the model's health, so they
+  never open it.
+"""
+import asyncio
+import os
+import random
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+import httpx
+import requests
+from flask import current_app, has_app_context
+
+_RETRY_STATUSES = {408, 429, 500, 502, 503, 504}
+_LATENCY_WINDOW = 200  # Recent successful call latencies kept per model for the hedge delay
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised instead of calling a model whose circuit is open."""
+
+
+def _retry_after(headers):
+    value = headers.get("Retry-After") if headers is not None else None
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max((parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+def _classify(exc):
+    """
+    Returns:
+        (reason, retryable, unhealthy, retry_after) for an exception raised
+        by a requests or httpx call; reason is None for anything else
+    """
+    response = getattr(exc, "response", None)
+    status = getattr(response, "status_code", None)
+    if status is not None:
+        return str(status), status in _RETRY_STATUSES, status >= 500 or status == 408, _retry_after(response.headers)
+    if isinstance(exc, (requests.ReadTimeout, httpx.ReadTimeout)):
+        return "read_timeout", False, True, None
+    if isinstance(exc, (requests.ConnectionError, httpx.ConnectError, httpx.ConnectTimeout, httpx.RemoteProtocolError)):
+        return "connection", True, True, None
+    if isinstance(exc, (requests.RequestException, httpx.TransportError)):
+        return "transport", False, True, None
+    return None, False, False, None
+
+
+class CircuitBreaker:
+    def __init__(self, threshold, cooldown):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.state = "closed"  # closed -> open -> half_open -> closed (or open again)
+        self.failures = 0
+        self.opened_at = 0.0
+        self.opens = 0
+        self.rejected = 0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Whether a call may go upstream now; in half_open, only one probe at a time."""
+        with self._lock:
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.cooldown:
+                self.state = "half_open"
+            if self.state == "closed":
+                return True
+            if self.state == "half_open" and not self._probing:
+                self._probing = True
+                return True
+            self.rejected += 1
+            return False
+
+    def retry_in(self):
+        with self._lock:
+            return max(self.cooldown - (time.monotonic() - self.opened_at), 0.0) if self.state == "open" else 0.0
+
+    def record(self, ok):
+        """Record a call's outcome. Returns True if this opened the circuit."""
+        with self._lock:
+            self._probing = False
+            if ok:
+                self.state, self.failures = "closed", 0
+                return False
+            self.failures += 1
+            if self.state == "half_open" or self.failures >= self.threshold:
+                opened = self.state != "open"
+                self.state, self.opened_at = "open", time.monotonic()
+                self.opens += opened
+                return opened
+            return False
+
+    def release(self):
+        """End a call that says nothing about the model's health (4xx, 429)."""
+        with self._lock:
+            self._probing = False
+
+    def stats(self):
+        retry_in = self.retry_in()
+        with self._lock:
+            return {
+                "state": self.state,
+                "consecutive_failures": self.failures,
+                "opens": self.opens,
+                "rejected": self.rejected,
+                "retry_in": round(retry_in, 1),
+            }
+
+
+class Resilience:
+    def __init__(self, attempts=3, base_delay=0.5, max_delay=20, breaker_failures=5, breaker_cooldown=30,
+                 hedge_percentile=0, hedge_min_samples=20, hedge_threads=32):
+        self.attempts = max(attempts, 1)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.breaker_failures = breaker_failures
+        self.breaker_cooldown = breaker_cooldown
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        self.hedge_threads = hedge_threads
+        self._breakers = {}
+        self._latencies = {}
+        self._lock = threading.Lock()
+        self._pool = None
+        self._pool_pid = None
+        self.calls = 0
+        self.retries = Counter()  # reason -> retries
+        self.failed = Counter()  # reason -> calls that failed for good
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    def breaker(self, model):
+        with self._lock:
+            breaker = self._breakers.get(model)
+            if breaker is None:
+                breaker = self._breakers[model] = CircuitBreaker(self.breaker_failures, self.breaker_cooldown)
+            return breaker
+
+    def _admit(self, model):
+        breaker = self.breaker(model)
+        if not breaker.allow():
+            raise CircuitOpenError(
+                f"{model} is failing upstream; requests to it are paused for {breaker.retry_in():.0f}s"
+            )
+        return breaker
+
+    def _on_error(self, model, breaker, attempt, exc):
+        """Record a failed attempt. Returns the delay before the next one, or None to give up."""
+        reason, retryable, unhealthy, retry_after = _classify(exc)
+        if unhealthy:
+            if breaker.record(False) and has_app_context():
+                current_app.logger.warning(f"Circuit opened for {model} after {breaker.failures} failures: {exc}")
+        else:
+            breaker.release()
+
+        delay = None
+        if retryable and attempt + 1 < self.attempts:
+            if retry_after is not None:
+                delay = retry_after + random.uniform(0, self.base_delay) if retry_after <= self.max_delay else None
+            else:
+                delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        with self._lock:
+            if delay is None:
+                self.failed[reason or "other"] += 1
+            else:
+                self.retries[reason] += 1
+        return delay
+
+    def call(self, model, send, hedge=True):
+        """
+        send() with retries under the model's circuit breaker; hedged when
+        enabled (never for streams: pass hedge=False).
+        """
+        with self._lock:
+            self.calls += 1
+        for attempt in range(self.attempts):
+            breaker = self._admit(model)
+            try:
+                result = self._hedged(model, send, breaker) if hedge else send()
+            except Exception as e:
+                delay = self._on_error(model, breaker, attempt, e)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                continue
+            breaker.record(True)
+            return result
+
+    async def call_async(self, model, send):
+        """call() for the async relay: send is a coroutine function; no hedging."""
+        with self._lock:
+            self.calls += 1
+        for attempt in range(self.attempts):
+            breaker = self._admit(model)
+            try:
+                result = await send()
+            except Exception as e:
+                delay = self._on_error(model, breaker, attempt, e)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                continue
+            breaker.record(True)
+            return result
+
+    def stream_failed(self, model, exc):
+        """A stream that opened fine broke while being read."""
+        if _classify(exc)[2]:
+            self.breaker(model).record(False)
+
+    def _timed(self, model, send):
+        started = time.monotonic()
+        result = send()
+        with self._lock:
+            samples = self._latencies.get(model)
+            if samples is None:
+                samples = self._latencies[model] = deque(maxlen=_LATENCY_WINDOW)
+            samples.append(time.monotonic() - started)
+        return result
+
+    def hedge_delay(self, model):
+        """Seconds after which a call to model gets a hedged second request, or None."""
+        if self.hedge_percentile <= 0:
+            return None
+        with self._lock:
+            samples = sorted(self._latencies.get(model, ()))
+        if len(samples) < self.hedge_min_samples:
+            return None
+        return samples[min(int(len(samples) * self.hedge_percentile / 100), len(samples) - 1)]
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None or self._pool_pid != os.getpid():
+                self._pool = ThreadPoolExecutor(max_workers=self.hedge_threads, thread_name_prefix="hedge")
+                self._pool_pid = os.getpid()
+            return self._pool
+
+    def _hedged(self, model, send, breaker):
+        delay = self.hedge_delay(model)
+        # A half-open circuit lets exactly one probe through, so only a healthy model gets a second request
+        if delay is None or breaker.state != "closed":
+            return self._timed(model, send)
+
+        app = current_app._get_current_object()
+
+        def run():
+            with app.app_context():
+                return self._timed(model, send)
+
+        pool = self._get_pool()
+        first = pool.submit(run)
+        if wait([first], timeout=delay).done or breaker.state != "closed":
+            return first.result()
+
+        # The loser is left to finish in the pool; its connection then goes back to the pool
+        second = pool.submit(run)
+        with self._lock:
+            self.hedges += 1
+        pending = {first, second}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is second:
+                        with self._lock:
+                            self.hedge_wins += 1
+                    return future.result()
+        return first.result()  # Both failed: raise the original request's error
+
+    def stats(self):
+        with self._lock:
+            models = sorted(set(self._breakers) | set(self._latencies))
+            stats = {
+                "calls": self.calls,
+                "retries": sum(self.retries.values()),
+                "retry_reasons": dict(self.retries),
+                "failed": dict(self.failed),
+                "hedges": self.hedges,
+                "hedge_wins": self.hedge_wins,
+            }
+        stats["models"] = {}
+        for model in models:
+            delay = self.hedge_delay(model)
+            stats["models"][model] = {
+                **self.breaker(model).stats(),
+                "hedge_after": round(delay, 3) if delay is not None else None,
+            }
+        return stats
+
+
+_resilience = None
+_resilience_key = None
+
+
+def get_resilience():
+    """The process's Resilience, rebuilt when its settings change."""
+    global _resilience, _resilience_key
+    config = current_app.config
+    key = (
+        config.get("LLM_RETRY_ATTEMPTS", 3),
+        config.get("LLM_RETRY_BASE_DELAY", 0.5),
+        config.get("LLM_RETRY_MAX_DELAY", 20),
+        config.get("LLM_BREAKER_FAILURES", 5),
+        config.get("LLM_BREAKER_COOLDOWN", 30),
+        config.get("LLM_HEDGE_PERCENTILE", 0),
+        config.get("LLM_HEDGE_MIN_SAMPLES", 20),
+        config.get("LLM_HEDGE_THREADS", 32),
+    )
+    if _resilience is None or key != _resilience_key:
+        _resilience = Resilience(*key)
+        _resilience_key = key
+    return _resilience
+
+
+def resilience_stats():
+    return get_resilience().stats()
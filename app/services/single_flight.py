@@ -0,0 +1,184 @@
+"""
+Single-flight deduplication of identical in-flight LLM calls.
+
+A double-clicked "Generate new questions" or a retried upload sends the same
+payload twice while the first call is still running. The first caller (the
+leader) makes the upstream call; callers with the same key that arrive
+before it finishes wait and receive its result instead of paying for their
+own call.
+
+    local   in-process: one Future per key (per worker)
+    sqlite  also across the workers of a host: the leader claims the key in
+            SINGLE_FLIGHT_PATH and publishes its result there; other workers
+            poll for it. If the leader fails, a waiting worker takes over.
+
+Keys include the user, so different users never share a result here.
+"""
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from flask import current_app
+from app.utils.sqlite_file import SQLiteFile
+
+_POLL_SECONDS = 0.1
+_RESULT_RETENTION = 60  # Seconds a published result stays for late pollers
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS flights (
+    key TEXT PRIMARY KEY,
+    pid INTEGER NOT NULL,
+    started_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS flight_results (
+    key TEXT PRIMARY KEY,
+    response TEXT NOT NULL,
+    finished_at REAL NOT NULL
+);
+"""
+
+
+class SQLiteFlightBackend:
+    """Cross-worker claims and results in a SQLite file."""
+
+    def __init__(self, path):
+        self._db = SQLiteFile(path, _SCHEMA)
+
+    def run(self, key, fn, wait):
+        """Run fn() as the host-wide leader for key, or return the result another worker publishes."""
+        conn = self._db.conn()
+        deadline = time.monotonic() + wait
+        while True:
+            now = time.time()
+            conn.execute("DELETE FROM flights WHERE key = ? AND started_at < ?", (key, now - wait))  # Crashed leader
+            claimed = conn.execute(
+                "INSERT OR IGNORE INTO flights (key, pid, started_at) VALUES (?, ?, ?)", (key, os.getpid(), now)
+            ).rowcount == 1
+            if claimed:
+                return self._lead(conn, key, fn), False
+
+            # Another worker is calling; only a result finished after we saw its claim is ours
+            while time.monotonic() < deadline:
+                time.sleep(_POLL_SECONDS)
+                row = conn.execute(
+                    "SELECT response FROM flight_results WHERE key = ? AND finished_at >= ?", (key, now)
+                ).fetchone()
+                if row is not None:
+                    return row[0], True
+                if conn.execute("SELECT 1 FROM flights WHERE key = ?", (key,)).fetchone() is None:
+                    break  # Leader failed without a result; try to take over
+            else:
+                raise TimeoutError(f"Gave up waiting {wait}s for an identical in-flight request")
+
+    def _lead(self, conn, key, fn):
+        try:
+            result = fn()
+        except BaseException:
+            conn.execute("DELETE FROM flights WHERE key = ?", (key,))  # Waiting workers take over
+            raise
+        try:
+            now = time.time()
+            conn.execute("DELETE FROM flight_results WHERE finished_at < ?", (now - _RESULT_RETENTION,))
+            conn.execute(
+                "INSERT OR REPLACE INTO flight_results (key, response, finished_at) VALUES (?, ?, ?)",
+                (key, result, now),
+            )
+            conn.execute("DELETE FROM flights WHERE key = ?", (key,))
+        except sqlite3.Error as e:
+            # The call itself succeeded; waiting workers will time out the claim and call again
+            current_app.logger.warning(f"Publishing a single-flight result failed: {e}")
+        return result
+
+
+class SingleFlight:
+    def __init__(self, backend=None, wait=200):
+        self.backend = backend
+        self.wait = wait
+        self._calls = {}  # key -> Future of the leader's result
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.shared_local = 0
+        self.shared_remote = 0
+        self.backend_errors = 0
+
+    def do(self, key, fn):
+        """
+        fn() once per key at a time; concurrent callers with the same key get
+        the leader's result (or its exception).
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+                self.leaders += 1
+            else:
+                self.shared_local += 1
+        if not leader:
+            return future.result(timeout=self.wait)
+
+        try:
+            result = self._run(key, fn)
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+
+    def _run(self, key, fn):
+        if self.backend is None:
+            return fn()
+        try:
+            result, shared = self.backend.run(key, fn, self.wait)
+        except sqlite3.Error as e:
+            self.backend_errors += 1
+            current_app.logger.warning(f"Single-flight backend failed, calling upstream directly: {e}")
+            return fn()
+        if shared:
+            with self._lock:
+                self.shared_remote += 1
+        return result
+
+    def stats(self):
+        with self._lock:
+            return {
+                "backend": "sqlite" if self.backend is not None else "local",
+                "in_flight": len(self._calls),
+                "leaders": self.leaders,
+                "shared_local": self.shared_local,
+                "shared_remote": self.shared_remote,
+                "backend_errors": self.backend_errors,
+            }
+
+
+_flight = None
+_flight_key = None
+
+
+def get_single_flight():
+    """The configured single-flight group, or None when SINGLE_FLIGHT is "off"."""
+    global _flight, _flight_key
+    config = current_app.config
+    backend = config.get("SINGLE_FLIGHT", "local")
+    if backend == "off":
+        return None
+    path = config.get("SINGLE_FLIGHT_PATH") or os.path.join(current_app.instance_path, "single_flight.db")
+    key = (backend, path, config.get("SINGLE_FLIGHT_WAIT", 200))
+    if _flight is None or key != _flight_key:
+        if backend == "sqlite":
+            _flight = SingleFlight(SQLiteFlightBackend(path), wait=key[2])
+        elif backend == "local":
+            _flight = SingleFlight(wait=key[2])
+        else:
+            raise ValueError(f"Unknown SINGLE_FLIGHT backend: {backend}")
+        _flight_key = key
+    return _flight
+
+
+def single_flight_stats():
+    flight = get_single_flight()
+    return flight.stats() if flight is not None else {"backend": "off"}
@@ -0,0 +1,77 @@
+"""
+Incremental persistence of streamed assistant replies.
+
+Chunks are collected in a list and joined only when written, so a long reply
+costs linear time. The reply is saved as a "partial" ChatMessage at the first
+checkpoint and rewritten whenever CHAT_CHECKPOINT_CHARS more characters or
+CHAT_CHECKPOINT_SECONDS have passed, so a worker crash or client disconnect
+loses at most one interval instead of the whole response.
+
+Buffering (feed/take) and writing (save) are separate steps so the async
+stream path in app.asgi can buffer on the event loop and write from a thread.
+"""
+import time
+from flask import current_app
+from app.extensions import db
+from app.models.chat import ChatMessage
+
+
+class StreamRecorder:
+    def __init__(self, thread_id, checkpoint_chars=None, checkpoint_seconds=None):
+        config = current_app.config
+        self.thread_id = thread_id
+        self.checkpoint_chars = checkpoint_chars or config.get("CHAT_CHECKPOINT_CHARS", 2000)
+        self.checkpoint_seconds = checkpoint_seconds or config.get("CHAT_CHECKPOINT_SECONDS", 5)
+        self.message_id = None
+        self.status = None
+        self._chunks = []
+        self._length = 0
+        self._taken_length = 0
+        self._taken_at = time.monotonic()
+
+    def feed(self, chunk):
+        """Buffer a streamed chunk. Returns True when a checkpoint is due."""
+        if chunk:
+            self._chunks.append(chunk)
+            self._length += len(chunk)
+        return (self._length - self._taken_length >= self.checkpoint_chars
+                or time.monotonic() - self._taken_at >= self.checkpoint_seconds) and self._length > self._taken_length
+
+    def take(self):
+        """The full text so far, for save(). Restarts the checkpoint interval."""
+        text = "".join(self._chunks)
+        self._chunks = [text] if text else []  # Later joins start from this prefix
+        self._taken_length = self._length
+        self._taken_at = time.monotonic()
+        return text
+
+    def save(self, text, status="partial"):
+        """Write text with the given status, creating the message on first use. Needs an app context."""
+        if not text:
+            return
+        if self.message_id is None:
+            message = ChatMessage(thread_id=self.thread_id, role="assistant", content=text, status=status)
+            db.session.add(message)
+            db.session.commit()
+            self.message_id = message.id
+        else:
+            # By id, so each save can run in a different session (thread)
+            ChatMessage.query.filter_by(id=self.message_id).update({"content": text, "status": status})
+            db.session.commit()
+        self.status = status
+
+    def append(self, chunk):
+        """Buffer a chunk and checkpoint in place when one is due."""
+        if self.feed(chunk):
+            self.save(self.take())
+
+    def finish(self, complete=True):
+        """
+        Final write. complete=False keeps the message marked partial (upstream
+        error or client disconnect) so the UI can offer to regenerate it.
+        """
+        try:
+            self.save(self.take(), "complete" if complete else "partial")
+        except Exception:
+            db.session.rollback()
+            current_app.logger.exception(f"Saving the reply for chat thread {self.thread_id} failed")
@@ -0,0 +1,250 @@
+import numpy as np
+from flask import current_app
+from sqlalchemy import event
+from app.extensions import db
+from app.models.embedding import Embedding, IndexState
+from app.services.quantization import blob_matches, decode_blobs
+from app.services.vector_store import get_store, tombstone_and_maybe_compact
+from app.utils.lru import LRUCache
+
+_cache = None
+_PENDING_WRITES = "packed_store_writes"  # db.session.info key
+
+
+class VectorIndex:
+    """
+    In-memory snapshot of one user's embeddings: one matrix row per chunk.
+    user_id None is the admin-wide snapshot over every user's notes.
+    """
+
+    def __init__(self, user_id, version, emb_ids, note_ids, matrix, live=None):
+        self.user_id = user_id
+        self.version = version
+        self.emb_ids = emb_ids      # Embedding.id per row
+        self.note_ids = note_ids    # Embedding.note_id per row
+        self.matrix = matrix        # (rows, dim) unit-normalized: float32 ndarray/memmap or QuantizedMatrix
+        self.live = live            # Boolean row mask for tombstoned stores, None if all rows are live
+        self.ann = None             # IVFIndex, built lazily for large corpora (see ann_index)
+        self._row_order = None
+        self._sorted_ids = None
+
+    def __len__(self):
+        return len(self.emb_ids)
+
+    @property
+    def nbytes(self):
+        # A memory-mapped matrix lives in the shared page cache, not in this worker's heap
+        matrix_bytes = 0 if isinstance(self.matrix, np.memmap) else self.matrix.nbytes
+        live_bytes = self.live.nbytes if self.live is not None else 0
+        return matrix_bytes + self.emb_ids.nbytes + self.note_ids.nbytes + live_bytes
+
+    def rows_for(self, emb_ids):
+        """Row number for each embedding id, -1 where absent. Later rows win over tombstoned duplicates."""
+        if self._row_order is None:
+            # Stable sort keeps append order among equal ids; take the last occurrence
+            order = np.argsort(self.emb_ids, kind="stable")
+            self._row_order = order
+            self._sorted_ids = self.emb_ids[order]
+        pos = np.searchsorted(self._sorted_ids, emb_ids, side="right") - 1
+        pos = np.clip(pos, 0, max(len(self._sorted_ids) - 1, 0))
+        if not len(self._sorted_ids):
+            return np.full(len(emb_ids), -1, dtype=np.int64)
+        hit = self._sorted_ids[pos] == emb_ids
+        return np.where(hit, self._row_order[pos], -1)
+
+    def row_mask(self, note_ids):
+        """Boolean mask of rows belonging to the given notes."""
+        return np.isin(self.note_ids, np.asarray(list(note_ids), dtype=np.int64))
+
+
+def _get_cache():
+    global _cache
+    if _cache is None:
+        _cache = LRUCache(
+            current_app.config.get("VECTOR_INDEX_CACHE_BYTES", 256 * 1024 * 1024),
+            weigher=lambda index: index.nbytes,
+        )
+    return _cache
+
+
+def get_index_version(user_id):
+    if user_id is None:
+        # Versions only ever increase, so their sum changes whenever any user's index does
+        return db.session.query(db.func.coalesce(db.func.sum(IndexState.version), 0)).scalar()
+    state = db.session.get(IndexState, user_id)
+    version = state.version if state else 0
+    if current_app.config.get("VECTOR_STORE_BACKEND") == "mmap":
+        # Packed-store writes land just after the commit that bumps the version,
+        # so a snapshot read in between must not be served once they do
+        return version, get_store(user_id, None, current_app.config).stamp()
+    return version
+
+
+def bump_index_version(user_id):
+    """
+    Mark a user's index as changed. Runs inside the caller's transaction so the
+    new version becomes visible to other workers together with the embedding writes.
+    """
+    updated = db.session.query(IndexState).filter_by(user_id=user_id).update(
+        {IndexState.version: IndexState.version + 1}, synchronize_session=False
+    )
+    if not updated:
+        db.session.add(IndexState(user_id=user_id, version=1))
+    invalidate_user_index(user_id)
+
+
+def invalidate_user_index(user_id):
+    _get_cache().pop(user_id)
+
+
+def load_sql_vectors(user_id, dim, fmt="float32"):
+    """
+    Read vectors out of the vector_blob column: (emb_ids, note_ids, matrix),
+    with the matrix in the requested storage format (see quantization).
+    """
+    from app.models.note import Note
+
+    query = db.session.query(Embedding.id, Embedding.note_id, Embedding.vector_blob, Embedding.vector_format)
+    if user_id is not None:
+        query = query.join(Note).filter(Note.user_id == user_id)
+    rows = [r for r in query.order_by(Embedding.id).all()
+            if blob_matches(r.vector_blob, r.vector_format, dim)]
+
+    emb_ids = np.fromiter((r.id for r in rows), dtype=np.int64, count=len(rows))
+    note_ids = np.fromiter((r.note_id for r in rows), dtype=np.int64, count=len(rows))
+    matrix = decode_blobs([r.vector_blob for r in rows], [r.vector_format for r in rows], dim, fmt)
+    return emb_ids, note_ids, matrix
+
+
+def queue_store_write(store, note_ids=None, emb_ids=None, append=None):
+    """
+    Schedule a packed-store change for when the current transaction commits; a
+    rollback drops it. The store then never holds rows from a failed commit
+    (whose embedding ids SQLite would hand out again) or loses rows to one.
+    Rows of note_ids/emb_ids are tombstoned first, then append, an
+    (emb_ids, note_ids, vectors) tuple, is written.
+    """
+    db.session.info.setdefault(_PENDING_WRITES, []).append(
+        (current_app._get_current_object(), store, note_ids, emb_ids, append)
+    )
+
+
+@event.listens_for(db.session, "after_commit")
+def _apply_store_writes(session):
+    if session.in_nested_transaction():
+        return
+    for app, store, note_ids, emb_ids, append in session.info.pop(_PENDING_WRITES, ()):
+        try:
+            if note_ids is not None or emb_ids is not None:
+                tombstone_and_maybe_compact(store, app.config, note_ids=note_ids, emb_ids=emb_ids)
+            if append is not None:
+                store.append(*append)
+        except Exception:
+            # The rows are committed; raising now would only fail the request that wrote them
+            app.logger.exception(f"Packed vector store write failed for user {store.user_id}; run flask reindex")
+
+
+@event.listens_for(db.session, "after_transaction_end")
+def _drop_store_writes(session, transaction):
+    if transaction.parent is None:
+        session.info.pop(_PENDING_WRITES, None)
+
+
+def _live_rows(rows):
+    """Mask of live rows, keeping only the last live row of any repeated embedding id."""
+    live = np.flatnonzero(rows["live"] == 1)
+    mask = np.zeros(len(rows), dtype=bool)
+    _, last = np.unique(rows["embedding_id"][live][::-1], return_index=True)
+    mask[live[len(live) - 1 - last]] = True
+    return mask
+
+
+def pending_note_vectors(user_id, dim, note_ids):
+    """
+    (note_ids, vectors) of the given notes' live packed rows as they will be
+    once the current transaction commits, queued store writes included.
+    """
+    wanted = np.asarray(list(note_ids), dtype=np.int64)
+    rows, vectors = open_user_store(user_id, dim).view()
+    keep = _live_rows(rows) & np.isin(rows["note_id"], wanted)
+    parts = [(np.asarray(rows["embedding_id"][keep]), np.asarray(rows["note_id"][keep]),
+              np.asarray(vectors[keep], dtype=np.float32))]
+    for _, store, dead_notes, dead_embs, append in db.session.info.get(_PENDING_WRITES, ()):
+        if store.user_id != user_id:
+            continue
+        for i, (emb_ids, owners, matrix) in enumerate(parts):
+            dead = np.zeros(len(emb_ids), dtype=bool)
+            if dead_notes is not None:
+                dead |= np.isin(owners, np.asarray(list(dead_notes), dtype=np.int64))
+            if dead_embs is not None:
+                dead |= np.isin(emb_ids, np.asarray(list(dead_embs), dtype=np.int64))
+            parts[i] = (emb_ids[~dead], owners[~dead], matrix[~dead])
+        if append is not None:
+            emb_ids, owners, matrix = append
+            sel = np.isin(owners, wanted)
+            parts.append((emb_ids[sel], owners[sel], np.asarray(matrix, dtype=np.float32)[sel]))
+    return np.concatenate([p[1] for p in parts]), np.concatenate([p[2] for p in parts])
+
+
+def open_user_store(user_id, dim):
+    """The user's PackedVectorStore, seeded from any vectors still in SQL on first use."""
+    store = get_store(user_id, dim, current_app.config)
+    if not store.exists():
+        store.create(*load_sql_vectors(user_id, dim))
+    return store
+
+
+def _build_index(user_id, version, dim):
+    if current_app.config.get("VECTOR_STORE_BACKEND") != "mmap":
+        fmt = current_app.config.get("EMBEDDING_STORAGE", "float32")
+        return VectorIndex(user_id, version, *load_sql_vectors(user_id, dim, fmt))
+
+    if user_id is None:
+        return _build_admin_packed_index(version, dim)
+
+    rows, vectors = open_user_store(user_id, dim).view()
+    live = _live_rows(rows)
+    return VectorIndex(
+        user_id, version,
+        np.array(rows["embedding_id"]), np.array(rows["note_id"]), vectors,
+        live=None if live.all() else live,
+    )
+
+
+def _build_admin_packed_index(version, dim):
+    """Stack every user's live packed rows into one in-memory matrix."""
+    from app.models.note import Note
+
+    parts = []
+    for (uid,) in db.session.query(Note.user_id).distinct():
+        rows, vectors = open_user_store(uid, dim).view()
+        live = _live_rows(rows)
+        parts.append((rows["embedding_id"][live], rows["note_id"][live], np.asarray(vectors)[live]))
+    if not parts:
+        return VectorIndex(None, version, np.zeros(0, np.int64), np.zeros(0, np.int64),
+                           np.zeros((0, dim), dtype=np.float32))
+    return VectorIndex(None, version, *(np.concatenate(p) for p in zip(*parts)))
+
+
+def get_user_index(user_id, dim=384, version=None):
+    """
+    Return the user's VectorIndex, served from the per-process cache while the
+    stored index version is unchanged. A version check is one primary-key lookup,
+    so writes made by other workers are still picked up on the next request.
+    Callers that already read the version can pass it in.
+    """
+    cache = _get_cache()
+    if version is None:
+        version = get_index_version(user_id)
+
+    index = cache.get(user_id, is_valid=lambda idx: idx.version == version and idx.matrix.shape[1] == dim)
+    if index is not None:
+        return index
+
+    index = _build_index(user_id, version, dim)
+    cache.put(user_id, index)
+    return index
+
+
+def index_cache_stats():
+    return _get_cache().stats()
@@ -0,0 +1,216 @@
+"""
+Packed, append-only, memory-mapped vector storage (VECTOR_STORE_BACKEND = "mmap").
+
+Each user gets a generation of two files under VECTOR_STORE_DIR:
+
+    user_<id>.<gen>.f32   float32 vectors, one row per chunk, no header
+    user_<id>.<gen>.rows  sidecar records (embedding_id, note_id, live) per row
+
+plus user_<id>.json naming the current generation and dimension. Chunk text
+stays in the embeddings table; the sidecar's embedding_id points at it.
+Deleted chunks are tombstoned in place (live = 0) and the files are rewritten
+into a new generation once enough rows are dead. Readers map the files
+read-only, so every worker shares the same OS page-cache pages.
+"""
+import json
+import os
+import threading
+from contextlib import contextmanager
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows — fall back to an in-process lock only
+    fcntl = None
+
+ROW_DTYPE = np.dtype([("embedding_id", "<i8"), ("note_id", "<i8"), ("live", "u1")])
+
+_thread_locks = {}
+_thread_locks_guard = threading.Lock()
+
+
+class PackedVectorStore:
+    """One user's packed vector files."""
+
+    def __init__(self, root, user_id, dim):
+        self.root = root
+        self.user_id = user_id
+        self.dim = dim
+        self.meta_path = os.path.join(root, f"user_{user_id}.json")
+        self.lock_path = os.path.join(root, f"user_{user_id}.lock")
+
+    # ── Files ──
+
+    def exists(self):
+        return os.path.exists(self.meta_path)
+
+    def _read_meta(self):
+        with open(self.meta_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _write_meta(self, meta):
+        tmp = f"{self.meta_path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(tmp, self.meta_path)
+
+    def _count_write(self, meta):
+        # In-place writes keep the generation, so readers tell them apart by this counter
+        self._write_meta({**meta, "writes": meta.get("writes", 0) + 1})
+
+    def _paths(self, generation):
+        base = os.path.join(self.root, f"user_{self.user_id}.{generation}")
+        return f"{base}.f32", f"{base}.rows"
+
+    @property
+    def row_bytes(self):
+        return self.dim * np.dtype(np.float32).itemsize
+
+    @contextmanager
+    def _locked(self):
+        """Serialize writers across threads and (where supported) processes."""
+        with _thread_locks_guard:
+            tlock = _thread_locks.setdefault(self.lock_path, threading.Lock())
+        with tlock:
+            os.makedirs(self.root, exist_ok=True)
+            with open(self.lock_path, "a") as lock_file:
+                if fcntl:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    if fcntl:
+                        fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _current(self):
+        """(meta, vec_path, rows_path, row_count) for the current generation, creating an empty store if needed."""
+        if not self.exists():
+            self._write_meta({"generation": 0, "dim": self.dim})
+        meta = self._read_meta()
+        vec_path, rows_path = self._paths(meta["generation"])
+        count = os.path.getsize(rows_path) // ROW_DTYPE.itemsize if os.path.exists(rows_path) else 0
+        return meta, vec_path, rows_path, count
+
+    # ── Writes ──
+
+    def create(self, emb_ids, note_ids, matrix):
+        """Start a fresh generation holding exactly the given rows."""
+        with self._locked():
+            previous = self._read_meta()["generation"] if self.exists() else None
+            self._write_generation(previous + 1 if previous is not None else 0, emb_ids, note_ids, matrix)
+            if previous is not None:
+                self._remove_generation(previous)
+
+    def append(self, emb_ids, note_ids, matrix):
+        if not len(emb_ids):
+            return
+        rows = np.zeros(len(emb_ids), dtype=ROW_DTYPE)
+        rows["embedding_id"] = emb_ids
+        rows["note_id"] = note_ids
+        rows["live"] = 1
+        with self._locked():
+            meta, vec_path, rows_path, count = self._current()
+            if meta["dim"] != self.dim:
+                # Vectors of a different dimension can't share a matrix; start over
+                self._write_generation(meta["generation"] + 1, emb_ids, note_ids, matrix)
+                self._remove_generation(meta["generation"])
+                return
+            with open(vec_path, "ab") as f:
+                # Drop vectors left behind by an append that crashed before its sidecar write
+                f.truncate(count * self.row_bytes)
+                f.write(np.ascontiguousarray(matrix, dtype=np.float32).tobytes())
+            with open(rows_path, "ab") as f:
+                f.write(rows.tobytes())
+            self._count_write(meta)
+
+    def tombstone(self, note_ids=None, emb_ids=None):
+        """Mark rows of the given notes and/or embeddings dead. Returns the dead-row ratio."""
+        with self._locked():
+            meta, vec_path, rows_path, count = self._current()
+            if not count:
+                return 0.0
+            rows = np.memmap(rows_path, dtype=ROW_DTYPE, mode="r+", shape=(count,))
+            dead = np.zeros(count, dtype=bool)
+            if note_ids is not None:
+                dead |= np.isin(rows["note_id"], np.asarray(list(note_ids), dtype=np.int64))
+            if emb_ids is not None:
+                dead |= np.isin(rows["embedding_id"], np.asarray(list(emb_ids), dtype=np.int64))
+            if dead.any():
+                rows["live"][dead] = 0
+                rows.flush()
+                self._count_write(meta)
+            ratio = float((rows["live"] == 0).sum()) / count
+            del rows
+            return ratio
+
+    def compact(self):
+        """Rewrite the live rows into a new generation and drop the old files."""
+        with self._locked():
+            meta, vec_path, rows_path, count = self._current()
+            dim = meta["dim"]
+            rows = np.fromfile(rows_path, dtype=ROW_DTYPE, count=count) if count else np.zeros(0, ROW_DTYPE)
+            live = rows["live"] == 1
+            vectors = np.fromfile(vec_path, dtype=np.float32, count=count * dim).reshape(count, dim) \
+                if count else np.zeros((0, dim), dtype=np.float32)
+            self.dim = dim
+            self._write_generation(meta["generation"] + 1, rows["embedding_id"][live],
+                                   rows["note_id"][live], vectors[live])
+            self._remove_generation(meta["generation"])
+
+    def _remove_generation(self, generation):
+        for path in self._paths(generation):
+            try:
+                os.remove(path)
+            except OSError:
+                pass  # Missing, or still mapped by a reader on Windows; harmless leftover
+
+    def _write_generation(self, generation, emb_ids, note_ids, matrix):
+        vec_path, rows_path = self._paths(generation)
+        rows = np.zeros(len(emb_ids), dtype=ROW_DTYPE)
+        rows["embedding_id"] = emb_ids
+        rows["note_id"] = note_ids
+        rows["live"] = 1
+        np.ascontiguousarray(matrix, dtype=np.float32).tofile(vec_path)
+        rows.tofile(rows_path)
+        # Readers switch over only once both files are complete
+        self._write_meta({"generation": generation, "dim": self.dim})
+
+    # ── Reads ──
+
+    def stamp(self):
+        """(generation, writes) identifying the current contents, or None if there is no store yet."""
+        if not self.exists():
+            return None
+        meta = self._read_meta()
+        return meta["generation"], meta.get("writes", 0)
+
+    def view(self):
+        """
+        Zero-copy read-only view: (rows, vectors) memory maps.
+        Tombstoned rows are still present; callers mask on rows["live"].
+        """
+        # Under the lock so a concurrent compact() can't remove the generation between reading meta and
+        # mapping its files; once mapped, the old files stay readable after they're unlinked
+        with self._locked():
+            meta = self._read_meta()
+            if meta["dim"] != self.dim:
+                return np.zeros(0, dtype=ROW_DTYPE), np.zeros((0, self.dim), dtype=np.float32)
+            vec_path, rows_path = self._paths(meta["generation"])
+            count = os.path.getsize(rows_path) // ROW_DTYPE.itemsize if os.path.exists(rows_path) else 0
+            if not count:
+                return np.zeros(0, dtype=ROW_DTYPE), np.zeros((0, self.dim), dtype=np.float32)
+            rows = np.memmap(rows_path, dtype=ROW_DTYPE, mode="r", shape=(count,))
+            vectors = np.memmap(vec_path, dtype=np.float32, mode="r", shape=(count, self.dim))
+        return rows, vectors
+
+def get_store(user_id, dim, config):
+    return PackedVectorStore(config["VECTOR_STORE_DIR"], user_id, dim)
+
+
+def tombstone_and_maybe_compact(store, config, note_ids=None, emb_ids=None):
+    """Tombstone rows, compacting once the dead fraction passes VECTOR_STORE_COMPACT_RATIO."""
+    if not store.exists():
+        return
+    ratio = store.tombstone(note_ids=note_ids, emb_ids=emb_ids)
+    if ratio >= config.get("VECTOR_STORE_COMPACT_RATIO", 0.3):
+        store.compact()
@@ -0,0 +1,129 @@
+import re
+import zlib
+from functools import lru_cache
+import numpy as np
+
+# Bump when the feature extraction changes so stored vectors can be detected as stale
+VECTORIZER_REVISION = 2
+
+_U64 = np.uint64
+_SEED_TRIGRAM = _U64(0x9E3779B97F4A7C15)
+_SEED_CJK_UNIGRAM = _U64(0xC2B2AE3D27D4EB4F)
+_SEED_CJK_BIGRAM = _U64(0x165667B19E3779F9)
+_SEED_WORD = 0x27D4EB2F
+
+# Alphabetic words outside CJK: Latin (with accents), Greek and Cyrillic letters plus digits
+WORD_RE = re.compile(r"[0-9a-zÀ-ɏͰ-ϿЀ-ӿ]+")
+
+_CJK_RANGES = (
+    (0x3040, 0x30FF),    # Hiragana, Katakana
+    (0x3400, 0x4DBF),    # CJK Extension A
+    (0x4E00, 0x9FFF),    # CJK Unified Ideographs
+    (0xAC00, 0xD7AF),    # Hangul syllables
+    (0xF900, 0xFAFF),    # CJK Compatibility Ideographs
+    (0x20000, 0x2A6DF),  # CJK Extension B
+)
+
+
+def _mix64(keys):
+    """splitmix64 finalizer — a fixed, process-independent 64-bit integer hash."""
+    x = keys.astype(_U64, copy=True)
+    x ^= x >> _U64(30)
+    x *= _U64(0xBF58476D1CE4E5B9)
+    x ^= x >> _U64(27)
+    x *= _U64(0x94D049BB133111EB)
+    x ^= x >> _U64(31)
+    return x
+
+
+def is_cjk(codes):
+    """Boolean mask of CJK codepoints in a uint32 codepoint array."""
+    mask = np.zeros(len(codes), dtype=bool)
+    for lo, hi in _CJK_RANGES:
+        mask |= (codes >= lo) & (codes <= hi)
+    return mask
+
+
+def to_codepoints(text):
+    return np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32)
+
+
+@lru_cache(maxsize=65536)
+def _word_hash(word):
+    return zlib.crc32(word.encode("utf-8"), _SEED_WORD)
+
+
+class HashingVectorizer:
+    """
+    Deterministic hashed bag-of-features embedding.
+
+    Features per text (lower-cased):
+      - character trigrams (weight 1)
+      - CJK character unigrams (weight 1) and bigrams (weight 2), since CJK text has no spaces
+      - Latin/Greek/Cyrillic words (weight 2)
+
+    All hashes are fixed-seed, so vectors are identical across processes and restarts.
+    transform() embeds a whole batch with one bincount instead of a loop per text.
+    """
+
+    def __init__(self, dim=384):
+        self.dim = dim
+
+    @property
+    def version(self):
+        return f"hash{VECTORIZER_REVISION}-{self.dim}"
+
+    def transform(self, texts):
+        """Embed a list of texts. Returns an (n, dim) float32 array of unit-normalized rows."""
+        n = len(texts)
+        dim = self.dim
+        texts = [t.lower().strip() for t in texts]
+        if not n:
+            return np.zeros((0, dim), dtype=np.float32)
+
+        codes = [to_codepoints(t) for t in texts]
+        lengths = np.fromiter((len(c) for c in codes), dtype=np.int64, count=n)
+        flat = np.concatenate(codes).astype(_U64) if lengths.sum() else np.zeros(0, dtype=_U64)
+        row_of = np.repeat(np.arange(n, dtype=np.int64), lengths)
+
+        rows, buckets, weights = [], [], []
+
+        def add(row_idx, hashes, weight):
+            rows.append(row_idx)
+            buckets.append((hashes % _U64(dim)).astype(np.int64))
+            weights.append(np.full(len(row_idx), weight, dtype=np.float32))
+
+        # Character trigrams that don't cross a text boundary
+        if len(flat) >= 3:
+            valid = row_of[:-2] == row_of[2:]
+            keys = (flat[:-2] << _U64(42)) | (flat[1:-1] << _U64(21)) | flat[2:]
+            add(row_of[:-2][valid], _mix64(keys[valid] ^ _SEED_TRIGRAM), 1.0)
+
+        # CJK unigrams and bigrams
+        cjk = is_cjk(flat)
+        if cjk.any():
+            add(row_of[cjk], _mix64(flat[cjk] ^ _SEED_CJK_UNIGRAM), 1.0)
+            if len(flat) >= 2:
+                valid = (row_of[:-1] == row_of[1:]) & cjk[:-1] & cjk[1:]
+                keys = (flat[:-1] << _U64(21)) | flat[1:]
+                add(row_of[:-1][valid], _mix64(keys[valid] ^ _SEED_CJK_BIGRAM), 2.0)
+
+        # Words — hashed once per distinct word
+        word_rows, word_hashes = [], []
+        for i, text in enumerate(texts):
+            for word in WORD_RE.findall(text):
+                word_rows.append(i)
+                word_hashes.append(_word_hash(word))
+        if word_rows:
+            add(np.array(word_rows, dtype=np.int64), np.array(word_hashes, dtype=_U64), 2.0)
+
+        if not rows:
+            return np.zeros((n, dim), dtype=np.float32)
+
+        flat_index = np.concatenate(rows) * dim + np.concatenate(buckets)
+        matrix = np.bincount(flat_index, weights=np.concatenate(weights), minlength=n * dim)
+        matrix = matrix.astype(np.float32).reshape(n, dim)
+
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        np.divide(matrix, norms, out=matrix, where=norms > 0)
+        return matrix
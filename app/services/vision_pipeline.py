@@ -2,6 +2,7 @@ import json
 import os
 import traceback
 from flask import current_app
+from app.services import http_client
 from app.services.openrouter import OpenRouterService
 from app.utils.image_utils import resize_image_for_upload, crop_image
 
@@ -80,7 +81,8 @@ def run_vision_pipeline(image_paths, model, user):
     Returns:
         list of mistake item dicts ready for review
     """
-    service = OpenRouterService(user=user)
+    service = OpenRouterService(user=user, priority="batch")
+    usage_before = http_client.thread_usage()
     upload_folder = current_app.config["UPLOAD_FOLDER"]
     crop_dir = os.path.join(upload_folder, "crops")
     os.makedirs(crop_dir, exist_ok=True)
@@ -181,7 +183,7 @@ def run_vision_pipeline(image_paths, model, user):
                 "confidence": item["confidence"],
             }
             prompt = RECONCILIATION_PROMPT.format(first_pass_json=json.dumps(first_pass_data, ensure_ascii=False))
-            recon_raw = service.vision_completion([crop_b64], prompt, model=model)
+            recon_raw = service.vision_completion([crop_b64], prompt, model=model, cache=True)
 
             recon_raw = recon_raw.strip()
             if recon_raw.startswith("```"):
@@ -203,12 +205,17 @@ def run_vision_pipeline(image_paths, model, user):
             if item["confidence"] < 0.6:
                 item["needs_user_edit"] = True
 
+    usage = http_client.thread_usage()
+    current_app.logger.info(
+        f"Vision pipeline: {usage['requests'] - usage_before['requests']} API calls over "
+        f"{usage['new_connections'] - usage_before['new_connections']} new connections"
+    )
     return {"mistakes": results}
 
 
 def suggest_subject_and_tags(mistakes, user):
     """Use the chat model to suggest a subject and tags based on the mistake content."""
-    service = OpenRouterService(user=user)
+    service = OpenRouterService(user=user, priority="batch")
 
     context = "\n".join([
         f"Question: {m.get('ocr_question', 'N/A')}, Answer: {m.get('ocr_answer', 'N/A')}"
@@ -228,7 +235,7 @@ RESPOND WITH VALID JSON ONLY:
 
     try:
         messages = [{"role": "user", "content": prompt}]
-        response = service.chat_completion(messages, temperature=0.3, max_tokens=500)
+        response = service.chat_completion(messages, temperature=0.3, max_tokens=500, cache=True)
         response = response.strip()
         if response.startswith("```"):
             lines = response.split("\n")
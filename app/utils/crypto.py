@@ -1,12 +1,27 @@
+import threading
 from cryptography.fernet import Fernet
 from flask import current_app
+from app.utils.lru import LRUCache
+
+_lock = threading.Lock()
+_fernet = None
+_fernet_key = None
+_key_cache = None
 
 
 def get_fernet():
+    """The process's Fernet instance, rebuilt only when FERNET_KEY changes."""
+    global _fernet, _fernet_key
     key = current_app.config.get("FERNET_KEY", "")
-    if not key or key == "generate-a-key":
-        key = Fernet.generate_key().decode()
-    return Fernet(key.encode() if isinstance(key, str) else key)
+    with _lock:
+        if _fernet is None or key != _fernet_key:
+            if not key or key == "generate-a-key":
+                # No key configured: one random key per process, so keys stay readable until restart
+                _fernet = Fernet(Fernet.generate_key())
+            else:
+                _fernet = Fernet(key.encode() if isinstance(key, str) else key)
+            _fernet_key = key
+        return _fernet
 
 
 def encrypt_api_key(plain_key):
@@ -17,3 +32,38 @@ def encrypt_api_key(plain_key):
 def decrypt_api_key(encrypted_key):
     f = get_fernet()
     return f.decrypt(encrypted_key.encode()).decode()
+
+
+def _get_key_cache():
+    global _key_cache
+    if _key_cache is None:
+        _key_cache = LRUCache(
+            current_app.config.get("API_KEY_CACHE_SIZE", 1024),
+            ttl=current_app.config.get("API_KEY_CACHE_TTL", 300),
+        )
+    return _key_cache
+
+
+def get_user_api_key(user):
+    """
+    The user's decrypted OpenRouter key, from a short-lived per-process cache.
+
+    Entries are keyed by user id and ciphertext, so a key changed through
+    another worker is never served stale here: the new ciphertext misses.
+    """
+    cache_key = (user.id, user.openrouter_api_key_enc)
+    plain = _get_key_cache().get(cache_key)
+    if plain is None:
+        plain = decrypt_api_key(user.openrouter_api_key_enc)
+        _get_key_cache().put(cache_key, plain)
+    return plain
+
+
+def forget_user_api_key(user):
+    """Drop the user's cached plaintext key. Call before their key is changed or removed."""
+    if user.openrouter_api_key_enc:
+        _get_key_cache().pop((user.id, user.openrouter_api_key_enc))
+
+
+def api_key_cache_stats():
+    return _get_key_cache().stats()
@@ -0,0 +1,96 @@
+import time
+import threading
+from collections import OrderedDict
+
+
+class LRUCache:
+    """
+    Thread-safe least-recently-used cache with hit/miss/eviction counters.
+
+    capacity is measured in whatever unit weigher returns — entries by default,
+    or e.g. bytes when weigher=lambda value: value.nbytes. With ttl (seconds),
+    entries also expire that long after they were put.
+    """
+
+    def __init__(self, capacity, weigher=None, ttl=None):
+        self.capacity = capacity
+        self.ttl = ttl
+        self._weigher = weigher or (lambda value: 1)
+        self._data = OrderedDict()  # key -> (value, weight, expires_at)
+        self._lock = threading.Lock()
+        self.weight = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key, default=None, is_valid=None):
+        """
+        Look up a key. If is_valid is given and returns False for the cached value,
+        the entry is dropped and the lookup counts as a miss.
+        """
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[2] is not None and entry[2] <= time.monotonic():
+                self._remove(key)
+                self.expirations += 1
+                entry = None
+            if entry is not None and is_valid is not None and not is_valid(entry[0]):
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        """Insert a value, evicting least-recently-used entries to stay within capacity."""
+        weight = self._weigher(value)
+        with self._lock:
+            self._remove(key)
+            if weight > self.capacity:
+                return False  # Would evict everything and still not fit
+            expires_at = time.monotonic() + self.ttl if self.ttl is not None else None
+            self._data[key] = (value, weight, expires_at)
+            self.weight += weight
+            while self.weight > self.capacity:
+                self._remove(next(iter(self._data)))
+                self.evictions += 1
+            return True
+
+    def pop(self, key):
+        with self._lock:
+            self._remove(key)
+
+    def values(self):
+        """Snapshot of the cached values, least recently used first."""
+        with self._lock:
+            return [entry[0] for entry in self._data.values()]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.weight = 0
+
+    def _remove(self, key):
+        entry = self._data.pop(key, None)
+        if entry is not None:
+            self.weight -= entry[1]
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._data),
+            "weight": self.weight,
+            "capacity": self.capacity,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
@@ -0,0 +1,27 @@
+import os
+import sqlite3
+import threading
+
+
+class SQLiteFile:
+    """
+    A small SQLite database file shared by the workers on one host (LLM
+    response cache, single-flight state). Each thread gets its own
+    autocommit connection in WAL mode, reopened after a fork.
+    """
+
+    def __init__(self, path, schema):
+        self.path = path
+        self.schema = schema
+        self._local = threading.local()
+
+    def conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(self.schema)
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
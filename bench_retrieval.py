@@ -0,0 +1,266 @@
+"""
+Retrieval benchmark -- latency, memory and recall of the RAG path.
+
+Builds synthetic per-user corpora of mixed Chinese/English mistake notes in a
+throwaway SQLite database, then measures retrieve_relevant_chunks() and
+_build_context_messages() in-process (no network, no running server).
+
+For every corpus size it reports:
+  - ingest time and cold index build time
+  - p50/p95 latency of retrieval and of context building
+  - peak traced memory of a cold index build plus one query (tracemalloc)
+  - recall@k against an exhaustive search with the same scoring (cosine
+    fused with BM25 at --bm25-weight), so it measures what the IVF index
+    loses, and how often the note a query was taken from is among the results
+
+Results are printed as JSON (and written to --out) so runs on different
+commits can be diffed.
+
+Usage:
+    python bench_retrieval.py
+    python bench_retrieval.py --sizes 100,1000,10000,100000 --queries 200 --out bench.json
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+from config import Config
+from app.services.quantization import FORMATS
+
+SUBJECTS = [("数学", "math"), ("物理", "physics"), ("化学", "chemistry"), ("英语", "English"), ("生物", "biology")]
+ZH_TOPICS = ["二次方程", "判别式", "三角函数", "导数", "数列", "牛顿第二定律", "电磁感应", "氧化还原反应",
+             "化学平衡", "光合作用", "细胞分裂", "定语从句", "虚拟语气", "概率", "向量", "动量守恒", "有机物", "遗传规律"]
+EN_TOPICS = ["quadratic equation", "discriminant", "trigonometry", "derivative", "arithmetic sequence",
+             "Newton's second law", "electromagnetic induction", "redox reaction", "chemical equilibrium",
+             "photosynthesis", "mitosis", "relative clause", "subjunctive mood", "probability", "vector",
+             "conservation of momentum", "organic compound", "Mendelian inheritance"]
+ZH_MISTAKES = ["计算时符号弄错了", "公式记错", "没有考虑边界条件", "单位换算错误", "审题不清", "概念混淆",
+               "漏掉了一种情况", "受力分析不完整", "配平错误", "时态用错"]
+EN_MISTAKES = ["sign error in the second step", "forgot to check the domain", "mixed up the formula",
+               "unit conversion mistake", "misread the question", "dropped a negative root",
+               "wrong free-body diagram", "did not balance the equation", "used the wrong tense"]
+
+
+def _paragraph(rng, topic):
+    zh, en = ZH_TOPICS[topic], EN_TOPICS[topic]
+    a, b, c = rng.integers(1, 99, size=3)
+    parts = [
+        f"题目：已知{zh}相关条件，a={a}，b={b}，求c的值。",
+        f"Problem: {en} with a={a}, b={b}; find c.",
+        f"错因：{ZH_MISTAKES[rng.integers(len(ZH_MISTAKES))]}。",
+        f"Mistake: {EN_MISTAKES[rng.integers(len(EN_MISTAKES))]}.",
+        f"正确答案 c={c}，关键是理解{zh}的定义。",
+        f"Key idea: review the definition of {en} before solving.",
+    ]
+    rng.shuffle(parts)
+    return " ".join(parts[:int(rng.integers(3, 7))])
+
+
+def build_corpus(user_id, n_chunks, rng, batch_size=500):
+    """Insert notes for one user until they hold about n_chunks chunks. Returns {note_id: [chunk texts]}."""
+    from app.extensions import db
+    from app.models.note import Note
+    from app.services.embedding_service import store_embeddings_for_notes, chunk_note
+
+    paragraphs_per_note = 3  # plus the title chunk
+    n_notes = max(1, n_chunks // (paragraphs_per_note + 1))
+    chunks = {}
+    for start in range(0, n_notes, batch_size):
+        notes = []
+        for i in range(start, min(start + batch_size, n_notes)):
+            topic = int(rng.integers(len(ZH_TOPICS)))
+            zh_subject, en_subject = SUBJECTS[topic % len(SUBJECTS)]
+            content = "\n\n".join(_paragraph(rng, topic) for _ in range(paragraphs_per_note))
+            notes.append(Note(user_id=user_id, title=f"{zh_subject} {en_subject} #{i} {ZH_TOPICS[topic]}",
+                              content_md=content))
+        db.session.add_all(notes)
+        db.session.commit()
+        store_embeddings_for_notes(notes)
+        for note in notes:
+            chunks[note.id] = chunk_note(note)
+    return chunks
+
+
+def make_queries(chunks, n, rng):
+    """Queries cut from random chunks: (query text, source note id)."""
+    note_ids = list(chunks)
+    queries = []
+    for _ in range(n):
+        note_id = note_ids[int(rng.integers(len(note_ids)))]
+        text = chunks[note_id][int(rng.integers(len(chunks[note_id])))]
+        length = max(8, len(text) // 3)
+        start = int(rng.integers(max(1, len(text) - length)))
+        queries.append((text[start:start + length], note_id))
+    return queries
+
+
+def _pct(samples, p):
+    return round(float(np.percentile(samples, p)) * 1000, 3) if samples else None
+
+
+def _exhaustive(app, user_id, query, k):
+    """Top-k embedding ids from retrieval's own scoring with the IVF index off (every row scored)."""
+    from app.services.embedding_service import _search, normalize_query
+    from app.services.vector_index import get_index_version
+
+    min_chunks = app.config["ANN_MIN_CHUNKS"]
+    app.config["ANN_MIN_CHUNKS"] = 0
+    try:
+        results = _search(normalize_query(query), user_id, None, k, get_index_version(user_id))
+    finally:
+        app.config["ANN_MIN_CHUNKS"] = min_chunks
+    return {r["embedding_id"] for r in results}
+
+
+def bench_size(app, n_chunks, args, rng):
+    from flask_login import login_user
+    from app.extensions import db
+    from app.models.user import User
+    from app.models.chat import ChatThread, ChatMessage
+    from app.routes.chat import _build_context_messages
+    from app.services.embedding_service import retrieve_relevant_chunks
+    from app.services.vector_index import get_user_index, invalidate_user_index
+
+    dim = app.config["EMBEDDING_DIM"]
+    with app.app_context():
+        user = User(username=f"bench_{n_chunks}", email=f"bench_{n_chunks}@localhost")
+        user.set_password("bench")
+        db.session.add(user)
+        db.session.commit()
+        user_id = user.id
+
+        t0 = time.perf_counter()
+        chunks = build_corpus(user_id, n_chunks, rng)
+        ingest_s = time.perf_counter() - t0
+        queries = make_queries(chunks, args.queries, rng)
+
+        thread = ChatThread(user_id=user_id, title="bench")
+        db.session.add(thread)
+        db.session.flush()
+        for i in range(6):
+            db.session.add(ChatMessage(thread_id=thread.id, role="user" if i % 2 == 0 else "assistant",
+                                       content=queries[i % len(queries)][0]))
+        db.session.commit()
+
+        # Cold build + first query, traced separately so tracemalloc overhead doesn't skew latency
+        invalidate_user_index(user_id)
+        tracemalloc.start()
+        t0 = time.perf_counter()
+        index = get_user_index(user_id, dim=dim)
+        build_s = time.perf_counter() - t0
+        retrieve_relevant_chunks(queries[0][0], user_id, top_k=args.k)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        latencies, hits, truth_total, source_hits = [], 0, 0, 0
+        for query, source_note in queries:
+            t0 = time.perf_counter()
+            results = retrieve_relevant_chunks(query, user_id, top_k=args.k)
+            latencies.append(time.perf_counter() - t0)
+            truth = _exhaustive(app, user_id, query, args.k)
+            hits += len(truth & {r["embedding_id"] for r in results})
+            truth_total += len(truth)
+            source_hits += any(r["note_id"] == source_note for r in results)
+
+        context_latencies, context_tokens = [], []
+        with app.test_request_context():
+            login_user(db.session.get(User, user_id))
+            thread = db.session.get(ChatThread, thread.id)
+            for query, _ in queries[:min(len(queries), 50)]:
+                t0 = time.perf_counter()
+                _, tokens = _build_context_messages(thread, user_message=query)
+                context_latencies.append(time.perf_counter() - t0)
+                context_tokens.append(tokens)
+
+        return {
+            "chunks": len(index),
+            "notes": len(chunks),
+            "ingest_s": round(ingest_s, 3),
+            "index_build_ms": round(build_s * 1000, 3),
+            "index_bytes": index.nbytes,
+            "peak_traced_bytes": peak,
+            "retrieve": {"p50_ms": _pct(latencies, 50), "p95_ms": _pct(latencies, 95)},
+            "build_context": {"p50_ms": _pct(context_latencies, 50), "p95_ms": _pct(context_latencies, 95),
+                              "mean_context_tokens": round(float(np.mean(context_tokens)), 1)},
+            "recall_at_k": round(hits / truth_total, 4) if truth_total else None,
+            "source_note_hit_rate": round(source_hits / len(queries), 4),
+        }
+
+
+def _git_commit():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                             cwd=os.path.dirname(os.path.abspath(__file__)), timeout=10)
+        return out.stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the retrieval path on synthetic corpora.")
+    parser.add_argument("--sizes", default="100,1000,10000,100000", help="comma-separated chunk counts")
+    parser.add_argument("--queries", type=int, default=100, help="queries per corpus")
+    parser.add_argument("--k", type=int, default=8, help="top_k for retrieval and recall@k")
+    parser.add_argument("--storage", default="float32", choices=FORMATS, help="EMBEDDING_STORAGE vector format")
+    parser.add_argument("--dim", type=int, default=Config.EMBEDDING_DIM, help="EMBEDDING_DIM")
+    parser.add_argument("--backend", default="sql", choices=["sql", "mmap"], help="VECTOR_STORE_BACKEND")
+    parser.add_argument("--ann-min-chunks", type=int, default=Config.ANN_MIN_CHUNKS,
+                        help="ANN_MIN_CHUNKS (0 = always exact search)")
+    parser.add_argument("--bm25-weight", type=float, default=Config.RETRIEVAL_BM25_WEIGHT,
+                        help="RETRIEVAL_BM25_WEIGHT")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", help="also write the JSON report to this file")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench_retrieval_")
+
+    class BenchConfig(Config):
+        SQLALCHEMY_DATABASE_URI = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+        UPLOAD_FOLDER = os.path.join(workdir, "uploads")
+        VECTOR_STORE_DIR = os.path.join(workdir, "vector_store")
+        VECTOR_STORE_BACKEND = args.backend
+        EMBEDDING_STORAGE = args.storage
+        EMBEDDING_DIM = args.dim
+        ANN_MIN_CHUNKS = args.ann_min_chunks
+        RETRIEVAL_BM25_WEIGHT = args.bm25_weight
+        RETRIEVAL_CACHE_SIZE = 0  # Measure real searches, not cache hits
+        EMBEDDING_INDEXER_ASYNC = False
+
+    from app import create_app
+    app = create_app(BenchConfig)
+    rng = np.random.default_rng(args.seed)
+
+    report = {
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "settings": {k: v for k, v in vars(args).items() if k != "out"},
+        "results": [],
+    }
+    for size in (int(s) for s in args.sizes.split(",") if s.strip()):
+        result = bench_size(app, size, args, rng)
+        result["requested_chunks"] = size
+        report["results"].append(result)
+        print(f"{size} chunks: retrieve p50={result['retrieve']['p50_ms']}ms "
+              f"recall@{args.k}={result['recall_at_k']}", file=sys.stderr)
+
+    shutil.rmtree(workdir, ignore_errors=True)
+
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    print(text)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text)
+
+
+if __name__ == "__main__":
+    main()
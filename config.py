@@ -17,12 +17,49 @@ class Config:
     OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY", "")
     OPENROUTER_BASE_URL = "https://openrouter.ai/api/v1"
 
+    # Outbound HTTP (OpenRouter, embedding APIs)
+    HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", 32))  # Keep-alive connections per upstream host per process
+    HTTP_CONNECT_TIMEOUT = 5  # Seconds to establish an upstream connection
+    HTTP_READ_TIMEOUT = 120  # Seconds to wait for upstream data (chat, embeddings)
+    HTTP_VISION_READ_TIMEOUT = 180  # Vision calls on several images take longer
+
+    # LLM response cache (call sites opt in with cache=True)
+    LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "true").lower() == "true"
+    LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", "")  # SQLite file shared by the workers on a host; empty = instance/llm_cache.db
+    LLM_CACHE_TTL = 7 * 86400  # Seconds a cached response is served
+    LLM_CACHE_MAX_BYTES = 64 * 1024 * 1024  # Least-recently-used responses are evicted beyond this
+
+    # Upstream LLM resilience (see app/services/resilience.py)
+    LLM_RETRY_ATTEMPTS = 3  # Tries per call on 408/429/5xx and connection errors (read timeouts are not retried)
+    LLM_RETRY_BASE_DELAY = 0.5  # Seconds; the backoff ceiling doubles per try, with full jitter
+    LLM_RETRY_MAX_DELAY = 20  # Longest wait between tries; a longer Retry-After fails the call instead
+    LLM_BREAKER_FAILURES = 5  # Consecutive 5xx/timeouts/connection errors that open a model's circuit
+    LLM_BREAKER_COOLDOWN = 30  # Seconds an open circuit fails fast before one probe call is let through
+    LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", 0))  # e.g. 95: duplicate calls slower than the model's p95; 0 = off
+    LLM_HEDGE_MIN_SAMPLES = 20  # Latencies seen before a model is hedged
+    LLM_HEDGE_THREADS = int(os.getenv("LLM_HEDGE_THREADS", 32))  # Threads running hedged calls; each holds two, and their requests share HTTP_POOL_SIZE
+
+    # Outbound LLM limits per API key and worker process (see app/services/rate_limiter.py)
+    LLM_LIMIT_CONCURRENCY = int(os.getenv("LLM_LIMIT_CONCURRENCY", 32))  # Requests in flight (streams until their response starts); 0 = unlimited
+    LLM_LIMIT_RPM = int(os.getenv("LLM_LIMIT_RPM", 0))  # Requests per minute; 0 = unlimited
+    LLM_LIMIT_TPM = int(os.getenv("LLM_LIMIT_TPM", 0))  # Estimated prompt + max_tokens per minute; 0 = unlimited
+    LLM_LIMIT_BATCH_SHARE = 0.75  # Share of the concurrency slots batch (vision pipeline) requests may hold
+    LLM_LIMIT_MAX_WAIT = 120  # Seconds a request may queue before failing
+    LLM_LIMIT_KEYS = 1024  # Limiters kept per process (one per API key); the least recently used are evicted
+
+    # Single-flight: identical concurrent LLM calls by one user share an upstream request
+    SINGLE_FLIGHT = os.getenv("SINGLE_FLIGHT", "local")  # "local" (per worker), "sqlite" (across a host's workers) or "off"
+    SINGLE_FLIGHT_PATH = os.getenv("SINGLE_FLIGHT_PATH", "")  # sqlite backend file; empty = instance/single_flight.db
+    SINGLE_FLIGHT_WAIT = 200  # Seconds a duplicate waits for the leader's result (longer than the vision read timeout)
+
     # Admin
     ADMIN_USERNAME = os.getenv("ADMIN_USERNAME", "admin")
     ADMIN_PASSWORD = os.getenv("ADMIN_PASSWORD", "admin")
 
     # Encryption
     FERNET_KEY = os.getenv("FERNET_KEY", "")
+    API_KEY_CACHE_SIZE = 1024  # Decrypted user API keys kept per worker
+    API_KEY_CACHE_TTL = 300  # Seconds a decrypted key stays cached
 
     # Vision models (OpenRouter model IDs)
     VISION_MODELS = [
@@ -47,6 +84,47 @@ class Config:
         {"id": "google/gemini-3-flash-preview", "name": "Gemini 3 Flash"},
     ]
 
+    # Chat history
+    CHAT_HISTORY_TURNS = 4  # Most recent user turns (with their replies) always sent verbatim; at least 1
+    CHAT_SUMMARY_BATCH_TURNS = 2  # Older turns are folded into the thread summary this many at a time (in the background); at least 1
+    CHAT_SUMMARY_MODEL = os.getenv("CHAT_SUMMARY_MODEL", "openai/gpt-5-nano")  # Empty = summarize with the chat model
+    CHAT_HISTORY_TOKEN_BUDGET = 8000  # Estimated tokens of summary + verbatim history per request
+    CHAT_HISTORY_TOKEN_BUDGETS = {  # Per-model overrides
+        "openai/gpt-5-nano": 6000,
+        "google/gemini-3-flash-preview": 16000,
+    }
+    CHAT_CHECKPOINT_CHARS = 2000  # Streamed reply is saved after this many new characters...
+    CHAT_CHECKPOINT_SECONDS = 5  # ...or this many seconds, whichever comes first
+    ASGI_THREADS = int(os.getenv("ASGI_THREADS", 32))  # app.asgi: threads running Flask views and database writes
+    ASGI_UPSTREAM_CONNECTIONS = 1000  # app.asgi: concurrent upstream streams per process
+
+    # Embeddings / retrieval
+    EMBEDDING_PROVIDER = os.getenv("EMBEDDING_PROVIDER", "hashing")  # "hashing" (local) or "openai" (OpenAI-compatible API)
+    EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "text-embedding-3-small")
+    EMBEDDING_API_BASE = os.getenv("EMBEDDING_API_BASE", "https://api.openai.com/v1")
+    EMBEDDING_API_KEY = os.getenv("EMBEDDING_API_KEY", "")
+    EMBEDDING_BATCH_SIZE = 64  # Texts per embeddings API request
+    EMBEDDING_CACHE = True  # Keep remote vectors in the embedding_cache table by content hash
+    EMBEDDING_DIM = int(os.getenv("EMBEDDING_DIM", 384))  # Must match the model's output for remote providers
+    EMBEDDING_STORAGE = os.getenv("EMBEDDING_STORAGE", "float32")  # vector_blob format: float32 / float16 / int8 / sparse (sql backend)
+    RETRIEVAL_BM25_WEIGHT = 0.3  # Share of the final score taken from BM25 keyword matching (0 = vectors only)
+    ANN_MIN_CHUNKS = 20000  # Corpora at least this large are searched through an IVF index (0 = always exact)
+    ANN_NPROBE = 8  # IVF cells scanned per query; higher = better recall, slower
+    RAG_CANDIDATES = 24  # Chunks retrieved per chat message before packing
+    RAG_CONTEXT_TOKEN_BUDGET = 1200  # Estimated tokens of note context added to the system prompt
+    RAG_MMR_LAMBDA = 0.7  # 1.0 = pure relevance, lower = more diverse context
+    NOTE_GRAPH_K = 10  # Related notes kept per note
+    RETRIEVAL_CACHE_SIZE = 1024  # Cached top-k result lists per worker (0 = off)
+    VECTOR_INDEX_CACHE_BYTES = int(os.getenv("VECTOR_INDEX_CACHE_BYTES", 256 * 1024 * 1024))  # per worker
+    VECTOR_STORE_BACKEND = os.getenv("VECTOR_STORE_BACKEND", "sql")  # "sql" (vector_blob rows) or "mmap"
+    VECTOR_STORE_DIR = os.getenv("VECTOR_STORE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "vector_store"))
+    VECTOR_STORE_COMPACT_RATIO = 0.3  # Rewrite a user's packed file once this fraction of rows is tombstoned
+    EMBEDDING_INDEXER_ASYNC = os.getenv("EMBEDDING_INDEXER_ASYNC", "true").lower() == "true"  # false = embed inside the save request
+    EMBEDDING_INDEXER_DEBOUNCE_SECONDS = 0.5  # Wait this long after a save so rapid edits coalesce into one re-embed
+    EMBEDDING_INDEXER_BATCH_SIZE = 32  # Notes embedded per background batch
+    EMBEDDING_INDEXER_MAX_ATTEMPTS = 5  # Tries per note before a failing note is dropped (see the log)
+    EMBEDDING_INDEXER_RETRY_SECONDS = 2  # Delay before retrying a failed note, doubled per attempt
+
     # Quota defaults
     DEFAULT_QUOTA_CHAT = 50
     DEFAULT_QUOTA_IMAGES = 20
@@ -0,0 +1,78 @@
+import time
+
+import pytest
+
+from config import Config
+
+# test_smoke.py drives a running server at 127.0.0.1:5000; run it directly with python instead
+collect_ignore = ["test_smoke.py"]
+
+
+def temp_settings(tmp_path):
+    """Config overrides that keep the database, uploads, vector files and caches under tmp_path."""
+    return {
+        "SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path / 'test.db'}",
+        "UPLOAD_FOLDER": str(tmp_path / "uploads"),
+        "VECTOR_STORE_DIR": str(tmp_path / "vector_store"),
+        "LLM_CACHE_PATH": str(tmp_path / "llm_cache.db"),
+        "SINGLE_FLIGHT_PATH": str(tmp_path / "single_flight.db"),
+        "OPENROUTER_API_KEY": "test-key",
+    }
+
+
+def wait_until(predicate, timeout=2.0):
+    """Poll predicate until it holds; fails the test after timeout seconds."""
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "condition not reached in time"
+        time.sleep(0.005)
+
+
+def add_user(app, username="student"):
+    """Create a user; returns its id."""
+    from app.extensions import db
+    from app.models.user import User
+
+    with app.app_context():
+        user = User(username=username, email=f"{username}@localhost")
+        user.set_password("x")
+        db.session.add(user)
+        db.session.commit()
+        return user.id
+
+
+def add_notes(app, user_id, *contents):
+    """One note per content string, titled by its first word; returns their ids."""
+    from app.extensions import db
+    from app.models.note import Note
+
+    with app.app_context():
+        notes = [Note(user_id=user_id, title=c.split()[0], content_md=c) for c in contents]
+        db.session.add_all(notes)
+        db.session.commit()
+        return [n.id for n in notes]
+
+
+def embedded_note_ids(app):
+    """Ids of the notes that have stored embeddings."""
+    from app.extensions import db
+    from app.models.embedding import Embedding
+
+    with app.app_context():
+        return {n for (n,) in db.session.query(Embedding.note_id).distinct()}
+
+
+def make_test_config(tmp_path, **overrides):
+    return type("TestConfig", (Config,), {**temp_settings(tmp_path), **overrides})
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    from app import create_app
+    from app.services import ann_index, embedding_service, vector_index
+
+    # These process-wide caches are keyed by user id and index version, which every test's database reuses
+    monkeypatch.setattr(embedding_service, "_result_cache", None)
+    monkeypatch.setattr(vector_index, "_cache", None)
+    ann_index._trained.clear()
+    return create_app(make_test_config(tmp_path))
@@ -0,0 +1,54 @@
+"""Unit tests for the IVF approximate nearest-neighbour index (app/services/ann_index.py)."""
+import numpy as np
+import pytest
+
+from app.services import ann_index
+from app.services.ann_index import build_ivf, get_ivf, recall_report
+from app.services.vector_index import VectorIndex
+
+
+def _unit(x):
+    return (x / np.linalg.norm(x, axis=1, keepdims=True)).astype(np.float32)
+
+
+def _clustered_index(user_id=1, n=4000, dim=32, clusters=50, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim))
+    matrix = _unit(centers[rng.integers(clusters, size=n)] + 0.3 * rng.standard_normal((n, dim)))
+    ids = np.arange(n, dtype=np.int64)
+    return VectorIndex(user_id, 0, ids, ids // 4, matrix)
+
+
+@pytest.fixture(autouse=True)
+def _fresh_centroids():
+    ann_index._trained.clear()
+    yield
+    ann_index._trained.clear()
+
+
+def test_probing_every_cell_scans_every_row_once():
+    index = _clustered_index(n=500)
+    ivf = get_ivf(index)
+    rows = ivf.candidates(index.matrix[0], ivf.n_cells)
+    assert sorted(rows.tolist()) == list(range(len(index)))
+    assert get_ivf(index) is ivf  # Kept on the snapshot
+
+
+def test_recall_is_high_and_grows_with_nprobe():
+    index = _clustered_index()
+    queries = index.matrix[np.random.default_rng(1).choice(len(index), 100, replace=False)]
+    report = recall_report(index, queries, k=8, nprobes=(1, 4, 8, 16))
+
+    assert report["cells"] == int(np.sqrt(len(index)))
+    recalls = [r["recall_at_k"] for r in report["ivf"]]
+    assert recalls == sorted(recalls)
+    by_probe = {r["nprobe"]: r for r in report["ivf"]}
+    assert by_probe[8]["recall_at_k"] >= 0.9
+    assert by_probe[8]["scanned_fraction"] < 0.5
+
+
+def test_centroids_are_reused_until_the_corpus_doubles():
+    small = _clustered_index(n=1000)
+    trained = build_ivf(small).centroids
+    assert build_ivf(_clustered_index(n=1500)).centroids is trained
+    assert build_ivf(_clustered_index(n=2500)).centroids is not trained
@@ -0,0 +1,141 @@
+"""Unit tests for the ASGI entry point's chat stream relay (app/asgi.py)."""
+import asyncio
+import importlib
+import json
+
+import httpx
+import pytest
+
+import config
+from conftest import temp_settings
+
+
+@pytest.fixture(scope="module")
+def asgi(tmp_path_factory):
+    # app.asgi builds its Flask app from the global Config at import
+    settings = {**temp_settings(tmp_path_factory.mktemp("asgi")), "ASGI_THREADS": 4}
+    with pytest.MonkeyPatch.context() as mp:
+        for name, value in settings.items():
+            mp.setattr(config.Config, name, value)
+        yield importlib.import_module("app.asgi")
+
+
+def _sse_body(*chunks):
+    lines = [f"data: {json.dumps({'choices': [{'delta': {'content': c}}]})}\n\n" for c in chunks]
+    return "".join(lines) + "data: [DONE]\n\n"
+
+
+def _events(body):
+    """Decoded JSON payloads of an SSE response body, plus "[DONE]" where it appears."""
+    events = []
+    for line in body.splitlines():
+        if line.startswith("data: "):
+            data = line[6:]
+            events.append(data if data == "[DONE]" else json.loads(data))
+    return events
+
+
+async def _start_chat(client, username):
+    response = await client.post(
+        "/auth/register", json={"username": username, "email": f"{username}@localhost", "password": "secret1"}
+    )
+    assert response.status_code == 201
+    response = await client.post("/api/chat/threads", json={})
+    assert response.status_code == 201
+    return response.json()["id"]
+
+
+def _client(asgi):
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=asgi.app), base_url="http://test")
+
+
+def _use_upstream(asgi, monkeypatch, handler):
+    monkeypatch.setattr(asgi, "_client", httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+
+
+async def _last_reply(client, thread_id):
+    response = await client.get(f"/api/chat/threads/{thread_id}/messages")
+    return response.json()["messages"][-1]
+
+
+def test_stream_is_relayed_and_saved(asgi, monkeypatch):
+    requests = []
+
+    def upstream(request):
+        requests.append(json.loads(request.content))
+        return httpx.Response(200, text=_sse_body("The slope ", "is 2."))
+
+    _use_upstream(asgi, monkeypatch, upstream)
+
+    async def run():
+        async with _client(asgi) as client:
+            thread_id = await _start_chat(client, "streamer")
+            response = await client.post(f"/api/chat/threads/{thread_id}/messages", json={"content": "hi", "stream": True})
+            return response, await _last_reply(client, thread_id)
+
+    response, reply = asyncio.run(run())
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    events = _events(response.text)
+    assert "context_tokens" in events[0]
+    assert "".join(e["content"] for e in events if isinstance(e, dict) and "content" in e) == "The slope is 2."
+    assert events[-2] == {"message_id": reply["id"], "status": "complete"}
+    assert events[-1] == "[DONE]"
+    assert requests[0]["stream"] is True
+    assert reply["role"] == "assistant" and reply["content"] == "The slope is 2."
+
+
+class _BrokenStream(httpx.AsyncByteStream):
+    """Upstream body that sends one chunk, then drops the connection."""
+
+    async def __aiter__(self):
+        yield _sse_body("Partial answer").split("data: [DONE]")[0].encode()
+        raise httpx.ReadError("connection reset")
+
+
+def test_upstream_failure_mid_stream_keeps_the_partial_reply(asgi, monkeypatch):
+    _use_upstream(asgi, monkeypatch, lambda request: httpx.Response(200, stream=_BrokenStream()))
+
+    async def run():
+        async with _client(asgi) as client:
+            thread_id = await _start_chat(client, "interrupted")
+            response = await client.post(f"/api/chat/threads/{thread_id}/messages", json={"content": "hi"})
+            return response, await _last_reply(client, thread_id)
+
+    response, reply = asyncio.run(run())
+    events = _events(response.text)
+    assert {"content": "Partial answer"} in events
+    assert any(isinstance(e, dict) and "connection reset" in e.get("error", "") for e in events)
+    assert events[-2] == {"message_id": reply["id"], "status": "partial"}
+    assert events[-1] == "[DONE]"
+    assert reply["content"] == "Partial answer"
+
+
+def test_open_streams_do_not_hold_pool_threads(asgi, monkeypatch):
+    streams = 12  # Three times ASGI_THREADS
+    opened = 0
+    all_open = asyncio.Event()
+
+    async def upstream(request):
+        # Every stream waits upstream until all of them are open at once
+        nonlocal opened
+        opened += 1
+        if opened == streams:
+            all_open.set()
+        await asyncio.wait_for(all_open.wait(), 10)
+        return httpx.Response(200, text=_sse_body("ok"))
+
+    _use_upstream(asgi, monkeypatch, upstream)
+
+    async def chat(i):
+        async with _client(asgi) as client:
+            thread_id = await _start_chat(client, f"parallel{i}")
+            response = await client.post(f"/api/chat/threads/{thread_id}/messages", json={"content": "hi"})
+            return _events(response.text)
+
+    async def run():
+        return await asyncio.gather(*(chat(i) for i in range(streams)))
+
+    for events in asyncio.run(run()):
+        assert {"content": "ok"} in events and events[-1] == "[DONE]"
+    assert opened == streams
@@ -0,0 +1,80 @@
+"""Unit tests for the BM25 inverted index over note chunks (app/services/bm25_index.py)."""
+import math
+
+import numpy as np
+import pytest
+
+from app.extensions import db
+from app.models.embedding import Embedding, Posting
+from app.models.note import Note
+from app.services import bm25_index, embedding_service
+from app.services.bm25_index import bm25_scores, tokenize
+from conftest import add_notes, add_user
+
+
+def _index(app, user_id, *contents):
+    note_ids = add_notes(app, user_id, *contents)
+    with app.app_context():
+        embedding_service.store_embeddings_for_notes(Note.query.filter(Note.id.in_(note_ids)).all())
+    return note_ids
+
+
+def _scores_by_text(user_id, query):
+    ids, scores = bm25_scores(user_id, query)
+    texts = dict(db.session.query(Embedding.id, Embedding.chunk_text).filter(Embedding.id.in_(ids.tolist())))
+    return {texts[int(i)]: float(s) for i, s in zip(ids, scores)}
+
+
+def test_tokenize_splits_cjk_into_bigrams_and_keeps_words():
+    assert tokenize("二次方程") == ["二次", "次方", "方程"]
+    assert tokenize("求 x 的值") == ["求", "的值", "x"]
+    assert tokenize("Newton's LAW") == ["newton", "s", "law"]
+    assert tokenize("a" * 40) == ["a" * bm25_index.MAX_TERM_LENGTH]
+
+
+def test_scores_follow_the_bm25_formula(app):
+    user_id = add_user(app)
+    _index(app, user_id, "判别式 判别式 小于零时方程无实根", "判别式等于零时有两个相等实根", "光合作用需要光照和叶绿素")
+    with app.app_context():
+        scores = _scores_by_text(user_id, "判别")
+        chunks = Embedding.query.all()
+
+    # Reference computation over every stored chunk (titles included)
+    docs = [tokenize(e.chunk_text) for e in chunks]
+    avg_len = sum(map(len, docs)) / len(docs)
+    df = sum("判别" in d for d in docs)
+    idf = math.log1p((len(docs) - df + 0.5) / (df + 0.5))
+    expected = {}
+    for emb, terms in zip(chunks, docs):
+        tf = terms.count("判别")
+        if tf:
+            k1, b = bm25_index.BM25_K1, bm25_index.BM25_B
+            expected[emb.chunk_text] = idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * len(terms) / avg_len))
+    assert scores.keys() == expected.keys()
+    for text, score in expected.items():
+        assert scores[text] == pytest.approx(score, rel=1e-5)
+
+
+def test_terms_in_too_many_chunks_are_skipped(app, monkeypatch):
+    monkeypatch.setattr(bm25_index, "BM25_MIN_DF_CUTOFF", 1)
+    monkeypatch.setattr(bm25_index, "BM25_MAX_DF_RATIO", 0.5)
+    user_id = add_user(app)
+    _index(app, user_id, *(f"方程 练习题第{i}题的解答过程" for i in range(4)), "判别式的定义与方程根的关系")
+    with app.app_context():
+        assert len(bm25_scores(user_id, "方程")[0]) == 0  # In every note: no signal, not worth reading
+        ids, _ = bm25_scores(user_id, "方程 判别")
+    assert len(ids) == 1  # Only the selective term was scored
+
+
+def test_postings_are_scoped_per_user_and_removed_with_the_chunks(app):
+    owner, other = add_user(app, "owner"), add_user(app, "other")
+    note_id, = _index(app, owner, "判别式决定一元二次方程实根的个数")
+    _index(app, other, "化学方程式需要配平原子个数")
+    with app.app_context():
+        assert len(bm25_scores(owner, "配平")[0]) == 0
+        assert len(bm25_scores(None, "配平")[0]) == 1
+
+        embedding_service.delete_embeddings_for_note(db.session.get(Note, note_id))
+        db.session.commit()
+        assert len(bm25_scores(owner, "判别")[0]) == 0
+        assert Posting.query.filter_by(user_id=owner).count() == 0
@@ -0,0 +1,121 @@
+"""Unit tests for chat history windowing and the rolling thread summary (app/services/chat_history.py)."""
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import pytest
+
+from app.extensions import db
+from app.models.chat import ChatMessage, ChatThread
+from app.services import chat_history
+from app.services.chat_history import build_history, invalidate_summary
+from conftest import add_user, wait_until
+
+
+@pytest.fixture
+def thread_id(app):
+    """A thread with four answered turns and a new question: u1 a1 u2 a2 u3 a3 u4 a4 u5."""
+    app.config.update(CHAT_HISTORY_TURNS=2, CHAT_SUMMARY_BATCH_TURNS=2, CHAT_HISTORY_TOKEN_BUDGET=8000)
+    user_id = add_user(app)
+    with app.app_context():
+        thread = ChatThread(user_id=user_id)
+        db.session.add(thread)
+        db.session.flush()
+        start = datetime.now(timezone.utc)
+        for i in range(9):
+            role, turn = ("user", i // 2 + 1) if i % 2 == 0 else ("assistant", i // 2 + 1)
+            db.session.add(ChatMessage(thread_id=thread.id, role=role, content=f"{role[0]}{turn}",
+                                       created_at=start + timedelta(seconds=i)))
+        db.session.commit()
+        return thread.id
+
+
+def _history(app, thread_id, service=None):
+    with app.app_context():
+        summary, messages = build_history(db.session.get(ChatThread, thread_id), service=service)
+        return summary, [m["content"] for m in messages]
+
+
+@pytest.fixture
+def summaries(monkeypatch):
+    """Stands in for the summary model; records what each fold was asked to summarize."""
+    calls = []
+
+    def summarize(service, model, previous, messages):
+        calls.append((previous, [m.content for m in messages]))
+        return f"summary {len(calls)}"
+
+    monkeypatch.setattr(chat_history, "_summarize", summarize)
+    return calls
+
+
+def _service():
+    return SimpleNamespace(user=None)
+
+
+def _wait_for_folds():
+    wait_until(lambda: not chat_history._folding, timeout=5)
+
+
+def test_window_keeps_the_newest_turns_up_to_the_fold_threshold(app, thread_id):
+    # keep 2 turns + a batch of 2 - 1: three user turns stay verbatim before anything is folded
+    assert _history(app, thread_id) == (None, ["u3", "a3", "u4", "a4", "u5"])
+
+
+def test_window_shrinks_to_the_token_budget_but_keeps_the_new_message(app, thread_id):
+    app.config["CHAT_HISTORY_TOKEN_BUDGET"] = 2
+    assert _history(app, thread_id) == (None, ["a4", "u5"])
+    app.config["CHAT_HISTORY_TOKEN_BUDGET"] = 0
+    assert _history(app, thread_id) == (None, ["u5"])
+
+
+def test_turn_settings_below_one_are_clamped(app, thread_id):
+    app.config.update(CHAT_HISTORY_TURNS=0, CHAT_SUMMARY_BATCH_TURNS=0)
+    assert _history(app, thread_id) == (None, ["u5"])
+
+
+def test_older_turns_are_folded_in_the_background(app, thread_id, summaries):
+    # While the fold runs, the reply still sees every turn that fits
+    assert _history(app, thread_id, _service()) == (None, ["u1", "a1", "u2", "a2", "u3", "a3", "u4", "a4", "u5"])
+    _wait_for_folds()
+    assert summaries == [(None, ["u1", "a1", "u2", "a2", "u3", "a3"])]
+
+    assert _history(app, thread_id, _service()) == ("summary 1", ["u4", "a4", "u5"])
+    _wait_for_folds()
+    assert len(summaries) == 1  # Not due again until the window grows by another batch
+
+
+def test_the_next_fold_sends_only_the_previous_summary_and_new_turns(app, thread_id, summaries):
+    _history(app, thread_id, _service())
+    _wait_for_folds()
+    with app.app_context():
+        last = ChatMessage.query.order_by(ChatMessage.created_at.desc()).first().created_at
+        for i, (role, content) in enumerate([("assistant", "a5"), ("user", "u6"), ("assistant", "a6"), ("user", "u7")]):
+            db.session.add(ChatMessage(thread_id=thread_id, role=role, content=content,
+                                       created_at=last + timedelta(seconds=i + 1)))
+        db.session.commit()
+
+    _history(app, thread_id, _service())
+    _wait_for_folds()
+    assert summaries[1] == ("summary 1", ["u4", "a4", "u5", "a5"])
+    assert _history(app, thread_id) == ("summary 2", ["u6", "a6", "u7"])
+
+
+def test_a_failed_fold_keeps_the_previous_summary(app, thread_id, monkeypatch):
+    def fail(*args):
+        raise RuntimeError("summary model unavailable")
+
+    monkeypatch.setattr(chat_history, "_summarize", fail)
+    _history(app, thread_id, _service())
+    _wait_for_folds()
+    assert _history(app, thread_id)[0] is None
+
+
+def test_editing_a_summarized_message_drops_the_summary(app, thread_id, summaries):
+    _history(app, thread_id, _service())
+    _wait_for_folds()
+    with app.app_context():
+        thread = db.session.get(ChatThread, thread_id)
+        invalidate_summary(thread, thread.messages[-1].id)  # After the summary: kept
+        assert thread.summary == "summary 1"
+        invalidate_summary(thread, thread.messages[0].id)
+        assert thread.summary is None and thread.summary_upto_id is None
@@ -0,0 +1,119 @@
+"""Unit tests for the resumable 'flask reindex' command (app/cli.py)."""
+import json
+import signal
+import threading
+
+from app.extensions import db
+from app.models.embedding import Embedding
+from app.models.note import Note
+from app.services import embedding_service
+from conftest import add_notes, add_user, embedded_note_ids
+
+
+def _reindex(app, tmp_path, *args, workers=1):
+    checkpoint = str(tmp_path / "reindex.json")
+    return app.test_cli_runner().invoke(
+        args=["reindex", "--workers", str(workers), "--checkpoint", checkpoint, *args], catch_exceptions=False
+    )
+
+
+def _blobs(app):
+    with app.app_context():
+        return {(e.note_id, e.chunk_text): e.vector_blob for e in Embedding.query}
+
+
+def test_reindex_embeds_every_note_and_removes_its_checkpoint(app, tmp_path):
+    note_ids = add_notes(app, add_user(app), "first note", "second note", "third note")
+    result = _reindex(app, tmp_path, "--batch-size", "2")
+    assert result.exit_code == 0, result.output
+    assert "Re-indexed 3 notes" in result.output
+    assert embedded_note_ids(app) == set(note_ids)
+    assert not (tmp_path / "reindex.json").exists()
+
+
+def test_reindex_resumes_after_its_checkpoint(app, tmp_path):
+    note_ids = add_notes(app, add_user(app), "first note", "second note", "third note")
+    with app.app_context():
+        version = embedding_service.get_embedding_provider().version
+    (tmp_path / "reindex.json").write_text(json.dumps({
+        "user_id": None, "stale_only": False, "force": False, "version": version,
+        "last_note_id": note_ids[0], "notes_done": 1, "chunks_done": 0,
+    }))
+    result = _reindex(app, tmp_path)
+    assert result.exit_code == 0, result.output
+    assert embedded_note_ids(app) == set(note_ids[1:])
+
+
+def test_checkpoint_from_other_options_is_refused(app, tmp_path):
+    add_notes(app, add_user(app), "first note")
+    (tmp_path / "reindex.json").write_text(json.dumps({
+        "user_id": 42, "stale_only": False, "force": False, "version": "other",
+        "last_note_id": 0, "notes_done": 0, "chunks_done": 0,
+    }))
+    result = _reindex(app, tmp_path)
+    assert result.exit_code != 0 and "--restart" in result.output
+    assert _reindex(app, tmp_path, "--restart").exit_code == 0
+
+
+def test_stale_only_rebuilds_just_the_outdated_notes(app, tmp_path):
+    current, stale = add_notes(app, add_user(app), "current note", "stale note")
+    assert _reindex(app, tmp_path).exit_code == 0
+    with app.app_context():
+        Embedding.query.filter_by(note_id=stale).update({Embedding.vector_version: "old-model"})
+        db.session.commit()
+        current_ids = {e.id for e in Embedding.query.filter_by(note_id=current)}
+
+    result = _reindex(app, tmp_path, "--stale-only")
+    assert result.exit_code == 0, result.output
+    assert "Re-indexed 1 notes" in result.output
+    with app.app_context():
+        assert {e.id for e in Embedding.query.filter_by(note_id=current)} == current_ids
+        assert embedding_service.count_stale_embeddings() == 0
+
+
+def test_worker_processes_produce_the_same_vectors(app, tmp_path):
+    add_notes(app, add_user(app), *(f"note {i}: 二次方程的判别式与实根个数的关系" for i in range(6)))
+    assert _reindex(app, tmp_path).exit_code == 0
+    sequential = _blobs(app)
+    assert _reindex(app, tmp_path, "--force", workers=2).exit_code == 0
+    assert _blobs(app) == sequential
+
+
+def test_reindex_restores_the_sigterm_handler(app, tmp_path):
+    add_notes(app, add_user(app), "only note")
+
+    def handler(signum, frame):
+        pass
+
+    previous = signal.signal(signal.SIGTERM, handler)
+    try:
+        assert _reindex(app, tmp_path).exit_code == 0
+        assert signal.getsignal(signal.SIGTERM) is handler
+    finally:
+        signal.signal(signal.SIGTERM, previous)
+
+
+def test_note_deleted_between_plan_and_apply_is_skipped(app, tmp_path, monkeypatch):
+    first, doomed, last = add_notes(app, add_user(app), "first note", "doomed note", "last note")
+    plan = embedding_service.plan_embeddings
+
+    def plan_then_delete(notes, force=False):
+        plans = plan(notes, force=force)
+        if any(n.id == doomed for n in notes):
+            # Another request deletes the note after its batch was planned, before the batch is written
+            def delete():
+                with app.app_context():
+                    note = db.session.get(Note, doomed)
+                    embedding_service.delete_embeddings_for_note(note)
+                    db.session.delete(note)
+                    db.session.commit()
+
+            thread = threading.Thread(target=delete)
+            thread.start()
+            thread.join()
+        return plans
+
+    monkeypatch.setattr(embedding_service, "plan_embeddings", plan_then_delete)
+    result = _reindex(app, tmp_path, "--batch-size", "1")
+    assert result.exit_code == 0, result.output
+    assert embedded_note_ids(app) == {first, last}
@@ -0,0 +1,65 @@
+"""Unit tests for token-budgeted MMR context packing (app/services/context_packer.py)."""
+import numpy as np
+import pytest
+
+from app.services.context_packer import estimate_tokens, pack_context
+
+
+def _chunk(emb_id, note_id, similarity, text):
+    return {"embedding_id": emb_id, "note_id": note_id, "similarity": similarity, "chunk_text": text}
+
+
+def _unit(*rows):
+    matrix = np.array(rows, dtype=np.float32)
+    return matrix / np.linalg.norm(matrix, axis=1, keepdims=True)
+
+
+def test_estimate_counts_cjk_characters_and_quarter_tokens_otherwise():
+    assert estimate_tokens("") == 0
+    assert estimate_tokens("判别式") == 3
+    assert estimate_tokens("abcdefgh") == 2
+    assert estimate_tokens("判别式 abcd") == 3 + 2  # " abcd" is five characters
+
+
+@pytest.mark.parametrize("budget", [10, 40, 80, 400])
+def test_packed_context_stays_within_the_budget(budget):
+    rng = np.random.default_rng(0)
+    chunks = [_chunk(i, i % 4, 1.0 - i / 40, f"chunk {i} " + "text " * int(rng.integers(2, 30))) for i in range(20)]
+    context, tokens, chosen = pack_context(chunks, _unit(*rng.standard_normal((20, 16))), budget)
+    assert tokens == estimate_tokens(context) <= budget
+    for c in chosen:
+        assert c["chunk_text"] in context
+
+
+def test_near_duplicates_are_dropped():
+    chunks = [_chunk(1, 1, 0.9, "Question: solve x^2 - 4 = 0"), _chunk(2, 2, 0.89, "Question: solve x^2 - 4 = 0."),
+              _chunk(3, 3, 0.5, "Photosynthesis needs light")]
+    _, _, chosen = pack_context(chunks, _unit([1, 0, 0], [1, 0.01, 0], [0, 1, 0]), budget=1000)
+    assert [c["embedding_id"] for c in chosen] == [1, 3]
+
+
+def test_mmr_prefers_a_diverse_chunk_over_a_redundant_one():
+    chunks = [_chunk(1, 1, 0.9, "quadratic roots"), _chunk(2, 2, 0.85, "quadratic roots again"),
+              _chunk(3, 3, 0.7, "vertex of a parabola")]
+    vectors = _unit([1, 0], [0.8, 0.6], [0, 1])
+    relevance_only = pack_context(chunks, vectors, budget=1000, mmr_lambda=1.0)[2]
+    diverse = pack_context(chunks, vectors, budget=1000, mmr_lambda=0.5)[2]
+    assert [c["embedding_id"] for c in relevance_only] == [1, 2, 3]
+    assert [c["embedding_id"] for c in diverse] == [1, 3, 2]
+
+
+def test_a_chunk_too_long_for_the_rest_of_the_budget_is_skipped():
+    chunks = [_chunk(1, 1, 0.9, "short one"), _chunk(2, 2, 0.8, "long " * 100), _chunk(3, 3, 0.7, "short two")]
+    _, _, chosen = pack_context(chunks, _unit([1, 0, 0], [0, 1, 0], [0, 0, 1]), budget=30)
+    assert [c["embedding_id"] for c in chosen] == [1, 3]
+
+
+def test_chunks_of_one_note_share_a_block_in_stored_order():
+    chunks = [_chunk(7, 1, 0.9, "second paragraph"), _chunk(9, 2, 0.8, "other note"), _chunk(3, 1, 0.7, "first paragraph")]
+    context, _, _ = pack_context(chunks, _unit([1, 0, 0], [0, 1, 0], [0, 0, 1]), budget=1000)
+    assert context == "[Note #1] first paragraph\nsecond paragraph\n\n---\n\n[Note #2] other note"
+
+
+def test_nothing_to_pack():
+    assert pack_context([], np.zeros((0, 4)), budget=100) == ("", 0, [])
+    assert pack_context([_chunk(1, 1, 0.9, "text")], _unit([1, 0]), budget=0) == ("", 0, [])
@@ -0,0 +1,87 @@
+"""Unit tests for API key encryption and the decrypted key cache (app/utils/crypto.py)."""
+import time
+from types import SimpleNamespace
+
+import pytest
+from cryptography.fernet import Fernet
+
+from app.utils import crypto
+
+
+@pytest.fixture
+def keys(app, monkeypatch):
+    """Fresh Fernet and key cache state; counts the decryptions that reach Fernet."""
+    for name in ("_fernet", "_fernet_key", "_key_cache"):
+        monkeypatch.setattr(crypto, name, None)
+    app.config["FERNET_KEY"] = Fernet.generate_key().decode()
+    decrypted = []
+    decrypt = crypto.decrypt_api_key
+
+    def counting(encrypted_key):
+        decrypted.append(encrypted_key)
+        return decrypt(encrypted_key)
+
+    monkeypatch.setattr(crypto, "decrypt_api_key", counting)
+    return decrypted
+
+
+def _user(app, plain, user_id=1):
+    with app.app_context():
+        return SimpleNamespace(id=user_id, openrouter_api_key_enc=crypto.encrypt_api_key(plain))
+
+
+def test_fernet_is_built_once_per_key(app, keys):
+    with app.app_context():
+        fernet = crypto.get_fernet()
+        assert crypto.get_fernet() is fernet
+        token = crypto.encrypt_api_key("sk-or-old")
+        app.config["FERNET_KEY"] = Fernet.generate_key().decode()
+        assert crypto.get_fernet() is not fernet
+        assert crypto.decrypt_api_key(crypto.encrypt_api_key("sk-or-new")) == "sk-or-new"
+        assert fernet.decrypt(token.encode()) == b"sk-or-old"
+
+
+def test_placeholder_key_uses_one_random_key_per_process(app, keys):
+    app.config["FERNET_KEY"] = "generate-a-key"
+    with app.app_context():
+        token = crypto.encrypt_api_key("sk-or-key")
+        assert crypto.decrypt_api_key(token) == "sk-or-key"
+
+
+def test_decrypted_key_is_cached(app, keys):
+    user = _user(app, "sk-or-key")
+    with app.app_context():
+        assert [crypto.get_user_api_key(user) for _ in range(3)] == ["sk-or-key"] * 3
+        assert crypto.api_key_cache_stats()["hits"] == 2
+    assert len(keys) == 1
+
+
+def test_changed_ciphertext_is_never_served_stale(app, keys):
+    user = _user(app, "sk-or-old")
+    with app.app_context():
+        assert crypto.get_user_api_key(user) == "sk-or-old"
+        # Another worker stored a new key: the row now carries a different ciphertext
+        user.openrouter_api_key_enc = crypto.encrypt_api_key("sk-or-new")
+        assert crypto.get_user_api_key(user) == "sk-or-new"
+        assert crypto.get_user_api_key(_user(app, "sk-or-other", user_id=2)) == "sk-or-other"
+
+
+def test_forgotten_key_is_decrypted_again(app, keys):
+    user = _user(app, "sk-or-key")
+    with app.app_context():
+        crypto.get_user_api_key(user)
+        crypto.forget_user_api_key(user)
+        assert crypto.get_user_api_key(user) == "sk-or-key"
+        crypto.forget_user_api_key(SimpleNamespace(id=3, openrouter_api_key_enc=None))
+    assert len(keys) == 2
+
+
+def test_cached_key_expires_after_the_ttl(app, keys):
+    app.config["API_KEY_CACHE_TTL"] = 0.05
+    user = _user(app, "sk-or-key")
+    with app.app_context():
+        crypto.get_user_api_key(user)
+        time.sleep(0.06)
+        assert crypto.get_user_api_key(user) == "sk-or-key"
+        assert crypto.api_key_cache_stats()["expirations"] == 1
+    assert len(keys) == 2
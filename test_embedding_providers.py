@@ -0,0 +1,131 @@
+"""Unit tests for the embedding providers and their content-hash cache (app/services/embedding_providers.py)."""
+import numpy as np
+import pytest
+
+from app.extensions import db
+from app.models.embedding import EmbeddingCacheEntry
+from app.services import embedding_providers, http_client
+from app.services.embedding_providers import (
+    CachedProvider, EmbeddingProvider, HashingProvider, OpenAICompatibleProvider, get_embedding_provider,
+)
+
+DIM = 8
+
+
+class _Response:
+    def __init__(self, data):
+        self._data = data
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return {"data": self._data}
+
+
+def _vector(text):
+    """A distinct, easily checked vector per text."""
+    vec = np.zeros(DIM, dtype=np.float32)
+    vec[len(text) % DIM] = 1.0
+    return vec
+
+
+def _fake_api(monkeypatch, shuffle=False, drop_index=False, dim=DIM):
+    """Serve embeddings for http_client.post; returns the list of input batches it received."""
+    batches = []
+
+    def post(url, json=None, **kwargs):
+        batches.append(json["input"])
+        data = [{"index": i, "embedding": np.resize(_vector(t), dim).tolist()} for i, t in enumerate(json["input"])]
+        if shuffle:
+            data.reverse()
+        if drop_index:
+            for item in data:
+                del item["index"]
+        return _Response(data)
+
+    monkeypatch.setattr(http_client, "post", post)
+    return batches
+
+
+def _remote(batch_size=2):
+    return OpenAICompatibleProvider("http://embeddings.test/v1", "test-model", DIM, batch_size=batch_size)
+
+
+TEXTS = ["a", "bb", "ccc", "dddd", "eeeee"]
+
+
+@pytest.mark.parametrize("shuffle, drop_index", [(False, False), (True, False), (False, True)])
+def test_remote_provider_batches_and_places_vectors_by_position(monkeypatch, shuffle, drop_index):
+    batches = _fake_api(monkeypatch, shuffle=shuffle, drop_index=drop_index)
+    out = _remote().embed(TEXTS)
+    assert batches == [["a", "bb"], ["ccc", "dddd"], ["eeeee"]]
+    np.testing.assert_array_equal(out, np.vstack([_vector(t) for t in TEXTS]))
+
+
+def test_remote_provider_rejects_a_wrong_dimension(monkeypatch):
+    _fake_api(monkeypatch, dim=DIM * 2)
+    with pytest.raises(ValueError, match="dimension"):
+        _remote().embed(TEXTS)
+
+
+def test_remote_provider_rejects_duplicate_indexes(monkeypatch):
+    def post(url, json=None, **kwargs):
+        return _Response([{"index": 0, "embedding": _vector(t).tolist()} for t in json["input"]])
+
+    monkeypatch.setattr(http_client, "post", post)
+    with pytest.raises(ValueError, match="indexes"):
+        _remote().embed(TEXTS)
+
+
+class _CountingProvider(EmbeddingProvider):
+    name = "counting"
+    model = "m"
+    dim = DIM
+
+    def __init__(self):
+        self.embedded = []
+
+    def embed(self, texts):
+        self.embedded.extend(texts)
+        return np.vstack([_vector(t) for t in texts])
+
+
+def test_cache_embeds_each_distinct_text_once(app):
+    with app.app_context():
+        inner = _CountingProvider()
+        cached = CachedProvider(inner)
+        out = cached.embed(["x", "yy", "x"])
+        db.session.commit()
+        np.testing.assert_array_equal(out, np.vstack([_vector(t) for t in ["x", "yy", "x"]]))
+        assert inner.embedded == ["x", "yy"]
+
+        # A new instance (another worker, a restart) reads the committed vectors back
+        again = CachedProvider(inner)
+        np.testing.assert_array_equal(again.embed(["yy", "x"]), out[[1, 0]])
+        assert inner.embedded == ["x", "yy"]
+        assert again.stats()["hits"] == 2 and again.stats()["misses"] == 0
+
+
+def test_query_lookups_are_not_stored(app):
+    with app.app_context():
+        cached = CachedProvider(_CountingProvider())
+        cached.embed(["one-off query"], store=False)
+        db.session.commit()
+        assert EmbeddingCacheEntry.query.count() == 0
+
+
+def test_long_model_names_fit_the_version_column():
+    provider = OpenAICompatibleProvider("http://x", "organisation/" + "very-long-model-name" * 3, DIM)
+    assert len(provider.version) <= 32 and provider.version.startswith("openai:")
+    assert HashingProvider(dim=DIM).version == HashingProvider(dim=DIM)._vectorizer.version
+
+
+def test_provider_is_rebuilt_when_settings_change(app, monkeypatch):
+    monkeypatch.setattr(embedding_providers, "_provider", None)
+    with app.app_context():
+        hashing = get_embedding_provider()
+        assert isinstance(hashing, HashingProvider) and get_embedding_provider() is hashing
+        app.config.update(EMBEDDING_PROVIDER="openai", EMBEDDING_API_BASE="http://embeddings.test/v1")
+        remote = get_embedding_provider()
+        assert isinstance(remote, CachedProvider) and isinstance(remote.provider, OpenAICompatibleProvider)
@@ -0,0 +1,78 @@
+"""Unit tests for storing note embeddings (app/services/embedding_service.py)."""
+from app.extensions import db
+from app.models.embedding import Embedding
+from app.models.note import Note
+from app.services import embedding_service
+from app.services.vector_index import get_index_version
+from conftest import add_notes, add_user
+
+PARAGRAPHS = [
+    "The discriminant of a quadratic equation tells how many real roots it has.",
+    "Photosynthesis turns light energy into chemical energy stored in glucose.",
+    "Newton's second law relates net force, mass and acceleration of a body.",
+]
+
+
+def _store(app, note_id):
+    with app.app_context():
+        return embedding_service.store_embeddings_for_note(db.session.get(Note, note_id))
+
+
+def _rows(app, note_id):
+    """chunk_text -> embedding id of the note's stored rows."""
+    with app.app_context():
+        return {e.chunk_text: e.id for e in Embedding.query.filter_by(note_id=note_id)}
+
+
+def _edit(app, note_id, content):
+    with app.app_context():
+        db.session.get(Note, note_id).content_md = content
+        db.session.commit()
+
+
+def test_unchanged_note_writes_nothing(app):
+    user_id = add_user(app)
+    note_id, = add_notes(app, user_id, "\n\n".join(PARAGRAPHS))
+    assert _store(app, note_id) == {"reused": 0, "rebuilt": 4, "removed": 0}  # 3 paragraphs + the title chunk
+    before = _rows(app, note_id)
+    with app.app_context():
+        version = get_index_version(user_id)
+
+    assert _store(app, note_id) == {"reused": 4, "rebuilt": 0, "removed": 0}
+    assert _rows(app, note_id) == before
+    with app.app_context():
+        assert get_index_version(user_id) == version
+
+
+def test_only_the_edited_paragraph_is_re_embedded(app):
+    note_id, = add_notes(app, add_user(app), "\n\n".join(PARAGRAPHS))
+    _store(app, note_id)
+    before = _rows(app, note_id)
+
+    edited = "Ohm's law says current equals voltage divided by resistance in a circuit."
+    _edit(app, note_id, "\n\n".join([PARAGRAPHS[0], edited, PARAGRAPHS[2]]))
+    assert _store(app, note_id) == {"reused": 3, "rebuilt": 1, "removed": 1}
+
+    after = _rows(app, note_id)
+    assert PARAGRAPHS[1] not in after and edited in after
+    for text in (PARAGRAPHS[0], PARAGRAPHS[2]):
+        assert after[text] == before[text]  # Kept rows keep their ids and vectors
+
+
+def test_repeated_paragraph_keeps_one_row_per_copy(app):
+    note_id, = add_notes(app, add_user(app), "\n\n".join([PARAGRAPHS[0], PARAGRAPHS[0]]))
+    assert _store(app, note_id)["rebuilt"] == 3
+
+    _edit(app, note_id, PARAGRAPHS[0])
+    assert _store(app, note_id) == {"reused": 2, "rebuilt": 0, "removed": 1}
+    with app.app_context():
+        assert Embedding.query.filter_by(note_id=note_id, chunk_text=PARAGRAPHS[0]).count() == 1
+
+
+def test_rows_from_another_embedding_version_are_rebuilt(app):
+    note_id, = add_notes(app, add_user(app), PARAGRAPHS[0])
+    _store(app, note_id)
+    with app.app_context():
+        Embedding.query.filter_by(note_id=note_id).update({Embedding.vector_version: "old-model"})
+        db.session.commit()
+    assert _store(app, note_id) == {"reused": 0, "rebuilt": 2, "removed": 2}
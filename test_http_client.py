@@ -0,0 +1,98 @@
+"""Unit tests for the pooled outbound HTTP client (app/services/http_client.py)."""
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from app.services import http_client
+
+
+class _EchoHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Keep-alive, so the client can reuse its connection
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        reply = json.dumps({"echo": json.loads(body)}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(reply)))
+        self.end_headers()
+        self.wfile.write(reply)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server_url():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _EchoHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/v1"
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def client(monkeypatch):
+    """A fresh session and counters for each test."""
+    for name in ("_session", "_session_key"):
+        monkeypatch.setattr(http_client, name, None)
+    monkeypatch.setattr(http_client, "_requests", http_client.Counter())
+    monkeypatch.setattr(http_client, "_new_connections", http_client.Counter())
+    return http_client
+
+
+def test_sequential_calls_reuse_one_connection(app, server_url, client):
+    with app.app_context():
+        before = client.thread_usage()
+        for i in range(5):
+            assert client.post(server_url, json={"n": i}).json() == {"echo": {"n": i}}
+        after = client.thread_usage()
+        stats = client.http_client_stats()
+
+    assert after["requests"] - before["requests"] == 5
+    assert after["new_connections"] - before["new_connections"] == 1
+    assert stats["hosts"]["127.0.0.1"] == {"requests": 5, "new_connections": 1, "reused": 4}
+    assert stats["reuse_rate"] == 0.8
+
+
+def test_thread_usage_counts_only_the_calling_thread(app, server_url, client):
+    usage = {}
+
+    def call():
+        with app.app_context():
+            client.post(server_url, json={})
+            usage["worker"] = client.thread_usage()
+
+    thread = threading.Thread(target=call)
+    thread.start()
+    thread.join()
+    with app.app_context():
+        mine = client.thread_usage()
+        client.post(server_url, json={})
+        assert client.thread_usage()["requests"] == mine["requests"] + 1
+    assert usage["worker"] == {"requests": 1, "new_connections": 1}
+
+
+def test_session_is_rebuilt_when_the_pool_size_changes(app, client):
+    with app.app_context():
+        session = client.get_session()
+        assert client.get_session() is session
+        app.config["HTTP_POOL_SIZE"] = 4
+        assert client.get_session() is not session
+        assert client.http_client_stats()["pool_size"] == 4
+
+
+def test_connect_and_read_timeouts_are_separate(app, client, monkeypatch):
+    sent = {}
+    app.config.update(HTTP_CONNECT_TIMEOUT=3, HTTP_READ_TIMEOUT=90)
+    with app.app_context():
+        monkeypatch.setattr(client.get_session(), "post", lambda url, **kwargs: sent.update(kwargs))
+        client.post("https://api.example.com/v1")
+        assert sent["timeout"] == (3, 90)
+        client.post("https://api.example.com/v1", read_timeout=10)
+        assert sent["timeout"] == (3, 10)
+        client.post("https://api.example.com/v1", timeout=1)
+        assert sent["timeout"] == 1
@@ -0,0 +1,107 @@
+"""Unit tests for the background embedding indexer (app/services/indexer.py)."""
+import threading
+
+import pytest
+
+from app.extensions import db
+from app.models.note import Note
+from app.services import embedding_service
+from app.services.embedding_providers import get_embedding_provider
+from app.services.indexer import EmbeddingIndexer
+from conftest import add_notes, add_user, embedded_note_ids
+
+
+@pytest.fixture
+def indexer(app):
+    app.config.update(
+        EMBEDDING_INDEXER_ASYNC=True,
+        EMBEDDING_INDEXER_DEBOUNCE_SECONDS=0.01,
+        EMBEDDING_INDEXER_RETRY_SECONDS=0.05,
+        EMBEDDING_INDEXER_MAX_ATTEMPTS=3,
+    )
+    indexer = EmbeddingIndexer()
+    indexer.init_app(app)
+    return indexer
+
+
+def test_failed_batch_is_retried_with_backoff(app, indexer, monkeypatch):
+    note_ids = add_notes(app, add_user(app), "quadratic discriminant", "photosynthesis light reactions")
+    store = embedding_service.store_embeddings_for_notes
+    batches = []
+
+    def flaky(notes):
+        batches.append(sorted(n.id for n in notes))
+        if len(batches) == 1:
+            raise RuntimeError("embedding API unavailable")
+        return store(notes)
+
+    monkeypatch.setattr(embedding_service, "store_embeddings_for_notes", flaky)
+    for note_id in note_ids:
+        indexer.note_changed(note_id)
+    assert indexer.wait_until_idle(5)
+
+    assert batches[0] == sorted(note_ids)
+    assert sorted(n for batch in batches[1:] for n in batch) == sorted(note_ids)
+    assert embedded_note_ids(app) == set(note_ids)
+    stats = indexer.stats()
+    assert stats["retries"] == 2 and stats["failed"] == 0 and stats["retrying"] == 0
+
+
+def test_note_that_keeps_failing_is_retried_alone_then_dropped(app, indexer, monkeypatch):
+    good, bad = add_notes(app, add_user(app), "vector projection", "poison pill")
+    store = embedding_service.store_embeddings_for_notes
+    batches = []
+
+    def fails_on_bad(notes):
+        batches.append(sorted(n.id for n in notes))
+        if any(n.id == bad for n in notes):
+            raise RuntimeError("malformed note")
+        return store(notes)
+
+    monkeypatch.setattr(embedding_service, "store_embeddings_for_notes", fails_on_bad)
+    indexer.note_changed(good)
+    indexer.note_changed(bad)
+    assert indexer.wait_until_idle(5)
+
+    # After the shared batch fails, each note is retried in a batch of its own
+    assert batches[0] == sorted([good, bad])
+    assert all(len(batch) == 1 for batch in batches[1:])
+    assert batches.count([bad]) == 2  # 3 attempts in all
+    assert embedded_note_ids(app) == {good}
+    assert indexer.stats()["failed"] == 1
+
+
+def test_note_deleted_while_its_batch_is_embedded_gets_no_rows(app, monkeypatch):
+    doomed, kept = add_notes(app, add_user(app), "doomed note text", "kept note text")
+    with app.app_context():
+        provider = get_embedding_provider()
+    embed = provider.embed
+
+    def delete_meanwhile(texts, **kwargs):
+        # Another request deletes the note while the batch's vectors are being computed
+        def delete():
+            with app.app_context():
+                note = db.session.get(Note, doomed)
+                embedding_service.delete_embeddings_for_note(note)
+                db.session.delete(note)
+                db.session.commit()
+
+        thread = threading.Thread(target=delete)
+        thread.start()
+        thread.join()
+        return embed(texts, **kwargs)
+
+    monkeypatch.setattr(provider, "embed", delete_meanwhile)
+    with app.app_context():
+        embedding_service.store_embeddings_for_notes(Note.query.filter(Note.id.in_([doomed, kept])).all())
+
+    assert embedded_note_ids(app) == {kept}
+
+
+def test_init_app_registers_one_exit_hook(app, monkeypatch):
+    registered = []
+    monkeypatch.setattr("app.services.indexer.atexit.register", lambda fn, *args: registered.append(fn))
+    indexer = EmbeddingIndexer()
+    indexer.init_app(app)
+    indexer.init_app(app)
+    assert registered == [indexer.wait_until_idle]
@@ -0,0 +1,121 @@
+"""Unit tests for the on-disk LLM response cache (app/services/llm_cache.py)."""
+import time
+
+import pytest
+
+from app.services import http_client, llm_cache
+from app.services.llm_cache import LLMCache, cache_key, get_llm_cache
+from app.services.openrouter import OpenRouterService
+
+MESSAGES = [{"role": "user", "content": "Grade: x = 3 solves 2x + 1 = 7"}]
+
+
+def _payload(messages=MESSAGES, **overrides):
+    return {"model": "test/model", "messages": messages, "temperature": 0, "max_tokens": 100, **overrides}
+
+
+def test_key_ignores_line_endings_surrounding_space_and_unicode_form():
+    same = [{"role": "user", "content": "  Grade: x = 3 solves 2x + 1 = 7\r\n"}]
+    assert cache_key(_payload(same)) == cache_key(_payload())
+    composed, decomposed = "caf\u00e9", "cafe\u0301"
+    assert cache_key(_payload([{"role": "user", "content": composed}])) == \
+        cache_key(_payload([{"role": "user", "content": decomposed}]))
+
+
+def test_key_covers_model_temperature_and_max_tokens():
+    keys = {cache_key(_payload(**change)) for change in
+            ({}, {"model": "test/other"}, {"temperature": 0.2}, {"max_tokens": 200})}
+    assert len(keys) == 4
+    assert cache_key(_payload(stream=False)) == cache_key(_payload())
+
+
+def test_hits_count_the_upstream_time_saved(app, tmp_path):
+    with app.app_context():
+        cache = LLMCache(str(tmp_path / "cache.db"), ttl=60, max_bytes=1 << 20)
+        assert cache.get("k") is None
+        cache.put("k", "test/model", "Correct.", latency=1.5)
+        assert cache.get("k") == "Correct."
+        assert cache.get("k") == "Correct."
+        stats = cache.stats()
+    assert (stats["entries"], stats["hits"], stats["misses"]) == (1, 2, 1)
+    assert stats["upstream_seconds_saved"] == 3.0
+
+
+def test_entries_are_shared_through_the_file(app, tmp_path):
+    path = str(tmp_path / "cache.db")
+    with app.app_context():
+        LLMCache(path, ttl=60, max_bytes=1 << 20).put("k", "test/model", "Correct.", latency=1)
+        assert LLMCache(path, ttl=60, max_bytes=1 << 20).get("k") == "Correct."
+
+
+def test_expired_entries_are_not_served(app, tmp_path):
+    with app.app_context():
+        cache = LLMCache(str(tmp_path / "cache.db"), ttl=0.05, max_bytes=1 << 20)
+        cache.put("k", "test/model", "Correct.", latency=1)
+        time.sleep(0.06)
+        assert cache.get("k") is None
+        cache.evict()
+        assert cache.stats()["entries"] == 0
+
+
+def test_least_recently_used_responses_are_evicted_beyond_max_bytes(app, tmp_path):
+    with app.app_context():
+        cache = LLMCache(str(tmp_path / "cache.db"), ttl=60, max_bytes=25)
+        for key in ("a", "b", "c"):
+            cache.put(key, "test/model", "x" * 10, latency=1)
+            time.sleep(0.01)
+        cache.get("a")  # "b" is now the least recently used
+        cache.evict()
+        assert cache.get("b") is None
+        assert cache.get("a") and cache.get("c")
+        assert cache.stats()["bytes"] == 20
+
+
+def test_disabled_cache(app):
+    app.config["LLM_CACHE_ENABLED"] = False
+    with app.app_context():
+        assert get_llm_cache() is None
+        assert llm_cache.llm_cache_stats() == {"enabled": False}
+
+
+class _Response:
+    def __init__(self, content):
+        self._content = content
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return {"choices": [{"message": {"content": self._content}}], "usage": {"total_tokens": 10}}
+
+
+@pytest.fixture
+def upstream(app, monkeypatch):
+    """Answer completions without the network; returns the payloads sent upstream."""
+    monkeypatch.setattr(llm_cache, "_cache", None)
+    sent = []
+
+    def post(url, json=None, **kwargs):
+        sent.append(json)
+        return _Response(f"answer {len(sent)}")
+
+    monkeypatch.setattr(http_client, "post", post)
+    return sent
+
+
+def test_opted_in_completions_are_served_from_the_cache(app, upstream):
+    with app.app_context():
+        service = OpenRouterService()
+        replies = [service.chat_completion(MESSAGES, model="test/model", temperature=0, cache=True) for _ in range(2)]
+        other = service.chat_completion(MESSAGES, model="test/model", temperature=0.5, cache=True)
+    assert replies == ["answer 1", "answer 1"]
+    assert other == "answer 2"
+    assert len(upstream) == 2
+
+
+def test_completions_without_cache_always_go_upstream(app, upstream):
+    with app.app_context():
+        service = OpenRouterService()
+        replies = [service.chat_completion(MESSAGES, model="test/model", temperature=0) for _ in range(2)]
+        assert get_llm_cache().stats()["entries"] == 0
+    assert replies == ["answer 1", "answer 2"]
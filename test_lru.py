@@ -0,0 +1,51 @@
+"""Unit tests for the thread-safe LRU cache (app/utils/lru.py)."""
+import time
+
+from app.utils.lru import LRUCache
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = LRUCache(2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1  # "b" is now the least recently used
+    cache.put("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1 and cache.get("c") == 3
+    assert cache.stats()["evictions"] == 1
+
+
+def test_capacity_is_measured_by_the_weigher():
+    cache = LRUCache(100, weigher=len)
+    cache.put("a", b"x" * 60)
+    cache.put("b", b"x" * 30)
+    cache.put("c", b"x" * 30)  # 120 > 100: evicts "a"
+    assert len(cache) == 2 and cache.weight == 60
+    assert cache.put("huge", b"x" * 101) is False
+    assert cache.get("huge") is None and cache.weight == 60
+
+
+def test_entries_expire_after_ttl():
+    cache = LRUCache(10, ttl=0.05)
+    cache.put("a", 1)
+    assert cache.get("a") == 1
+    time.sleep(0.06)
+    assert cache.get("a", default="gone") == "gone"
+    assert cache.stats()["expirations"] == 1
+
+
+def test_invalid_entry_is_dropped_and_counted_as_a_miss():
+    cache = LRUCache(10)
+    cache.put("a", 1)
+    assert cache.get("a", is_valid=lambda value: value == 2) is None
+    assert len(cache) == 0
+    assert cache.stats()["misses"] == 1
+
+
+def test_putting_a_key_again_replaces_its_weight():
+    cache = LRUCache(100, weigher=len)
+    cache.put("a", "x" * 40)
+    cache.put("a", "x" * 10)
+    assert cache.weight == 10
+    cache.pop("a")
+    assert cache.weight == 0 and len(cache) == 0
@@ -0,0 +1,122 @@
+"""Unit tests for quantized vector storage and scoring (app/services/quantization.py)."""
+import numpy as np
+import pytest
+
+from app.models.embedding import Embedding
+from app.models.note import Note
+from app.services import embedding_service
+from app.services.quantization import (
+    QuantizedMatrix, SparseMatrix, blob_matches, blob_size, decode_blobs, encode_vectors, quantize,
+    ranking_agreement, to_sparse,
+)
+from app.services.vectorizer import HashingVectorizer
+from conftest import add_notes, add_user
+
+DIM = 64
+
+
+def _unit_rows(n, dim=DIM, seed=0):
+    matrix = np.random.default_rng(seed).standard_normal((n, dim)).astype(np.float32)
+    return matrix / np.linalg.norm(matrix, axis=1, keepdims=True)
+
+
+@pytest.mark.parametrize("fmt, tolerance", [("float32", 0), ("float16", 1e-3), ("int8", 1e-2)])
+def test_blobs_round_trip_within_the_format_precision(fmt, tolerance):
+    matrix = _unit_rows(20)
+    blobs = encode_vectors(matrix, fmt)
+    assert all(len(b) == blob_size(fmt, DIM) and blob_matches(b, fmt, DIM) for b in blobs)
+
+    decoded = np.asarray(decode_blobs(blobs, [fmt] * len(blobs), DIM, fmt), dtype=np.float32)
+    np.testing.assert_allclose(decoded, matrix, atol=tolerance)
+
+
+@pytest.mark.parametrize("fmt", ["float16", "int8"])
+def test_quantized_scoring_matches_dense_scoring(fmt):
+    matrix, query = _unit_rows(10000), _unit_rows(1, seed=1)[0]
+    quantized = quantize(matrix, fmt)
+    assert isinstance(quantized, QuantizedMatrix) and quantized.format == fmt
+    assert quantized.nbytes < matrix.nbytes / (1.9 if fmt == "float16" else 3.5)
+    np.testing.assert_allclose(quantized @ query, matrix @ query, atol=0.02)
+    np.testing.assert_allclose(quantized[[3, 7]] @ query, (matrix @ query)[[3, 7]], atol=0.02)
+
+
+def test_int8_keeps_rankings_of_hashed_embeddings():
+    texts = [f"练习题 {i}: 求方程 x^2 + {i}x + {i % 7} = 0 的判别式" for i in range(300)]
+    dense = HashingVectorizer(dim=384).transform(texts)
+    agreement = ranking_agreement(dense, quantize(dense, "int8"), dense[:50], k=8)
+    assert agreement["top1_agreement"] == 1.0
+    assert agreement["overlap_at_k"] >= 0.9
+
+
+def test_mixed_formats_decode_into_the_target_format():
+    matrix = _unit_rows(3)
+    blobs = [encode_vectors(matrix[i:i + 1], fmt)[0] for i, fmt in enumerate(["float32", "float16", "int8"])]
+    decoded = decode_blobs(blobs, [None, "float16", "int8"], DIM, "float16")
+    assert decoded.format == "float16"
+    np.testing.assert_allclose(np.asarray(decoded), matrix, atol=1e-2)
+
+
+def test_int8_storage_serves_the_same_results(app):
+    user_id = add_user(app)
+    add_notes(app, user_id, "The discriminant of a quadratic equation decides its real roots.",
+              "Photosynthesis stores light energy as chemical energy in glucose.")
+    app.config.update(EMBEDDING_STORAGE="int8", RETRIEVAL_BM25_WEIGHT=0)
+    with app.app_context():
+        embedding_service.store_embeddings_for_notes(Note.query.all())
+        assert {e.vector_format for e in Embedding.query} == {"int8"}
+        results = embedding_service.retrieve_relevant_chunks("quadratic discriminant", user_id, top_k=4)
+        exact = embedding_service.generate_embeddings([r["chunk_text"] for r in results]) \
+            @ embedding_service.generate_embedding("quadratic discriminant")
+    assert "discriminant" in results[0]["chunk_text"]
+    np.testing.assert_allclose([r["similarity"] for r in results], exact, atol=0.02)
+
+
+# ── Sparse ──
+
+def _hashed(n=50, dim=1024):
+    """Hashed embeddings with a few empty rows, as stored chunks really are."""
+    texts = [f"判别式 练习 {i} quadratic roots {i * 7}" if i % 10 else "" for i in range(n)]
+    return HashingVectorizer(dim=dim).transform(texts)
+
+
+def test_sparse_blobs_round_trip_exactly():
+    dense = _hashed()
+    blobs = encode_vectors(dense, "sparse")
+    assert len(blobs[0]) == 0 and all(blob_matches(b, "sparse", 1024) for b in blobs)
+    decoded = decode_blobs(blobs, ["sparse"] * len(blobs), 1024, "sparse")
+    assert isinstance(decoded, SparseMatrix)
+    np.testing.assert_array_equal(np.asarray(decoded), dense)
+    assert decoded.nbytes < dense.nbytes / 4
+
+
+def test_sparse_dense_product_matches_dense_scoring():
+    dense = _hashed()
+    sparse = to_sparse(dense)
+    query = HashingVectorizer(dim=1024).transform(["quadratic 判别式"])[0]
+    np.testing.assert_allclose(sparse @ query, dense @ query, atol=1e-6)
+    for rows in ([0, 11, 3], np.arange(50) % 3 == 0, slice(5, 15)):
+        np.testing.assert_allclose(sparse[rows] @ query, (dense @ query)[rows], atol=1e-6)
+        np.testing.assert_array_equal(np.asarray(sparse[rows]), dense[rows])
+
+
+def test_sparse_columns_beyond_the_dimension_are_dropped():
+    wide = np.zeros((2, 16), dtype=np.float32)
+    wide[0, [1, 12]] = [0.6, 0.8]
+    wide[1, 3] = 1.0
+    narrow = decode_blobs(encode_vectors(wide, "sparse"), ["sparse", "sparse"], 8, "sparse")
+    assert narrow.shape == (2, 8)
+    np.testing.assert_array_equal(np.asarray(narrow), wide[:, :8])
+
+
+def test_sparse_storage_scores_exactly_like_float32(app):
+    user_id = add_user(app)
+    add_notes(app, user_id, "The discriminant of a quadratic equation decides its real roots.",
+              "Photosynthesis stores light energy as chemical energy in glucose.")
+    app.config.update(EMBEDDING_STORAGE="sparse", RETRIEVAL_BM25_WEIGHT=0)
+    with app.app_context():
+        embedding_service.store_embeddings_for_notes(Note.query.all())
+        assert {e.vector_format for e in Embedding.query} == {"sparse"}
+        results = embedding_service.retrieve_relevant_chunks("quadratic discriminant", user_id, top_k=4)
+        exact = embedding_service.generate_embeddings([r["chunk_text"] for r in results]) \
+            @ embedding_service.generate_embedding("quadratic discriminant")
+    np.testing.assert_allclose([r["similarity"] for r in results], exact, atol=1e-6)
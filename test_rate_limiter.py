@@ -0,0 +1,147 @@
+"""Unit tests for the per-key LLM request limiter (app/services/rate_limiter.py)."""
+import asyncio
+import threading
+import time
+
+import pytest
+from flask import Flask
+
+from app.services import rate_limiter
+from app.services.rate_limiter import KeyLimiter, LimiterTimeout, get_limiter
+from conftest import wait_until
+
+
+def _queued(limiter, lane):
+    return limiter.stats()["queued"][lane]
+
+
+def _acquire_in_thread(limiter, lane, order, label=None):
+    def run():
+        grant = limiter.acquire(lane, 0)
+        order.append(lane if label is None else label)
+        limiter.release(grant)
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread
+
+
+def test_waiting_interactive_requests_go_before_batch():
+    limiter = KeyLimiter("test", concurrency=1)
+    holder = limiter.acquire("interactive", 0)
+    order = []
+    threads = [_acquire_in_thread(limiter, "batch", order)]
+    wait_until(lambda: _queued(limiter, "batch") == 1)
+    threads.append(_acquire_in_thread(limiter, "interactive", order))
+    wait_until(lambda: _queued(limiter, "interactive") == 1)
+
+    limiter.release(holder)
+    for thread in threads:
+        thread.join(2)
+    assert order == ["interactive", "batch"]
+
+
+def test_same_lane_is_first_come_first_served():
+    limiter = KeyLimiter("test", concurrency=1)
+    holder = limiter.acquire("batch", 0)
+    order = []
+    threads = []
+    for i in range(3):
+        threads.append(_acquire_in_thread(limiter, "batch", order, label=i))
+        wait_until(lambda: _queued(limiter, "batch") == i + 1)
+
+    limiter.release(holder)
+    for thread in threads:
+        thread.join(2)
+    assert order == [0, 1, 2]
+    assert limiter.stats()["granted"]["batch"] == 4
+
+
+def test_batch_lane_is_capped_at_its_share_of_slots():
+    limiter = KeyLimiter("test", concurrency=4, batch_share=0.5, max_wait=0.1)
+    batch = [limiter.acquire("batch", 0) for _ in range(2)]
+    with pytest.raises(LimiterTimeout):
+        limiter.acquire("batch", 0)
+
+    # The remaining slots stay free for interactive requests
+    interactive = [limiter.acquire("interactive", 0) for _ in range(2)]
+    assert limiter.stats()["in_flight"] == {"interactive": 2, "batch": 2}
+    for grant in batch + interactive:
+        limiter.release(grant)
+    assert limiter.stats()["in_flight"] == {"interactive": 0, "batch": 0}
+
+
+def test_timeout_leaves_the_queue_and_is_counted():
+    limiter = KeyLimiter("test", concurrency=1, max_wait=0.1)
+    holder = limiter.acquire("interactive", 0)
+    started = time.monotonic()
+    with pytest.raises(LimiterTimeout):
+        limiter.acquire("interactive", 0)
+    assert time.monotonic() - started < 1
+
+    stats = limiter.stats()
+    assert stats["timeouts"]["interactive"] == 1
+    assert stats["queued"] == {"interactive": 0, "batch": 0}
+
+    # A timed-out ticket doesn't block the next request once the slot frees up
+    limiter.release(holder)
+    limiter.release(limiter.acquire("interactive", 0))
+
+
+def test_async_acquire_times_out():
+    limiter = KeyLimiter("test", concurrency=1, max_wait=0.1)
+    holder = limiter.acquire("interactive", 0)
+    with pytest.raises(LimiterTimeout):
+        asyncio.run(limiter.acquire_async("interactive", 0))
+    limiter.release(holder)
+    limiter.release(asyncio.run(limiter.acquire_async("interactive", 0)))
+
+
+def test_request_bucket_limits_rpm():
+    limiter = KeyLimiter("test", concurrency=0, rpm=2, max_wait=0.1)
+    for _ in range(2):
+        limiter.release(limiter.acquire("interactive", 0))
+    with pytest.raises(LimiterTimeout):
+        limiter.acquire("interactive", 0)
+
+
+def test_unused_tokens_are_refunded():
+    limiter = KeyLimiter("test", concurrency=0, tpm=1000, max_wait=0.1)
+    grant = limiter.acquire("interactive", 800)
+    with pytest.raises(LimiterTimeout):
+        limiter.acquire("interactive", 800)
+    limiter.release(grant, used_tokens=100)
+    limiter.release(limiter.acquire("interactive", 800))
+
+
+def test_open_stream_frees_its_slot_but_keeps_its_tokens():
+    limiter = KeyLimiter("test", concurrency=1, tpm=1000, max_wait=0.1)
+    stream = limiter.acquire("interactive", 600)
+    limiter.stream_opened(stream)
+    assert limiter.stats()["streaming"]["interactive"] == 1
+
+    # The slot is free again, but the stream's reservation still counts toward TPM
+    other = limiter.acquire("interactive", 300)
+    limiter.release(other, used_tokens=300)
+    with pytest.raises(LimiterTimeout):
+        limiter.acquire("interactive", 300)
+
+    limiter.release(stream, used_tokens=100)
+    stats = limiter.stats()
+    assert stats["streaming"]["interactive"] == 0
+    assert stats["in_flight"]["interactive"] == 0
+    limiter.release(limiter.acquire("interactive", 300))
+
+
+def test_least_recently_used_key_limiters_are_evicted(monkeypatch):
+    monkeypatch.setattr(rate_limiter, "_limiters", None)
+    app = Flask(__name__)
+    app.config["LLM_LIMIT_KEYS"] = 2
+    with app.app_context():
+        first = get_limiter("key-1", "user:1")
+        get_limiter("key-2", "user:2")
+        assert get_limiter("key-1", "user:1") is first
+        get_limiter("key-3", "user:3")  # Evicts key-2, the least recently used
+
+        assert set(rate_limiter.rate_limiter_stats()) == {"user:1", "user:3"}
+        assert get_limiter("key-1", "user:1") is first
@@ -0,0 +1,216 @@
+"""Unit tests for retries, hedging and circuit breaking of LLM calls (app/services/resilience.py)."""
+import asyncio
+import threading
+import time
+
+import pytest
+import requests
+from flask import Flask
+
+from app.services.resilience import CircuitBreaker, CircuitOpenError, Resilience
+
+
+def _http_error(status, headers=None):
+    response = requests.Response()
+    response.status_code = status
+    response.headers.update(headers or {})
+    return requests.HTTPError(f"{status} error", response=response)
+
+
+def _failing(*errors, result="ok"):
+    """send() raising the given errors in turn, then returning result; .calls counts attempts."""
+    pending = list(errors)
+
+    def send():
+        send.calls += 1
+        if pending:
+            raise pending.pop(0)
+        return result
+
+    send.calls = 0
+    return send
+
+
+# ── CircuitBreaker ──
+
+def test_breaker_opens_after_threshold_failures():
+    breaker = CircuitBreaker(threshold=3, cooldown=60)
+    for _ in range(2):
+        assert breaker.allow()
+        assert breaker.record(False) is False
+    assert breaker.state == "closed"
+    assert breaker.allow()
+    assert breaker.record(False) is True
+    assert breaker.state == "open"
+    assert not breaker.allow()
+    assert breaker.stats()["rejected"] == 1
+
+
+def test_success_resets_the_failure_count():
+    breaker = CircuitBreaker(threshold=2, cooldown=60)
+    breaker.record(False)
+    breaker.record(True)
+    breaker.record(False)
+    assert breaker.state == "closed"
+
+
+def test_half_open_admits_a_single_probe_and_closes_on_success():
+    breaker = CircuitBreaker(threshold=1, cooldown=0.05)
+    breaker.record(False)
+    assert not breaker.allow()
+    time.sleep(0.06)
+
+    assert breaker.allow()  # The probe
+    assert breaker.state == "half_open"
+    assert not breaker.allow()  # Everyone else waits for its outcome
+    breaker.record(True)
+    assert breaker.state == "closed"
+    assert breaker.allow()
+
+
+def test_failed_probe_reopens_the_circuit():
+    breaker = CircuitBreaker(threshold=5, cooldown=0.05)
+    for _ in range(5):
+        breaker.record(False)
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.record(False)
+    assert breaker.state == "open"
+    assert breaker.opens == 2
+    assert not breaker.allow()
+    assert breaker.retry_in() > 0
+
+
+def test_probe_released_without_a_verdict_lets_the_next_call_probe():
+    breaker = CircuitBreaker(threshold=1, cooldown=0.05)
+    breaker.record(False)
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.release()  # e.g. the probe got a 400
+    assert breaker.state == "half_open"
+    assert breaker.allow()
+
+
+# ── Resilience.call ──
+
+def _resilience(**kwargs):
+    settings = {"attempts": 3, "base_delay": 0.001, "max_delay": 1, "breaker_failures": 2, "breaker_cooldown": 60}
+    settings.update(kwargs)
+    return Resilience(**settings)
+
+
+def test_retries_server_errors_then_succeeds():
+    resilience = _resilience(breaker_failures=5)
+    send = _failing(_http_error(503), requests.ConnectionError("reset"))
+    assert resilience.call("m", send) == "ok"
+    assert send.calls == 3
+    assert resilience.stats()["retry_reasons"] == {"503": 1, "connection": 1}
+    assert resilience.breaker("m").state == "closed"
+
+
+def test_client_errors_are_not_retried_and_do_not_open_the_breaker():
+    resilience = _resilience(breaker_failures=1)
+    send = _failing(_http_error(400))
+    with pytest.raises(requests.HTTPError):
+        resilience.call("m", send)
+    assert send.calls == 1
+    assert resilience.breaker("m").state == "closed"
+
+
+def test_rate_limits_are_retried_without_opening_the_breaker():
+    resilience = _resilience(breaker_failures=1)
+    send = _failing(_http_error(429), _http_error(429))
+    assert resilience.call("m", send) == "ok"
+    assert resilience.breaker("m").state == "closed"
+
+
+def test_retry_after_beyond_max_delay_fails_at_once():
+    resilience = _resilience(max_delay=1)
+    send = _failing(_http_error(429, {"Retry-After": "30"}))
+    with pytest.raises(requests.HTTPError):
+        resilience.call("m", send)
+    assert send.calls == 1
+    assert resilience.stats()["failed"] == {"429": 1}
+
+
+def test_read_timeouts_are_not_retried_but_count_against_the_model():
+    resilience = _resilience(breaker_failures=1)
+    send = _failing(requests.ReadTimeout("slow"))
+    with pytest.raises(requests.ReadTimeout):
+        resilience.call("m", send)
+    assert send.calls == 1
+    assert resilience.breaker("m").state == "open"
+
+
+def test_open_circuit_fails_fast_per_model():
+    resilience = _resilience(attempts=1, breaker_failures=2)
+    for _ in range(2):
+        with pytest.raises(requests.HTTPError):
+            resilience.call("bad", _failing(_http_error(502)))
+    send = _failing()
+    with pytest.raises(CircuitOpenError):
+        resilience.call("bad", send)
+    assert send.calls == 0
+    assert resilience.call("good", _failing()) == "ok"
+
+
+def test_async_call_retries():
+    resilience = _resilience()
+    attempts = []
+
+    async def send():
+        attempts.append(1)
+        if len(attempts) < 2:
+            raise _http_error(500)
+        return "ok"
+
+    assert asyncio.run(resilience.call_async("m", send)) == "ok"
+    assert len(attempts) == 2
+
+
+def test_slow_call_is_hedged_and_the_faster_request_wins():
+    resilience = _resilience(hedge_percentile=50, hedge_min_samples=1, hedge_threads=4)
+    app = Flask(__name__)
+    calls = []
+    lock = threading.Lock()
+
+    def send():
+        with lock:
+            calls.append(1)
+            stalled = len(calls) == 2  # Call 1 primes the latency window; call 2 stalls
+        time.sleep(1.0 if stalled else 0.01)
+        return "slow" if stalled else "fast"
+
+    with app.app_context():
+        assert resilience.call("m", send) == "fast"
+        started = time.monotonic()
+        assert resilience.call("m", send) == "fast"
+        assert time.monotonic() - started < 0.5
+    stats = resilience.stats()
+    assert stats["hedges"] == 1
+    assert stats["hedge_wins"] == 1
+
+
+def test_half_open_probe_is_not_hedged():
+    resilience = _resilience(attempts=1, breaker_failures=1, breaker_cooldown=0.05,
+                             hedge_percentile=50, hedge_min_samples=1, hedge_threads=4)
+    app = Flask(__name__)
+    calls = []
+
+    def slow():
+        calls.append(1)
+        time.sleep(0.2)
+        return "probe ok"
+
+    with app.app_context():
+        assert resilience.call("m", _failing()) == "ok"  # Primes the latency window
+        with pytest.raises(requests.HTTPError):
+            resilience.call("m", _failing(_http_error(502)))
+        assert resilience.breaker("m").state == "open"
+        time.sleep(0.06)
+
+        # The probe runs well past the hedge delay, yet stays the only request upstream
+        assert resilience.call("m", slow) == "probe ok"
+    assert len(calls) == 1
+    assert resilience.stats()["hedges"] == 0
+    assert resilience.breaker("m").state == "closed"
@@ -0,0 +1,151 @@
+"""Unit tests for retrieval over stored chunk vectors (retrieve_relevant_chunks in app/services/embedding_service.py)."""
+import numpy as np
+import pytest
+
+from app.models.embedding import Embedding
+from app.models.note import Note
+from app.services import embedding_service
+from app.services.bm25_index import bm25_scores
+from app.services.embedding_service import retrieve_relevant_chunks
+from conftest import add_notes, add_user
+
+NOTES = (
+    "The discriminant of a quadratic equation tells how many real roots it has.",
+    "Photosynthesis turns light energy into chemical energy stored in glucose.",
+    "Newton's second law relates net force, mass and acceleration of a body.",
+    "A quadratic function's vertex lies on its axis of symmetry x = -b / 2a.",
+)
+
+
+@pytest.fixture
+def corpus(app):
+    """(user_id, note_ids) with every note embedded; retrieval scores by cosine only."""
+    app.config["RETRIEVAL_BM25_WEIGHT"] = 0
+    user_id = add_user(app)
+    note_ids = add_notes(app, user_id, *NOTES)
+    with app.app_context():
+        embedding_service.store_embeddings_for_notes(Note.query.all())
+    return user_id, note_ids
+
+
+def _brute_force(query, k):
+    """(embedding_id, cosine) of the k best chunks, scoring one row at a time."""
+    query_vec = embedding_service.generate_embedding(embedding_service.normalize_query(query))
+    scored = []
+    for emb in Embedding.query.all():
+        vec = embedding_service.generate_embeddings([emb.chunk_text])[0]
+        scored.append((emb.id, float(vec @ query_vec)))
+    return sorted(scored, key=lambda s: -s[1])[:k]
+
+
+def test_results_match_a_row_by_row_cosine_scan(app, corpus):
+    user_id, _ = corpus
+    query = "quadratic equation roots"
+    with app.app_context():
+        results = retrieve_relevant_chunks(query, user_id, top_k=3)
+        expected = _brute_force(query, 3)
+    assert [r["embedding_id"] for r in results] == [emb_id for emb_id, _ in expected]
+    np.testing.assert_allclose([r["similarity"] for r in results], [s for _, s in expected], rtol=1e-5)
+    assert "discriminant" in results[0]["chunk_text"]
+
+
+def test_note_ids_restrict_the_candidates(app, corpus):
+    user_id, note_ids = corpus
+    with app.app_context():
+        results = retrieve_relevant_chunks("quadratic equation roots", user_id, note_ids=[note_ids[1]], top_k=8)
+    assert results and {r["note_id"] for r in results} == {note_ids[1]}
+
+
+def test_other_users_chunks_are_not_returned(app, corpus):
+    _, note_ids = corpus
+    other = add_user(app, "other")
+    with app.app_context():
+        assert retrieve_relevant_chunks("quadratic equation roots", other) == []
+        assert {r["note_id"] for r in retrieve_relevant_chunks("quadratic", None, top_k=50)} == set(note_ids)
+
+
+def test_keyword_hits_blend_max_normalized_bm25_into_the_cosine(app, corpus, monkeypatch):
+    user_id, _ = corpus
+    query = "discriminant"
+    with app.app_context():
+        cosine = {r["embedding_id"]: r["similarity"] for r in retrieve_relevant_chunks(query, user_id, top_k=50)}
+        app.config["RETRIEVAL_BM25_WEIGHT"] = 0.3
+        monkeypatch.setattr(embedding_service, "_result_cache", None)  # The weight isn't part of the cache key
+        fused = retrieve_relevant_chunks(query, user_id, top_k=50)
+        hit_ids, hit_scores = bm25_scores(user_id, query)
+
+    keyword = dict(zip(hit_ids.tolist(), (hit_scores / hit_scores.max()).tolist()))
+    assert keyword and fused[0]["embedding_id"] in keyword
+    for r in fused:
+        expected = 0.7 * cosine[r["embedding_id"]] + 0.3 * keyword.get(r["embedding_id"], 0.0)
+        assert r["similarity"] == pytest.approx(expected, abs=1e-5)
+
+
+def _count_searches(monkeypatch):
+    calls = []
+    search = embedding_service._search
+
+    def counting(*args):
+        calls.append(args)
+        return search(*args)
+
+    monkeypatch.setattr(embedding_service, "_search", counting)
+    return calls
+
+
+def test_repeated_query_is_served_from_the_cache(app, corpus, monkeypatch):
+    user_id, _ = corpus
+    searches = _count_searches(monkeypatch)
+    with app.app_context():
+        first = retrieve_relevant_chunks("Quadratic   equation roots", user_id, top_k=3)
+        first[0]["chunk_text"] = "mutated by the caller"
+        again = retrieve_relevant_chunks("quadratic equation ROOTS", user_id, top_k=3)
+        retrieve_relevant_chunks("quadratic equation roots", user_id, top_k=2)
+    assert len(searches) == 2  # Normalized re-send hits; another top_k doesn't
+    assert again[0]["chunk_text"] != "mutated by the caller"
+    assert embedding_service.retrieval_cache_stats()["hits"] == 1
+
+
+def test_embedding_writes_invalidate_cached_results(app, corpus, monkeypatch):
+    user_id, _ = corpus
+    searches = _count_searches(monkeypatch)
+    with app.app_context():
+        retrieve_relevant_chunks("ohm resistance voltage", user_id)
+    note_id, = add_notes(app, user_id, "Ohm's law: current equals voltage divided by resistance.")
+    with app.app_context():
+        embedding_service.store_embeddings_for_notes(Note.query.filter_by(id=note_id).all())
+        results = retrieve_relevant_chunks("ohm resistance voltage", user_id)
+    assert len(searches) == 2
+    assert results[0]["note_id"] == note_id
+
+
+def test_packed_store_writes_invalidate_cached_results(app, monkeypatch):
+    app.config.update(VECTOR_STORE_BACKEND="mmap", RETRIEVAL_BM25_WEIGHT=0)
+    user_id = add_user(app)
+    add_notes(app, user_id, *NOTES)
+    searches = _count_searches(monkeypatch)
+    with app.app_context():
+        embedding_service.store_embeddings_for_notes(Note.query.all())
+        retrieve_relevant_chunks("ohm resistance voltage", user_id)
+    note_id, = add_notes(app, user_id, "Ohm's law: current equals voltage divided by resistance.")
+    with app.app_context():
+        embedding_service.store_embeddings_for_notes(Note.query.filter_by(id=note_id).all())
+        results = retrieve_relevant_chunks("ohm resistance voltage", user_id)
+    assert len(searches) == 2
+    assert results[0]["note_id"] == note_id
+
+
+def test_cache_size_zero_disables_caching(app, corpus, monkeypatch):
+    user_id, _ = corpus
+    app.config["RETRIEVAL_CACHE_SIZE"] = 0
+    searches = _count_searches(monkeypatch)
+    with app.app_context():
+        for _ in range(2):
+            retrieve_relevant_chunks("quadratic", user_id)
+    assert len(searches) == 2
+
+
+def test_top_k_indices_agree_with_a_full_sort():
+    scores = np.random.default_rng(0).standard_normal(100).astype(np.float32)
+    for k in (1, 5, 99, 100, 150):
+        np.testing.assert_array_equal(embedding_service._top_k_indices(scores, k), np.argsort(-scores)[:k])
@@ -0,0 +1,144 @@
+"""Unit tests for single-flight deduplication of LLM calls (app/services/single_flight.py)."""
+import threading
+import time
+
+import pytest
+
+from app.services.single_flight import SingleFlight, SQLiteFlightBackend
+from conftest import wait_until
+
+
+class _Call:
+    """An upstream call that blocks until released, then returns or raises."""
+
+    def __init__(self, result="answer", error=None):
+        self.result = result
+        self.error = error
+        self.calls = 0
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def __call__(self):
+        self.calls += 1
+        self.started.set()
+        assert self.release.wait(5)
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+def _run_callers(flight, key, fn, n):
+    """Start n threads calling flight.do(key, fn); returns (threads, outcomes) with ("ok"|"error", value) per caller."""
+    outcomes = []
+    lock = threading.Lock()
+
+    def run():
+        try:
+            outcome = ("ok", flight.do(key, fn))
+        except Exception as e:
+            outcome = ("error", e)
+        with lock:
+            outcomes.append(outcome)
+
+    threads = [threading.Thread(target=run) for _ in range(n)]
+    for thread in threads:
+        thread.start()
+    return threads, outcomes
+
+
+def test_concurrent_identical_calls_share_one_upstream_call():
+    flight = SingleFlight()
+    call = _Call()
+    threads, outcomes = _run_callers(flight, "k", call, 5)
+    wait_until(lambda: flight.stats()["shared_local"] == 4)
+    call.release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert call.calls == 1
+    assert outcomes == [("ok", "answer")] * 5
+    assert flight.stats()["in_flight"] == 0
+
+
+def test_leader_error_reaches_every_waiter_and_frees_the_key():
+    flight = SingleFlight()
+    call = _Call(error=ValueError("upstream said no"))
+    threads, outcomes = _run_callers(flight, "k", call, 3)
+    wait_until(lambda: flight.stats()["shared_local"] == 2)
+    call.release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert call.calls == 1
+    assert len(outcomes) == 3
+    assert all(kind == "error" and isinstance(e, ValueError) for kind, e in outcomes)
+
+    # The failure isn't cached: the next caller goes upstream again
+    retry = _Call(result="second try")
+    retry.release.set()
+    assert flight.do("k", retry) == "second try"
+    assert retry.calls == 1
+
+
+def test_different_keys_do_not_share():
+    flight = SingleFlight()
+    a, b = _Call("a"), _Call("b")
+    threads_a, outcomes_a = _run_callers(flight, "a", a, 1)
+    threads_b, outcomes_b = _run_callers(flight, "b", b, 1)
+    assert a.started.wait(2) and b.started.wait(2)
+    a.release.set()
+    b.release.set()
+    for thread in threads_a + threads_b:
+        thread.join(5)
+    assert outcomes_a == [("ok", "a")] and outcomes_b == [("ok", "b")]
+
+
+def test_waiter_gives_up_after_wait_seconds():
+    flight = SingleFlight(wait=0.1)
+    call = _Call()
+    threads, _ = _run_callers(flight, "k", call, 1)
+    assert call.started.wait(2)
+    with pytest.raises(TimeoutError):
+        flight.do("k", call)
+    call.release.set()
+    for thread in threads:
+        thread.join(5)
+
+
+def test_sqlite_backend_shares_a_result_across_workers(tmp_path):
+    path = str(tmp_path / "flight.db")
+    worker_a, worker_b = SingleFlight(SQLiteFlightBackend(path)), SingleFlight(SQLiteFlightBackend(path))
+    call = _Call()
+    threads, outcomes = _run_callers(worker_a, "k", call, 1)
+    assert call.started.wait(2)
+
+    never = _Call(result="should not run")
+    threads_b, outcomes_b = _run_callers(worker_b, "k", never, 1)
+    time.sleep(0.15)  # Let worker B see the claim and start polling
+    call.release.set()
+    for thread in threads + threads_b:
+        thread.join(5)
+
+    assert outcomes == [("ok", "answer")] and outcomes_b == [("ok", "answer")]
+    assert never.calls == 0
+    assert worker_b.stats()["shared_remote"] == 1
+
+
+def test_sqlite_backend_waiter_takes_over_when_the_leader_fails(tmp_path):
+    path = str(tmp_path / "flight.db")
+    worker_a, worker_b = SingleFlight(SQLiteFlightBackend(path)), SingleFlight(SQLiteFlightBackend(path))
+    failing = _Call(error=RuntimeError("leader crashed"))
+    threads, outcomes = _run_callers(worker_a, "k", failing, 1)
+    assert failing.started.wait(2)
+
+    fallback = _Call(result="from worker b")
+    fallback.release.set()
+    threads_b, outcomes_b = _run_callers(worker_b, "k", fallback, 1)
+    time.sleep(0.15)
+    failing.release.set()
+    for thread in threads + threads_b:
+        thread.join(5)
+
+    assert outcomes[0][0] == "error" and isinstance(outcomes[0][1], RuntimeError)
+    assert outcomes_b == [("ok", "from worker b")]
+    assert fallback.calls == 1
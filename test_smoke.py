@@ -90,6 +90,10 @@ r = s.put(f"{base}/api/notes/{note['id']}", json={"title": "Updated Test Note",
 assert r.status_code == 200
 print(f"[OK] PUT /api/notes/{note['id']} -- title={r.json()['title']}, status={r.json()['status']}")
 
+r = s.get(f"{base}/api/notes/{note['id']}/related")
+assert r.status_code == 200
+print(f"[OK] GET /api/notes/{note['id']}/related -- {len(r.json()['related'])} related notes")
+
 # 9. Create chat thread
 r = s.post(f"{base}/api/chat/threads", json={"title": "Test Thread"})
 assert r.status_code == 201
@@ -0,0 +1,103 @@
+"""Unit tests for checkpointing streamed replies (app/services/stream_recorder.py)."""
+import pytest
+
+from app.extensions import db
+from app.models.chat import ChatMessage, ChatThread
+from app.services import stream_recorder
+from app.services.stream_recorder import StreamRecorder
+from conftest import add_user
+
+
+@pytest.fixture
+def thread_id(app):
+    user_id = add_user(app)
+    with app.app_context():
+        thread = ChatThread(user_id=user_id)
+        db.session.add(thread)
+        db.session.commit()
+        return thread.id
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """A monotonic clock the test advances by hand."""
+    now = [1000.0]
+    monkeypatch.setattr(stream_recorder.time, "monotonic", lambda: now[0])
+    return now
+
+
+def _saved(recorder):
+    message = db.session.get(ChatMessage, recorder.message_id)
+    db.session.refresh(message)
+    return message.content, message.status
+
+
+def test_checkpoint_after_enough_characters(app, thread_id, clock):
+    with app.app_context():
+        recorder = StreamRecorder(thread_id, checkpoint_chars=10, checkpoint_seconds=60)
+        recorder.append("Hello ")
+        assert recorder.message_id is None
+        recorder.append("world")
+        assert _saved(recorder) == ("Hello world", "partial")
+
+        recorder.append("!")  # Only one character since the last checkpoint
+        assert _saved(recorder) == ("Hello world", "partial")
+        recorder.finish()
+        assert _saved(recorder) == ("Hello world!", "complete")
+        assert ChatMessage.query.filter_by(thread_id=thread_id).count() == 1
+
+
+def test_checkpoint_after_enough_time(app, thread_id, clock):
+    with app.app_context():
+        recorder = StreamRecorder(thread_id, checkpoint_chars=1000, checkpoint_seconds=5)
+        recorder.append("slow ")
+        assert recorder.message_id is None
+        clock[0] += 5
+        recorder.append("stream")
+        assert _saved(recorder) == ("slow stream", "partial")
+
+        clock[0] += 10
+        assert recorder.feed("") is False  # Time alone is not enough without new text
+
+
+def test_take_returns_the_whole_reply_so_far(app, thread_id, clock):
+    with app.app_context():
+        recorder = StreamRecorder(thread_id, checkpoint_chars=3, checkpoint_seconds=60)
+        assert recorder.feed("ab") is False
+        assert recorder.feed("cd") is True
+        assert recorder.take() == "abcd"
+        assert recorder.feed("e") is False
+        assert recorder.take() == "abcde"
+
+
+def test_interrupted_stream_stays_partial(app, thread_id, clock):
+    with app.app_context():
+        recorder = StreamRecorder(thread_id, checkpoint_chars=1000, checkpoint_seconds=60)
+        recorder.append("Partial answer")
+        recorder.finish(complete=False)
+        assert _saved(recorder) == ("Partial answer", "partial")
+        assert recorder.status == "partial"
+
+
+def test_empty_reply_saves_nothing(app, thread_id, clock):
+    with app.app_context():
+        recorder = StreamRecorder(thread_id)
+        recorder.finish()
+        assert recorder.message_id is None
+        assert ChatMessage.query.filter_by(thread_id=thread_id).count() == 0
+
+
+def test_a_failed_final_write_is_rolled_back(app, thread_id, clock, monkeypatch):
+    with app.app_context():
+        recorder = StreamRecorder(thread_id, checkpoint_chars=1000, checkpoint_seconds=60)
+        recorder.append("checkpointed")
+        recorder.save(recorder.take())
+
+        def fail(*args, **kwargs):
+            raise RuntimeError("database is locked")
+
+        monkeypatch.setattr(db.session, "commit", fail)
+        recorder.append(" and lost")
+        recorder.finish()
+        monkeypatch.undo()
+        assert _saved(recorder) == ("checkpointed", "partial")
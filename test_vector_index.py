@@ -0,0 +1,64 @@
+"""Unit tests for the per-user in-memory vector indexes (app/services/vector_index.py)."""
+import numpy as np
+
+from app.extensions import db
+from app.models.note import Note
+from app.services import embedding_service, vector_index
+from app.services.vector_index import VectorIndex, bump_index_version, get_user_index, index_cache_stats
+from conftest import add_notes, add_user
+
+
+def _embed_all(app):
+    with app.app_context():
+        embedding_service.store_embeddings_for_notes(Note.query.all())
+
+
+def test_index_is_served_from_cache_until_the_version_changes(app):
+    user_id = add_user(app)
+    add_notes(app, user_id, "The discriminant of a quadratic decides its real roots.")
+    _embed_all(app)
+    with app.app_context():
+        first = get_user_index(user_id)
+        assert get_user_index(user_id) is first
+        rows = len(first)
+
+    note_id, = add_notes(app, user_id, "Photosynthesis stores light energy as glucose in plants.")
+    _embed_all(app)
+    with app.app_context():
+        rebuilt = get_user_index(user_id)
+        assert rebuilt is not first and rebuilt.version > first.version
+        assert len(rebuilt) > rows
+        assert note_id in set(rebuilt.note_ids.tolist())
+
+
+def test_bumping_the_version_drops_the_cached_index(app):
+    user_id = add_user(app)
+    add_notes(app, user_id, "Newton's second law relates force, mass and acceleration.")
+    _embed_all(app)
+    with app.app_context():
+        first = get_user_index(user_id)
+        bump_index_version(user_id)
+        db.session.commit()
+        assert get_user_index(user_id) is not first
+
+
+def test_cache_stays_within_its_byte_budget(app, monkeypatch):
+    first_user, second_user = add_user(app, "first"), add_user(app, "second")
+    add_notes(app, first_user, "The discriminant of a quadratic decides its real roots.")
+    add_notes(app, second_user, "Photosynthesis stores light energy as glucose in plants.")
+    _embed_all(app)
+    with app.app_context():
+        one_index = get_user_index(first_user).nbytes
+        app.config["VECTOR_INDEX_CACHE_BYTES"] = one_index
+        monkeypatch.setattr(vector_index, "_cache", None)  # Rebuilt with the smaller budget
+
+        get_user_index(first_user)
+        get_user_index(second_user)
+        stats = index_cache_stats()
+    assert stats["entries"] == 1 and stats["weight"] <= one_index
+    assert stats["evictions"] == 1
+
+
+def test_rows_for_prefers_the_latest_duplicate_row():
+    index = VectorIndex(1, 0, np.array([5, 3, 5, 9]), np.array([1, 1, 2, 2]), np.zeros((4, 2), np.float32))
+    np.testing.assert_array_equal(index.rows_for(np.array([5, 3, 9, 7])), [2, 1, 3, -1])
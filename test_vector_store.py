@@ -0,0 +1,54 @@
+"""Unit tests for the packed memory-mapped vector store (app/services/vector_store.py)."""
+import threading
+
+import numpy as np
+
+from app.services.vector_store import PackedVectorStore
+
+
+def _vectors(n, dim=8, seed=0):
+    return np.random.default_rng(seed).standard_normal((n, dim)).astype(np.float32)
+
+
+def test_append_tombstone_and_compact_keep_the_live_rows(tmp_path):
+    store = PackedVectorStore(str(tmp_path), 1, 8)
+    matrix = _vectors(4)
+    store.append([10, 11, 12, 13], [1, 1, 2, 2], matrix)
+    assert store.tombstone(note_ids=[1]) == 0.5
+
+    rows, vectors = store.view()
+    assert list(rows["live"]) == [0, 0, 1, 1]
+    np.testing.assert_array_equal(vectors, matrix)
+
+    generation = store.stamp()[0]
+    store.compact()
+    rows, vectors = store.view()
+    assert store.stamp()[0] == generation + 1
+    assert list(rows["embedding_id"]) == [12, 13]
+    np.testing.assert_array_equal(vectors, matrix[2:])
+
+
+def test_views_stay_readable_while_compaction_swaps_generations(tmp_path):
+    store = PackedVectorStore(str(tmp_path), 1, 8)
+    store.append(list(range(64)), [i // 4 for i in range(64)], _vectors(64))
+    errors = []
+    done = threading.Event()
+
+    def read():
+        try:
+            while not done.is_set():
+                rows, vectors = store.view()
+                assert len(rows) == len(vectors) == 64
+                float(vectors.sum())
+        except Exception as e:
+            errors.append(e)
+
+    readers = [threading.Thread(target=read) for _ in range(4)]
+    for thread in readers:
+        thread.start()
+    for _ in range(200):
+        store.compact()
+    done.set()
+    for thread in readers:
+        thread.join(5)
+    assert errors == []
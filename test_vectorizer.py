@@ -0,0 +1,60 @@
+"""Unit tests for the deterministic hashing vectorizer (app/services/vectorizer.py)."""
+import hashlib
+import os
+import subprocess
+import sys
+
+import numpy as np
+
+from app.services.vectorizer import HashingVectorizer
+
+TEXTS = ["二次方程 判别式", "Quadratic discriminant b² - 4ac", "Photosynthèse et lumière", ""]
+
+_DIGEST_SCRIPT = """
+import hashlib, sys
+from app.services.vectorizer import HashingVectorizer
+texts = sys.argv[1:]
+print(hashlib.sha256(HashingVectorizer(dim=64).transform(texts).tobytes()).hexdigest())
+"""
+
+
+def test_vectors_are_identical_across_processes():
+    # Python's own hash() is salted per process; the vectorizer's features must not be
+    root = os.path.dirname(os.path.abspath(__file__))
+    digests = set()
+    for seed in ("1", "2"):
+        env = {**os.environ, "PYTHONHASHSEED": seed, "PYTHONPATH": root}
+        out = subprocess.run([sys.executable, "-c", _DIGEST_SCRIPT, *TEXTS], env=env, cwd=root,
+                             capture_output=True, text=True, check=True)
+        digests.add(out.stdout.strip())
+    local = hashlib.sha256(HashingVectorizer(dim=64).transform(TEXTS).tobytes()).hexdigest()
+    assert digests == {local}
+
+
+def test_batch_matches_one_text_at_a_time():
+    vectorizer = HashingVectorizer(dim=128)
+    batch = vectorizer.transform(TEXTS)
+    singles = np.vstack([vectorizer.transform([t]) for t in TEXTS])
+    np.testing.assert_array_equal(batch, singles)
+
+
+def test_rows_are_unit_length_and_empty_text_is_zero():
+    matrix = HashingVectorizer(dim=128).transform(TEXTS)
+    assert matrix.shape == (4, 128) and matrix.dtype == np.float32
+    np.testing.assert_allclose(np.linalg.norm(matrix[:3], axis=1), 1.0, rtol=1e-6)
+    assert not matrix[3].any()
+    assert HashingVectorizer(dim=128).transform([]).shape == (0, 128)
+
+
+def test_case_is_ignored_and_shared_cjk_terms_score_higher():
+    vectorizer = HashingVectorizer()
+    upper, lower = vectorizer.transform(["Quadratic Discriminant", "quadratic discriminant"])
+    np.testing.assert_array_equal(upper, lower)
+
+    query, related, unrelated = vectorizer.transform(["判别式", "一元二次方程的判别式", "光合作用的条件"])
+    assert query @ related > query @ unrelated
+
+
+def test_version_names_the_revision_and_dimension():
+    assert HashingVectorizer(dim=256).version.endswith("-256")
+    assert HashingVectorizer(dim=256).version != HashingVectorizer(dim=384).version